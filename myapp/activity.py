@@ -0,0 +1,223 @@
+"""
+Coalesced user activity tracking
+
+Every authenticated request calls record_activity(), which only touches a
+per-process buffer. A background thread in each process flushes it every
+ACTIVITY_FLUSH_INTERVAL seconds (default 300), off the request path and
+whether or not more requests arrive: one batched UPDATE of
+UserProfile.last_seen_at for every user seen since the last flush, and one
+bulk INSERT of (date, user) rows into DailyActiveUser for users not yet
+recorded that day. So a user's activity costs at most one write per interval
+per process, and DAU/WAU/MAU and retention become counts over a small
+(date, user) table instead of scans of the request logs.
+
+A process that exits normally (a worker recycled or shut down) flushes from
+an atexit hook, and the flush_activity job flushes the scheduler process's
+own buffer. Only a process killed outright loses its last interval. A flush
+that fails puts the buffer back for the next one.
+
+ACTIVITY_FLUSH_THREAD = False starts neither the thread nor the atexit hook
+(the settings turn it off for the test runner), so the buffer is only
+written by explicit flush_activity() calls.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_SUMMARY_CACHE_KEY = 'activity_summary'
+
+_lock = threading.Lock()
+_last_seen = {}        # user_id -> latest activity time since the last flush
+_pending_days = set()  # (date, user_id) not yet written
+_recorded_days = set()  # (date, user_id) already written by this process
+_flusher_pid = None    # the process the flush thread was started in
+
+
+def flush_interval():
+    return getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', 300)
+
+
+def flush_thread_enabled():
+    return getattr(settings, 'ACTIVITY_FLUSH_THREAD', True)
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(max(flush_interval(), 1))
+        try:
+            flush_activity()
+        except Exception:
+            # flush_activity() put the buffer back; the next flush retries it
+            logger.exception("Flushing user activity failed")
+        finally:
+            # This thread's own connections; don't hold them between flushes
+            connections.close_all()
+
+
+def _start_flusher():
+    """Start the flush thread once per process (again after a fork)"""
+    global _flusher_pid
+
+    if _flusher_pid == os.getpid() or not flush_thread_enabled():
+        return
+    _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_periodically, name='activity-flush', daemon=True).start()
+    atexit.register(_flush_at_exit)
+
+
+def _flush_at_exit():
+    try:
+        flush_activity()
+    except Exception:
+        logger.exception("Flushing user activity at exit failed")
+
+
+def record_activity(user_id, now=None):
+    now = now or timezone.now()
+    day = timezone.localdate(now)
+    with _lock:
+        _last_seen[user_id] = now
+        if (day, user_id) not in _recorded_days:
+            _pending_days.add((day, user_id))
+        _start_flusher()
+
+
+def flush_activity():
+    """Write buffered activity in batches; returns the number of users flushed"""
+    from django.contrib.auth.models import User
+    from .models import DailyActiveUser, UserProfile
+
+    with _lock:
+        last_seen = dict(_last_seen)
+        days = set(_pending_days)
+        _last_seen.clear()
+        _pending_days.clear()
+        # Only today's (and yesterday's, around midnight) rows can recur
+        cutoff = timezone.localdate() - timedelta(days=1)
+        _recorded_days.difference_update({key for key in _recorded_days if key[0] < cutoff})
+
+    user_ids = list(last_seen)
+    try:
+        with transaction.atomic():
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                UserProfile.objects.filter(user_id__in=chunk).update(
+                    last_seen_at=Case(
+                        *[When(user_id=user_id, then=Value(last_seen[user_id])) for user_id in chunk],
+                        output_field=DateTimeField(),
+                    )
+                )
+            # Users deleted since their request would fail the whole batch at commit
+            day_user_ids = list({user_id for _, user_id in days})
+            existing = set()
+            for start in range(0, len(day_user_ids), 500):
+                existing.update(
+                    User.objects.filter(id__in=day_user_ids[start:start + 500]).values_list('id', flat=True)
+                )
+            DailyActiveUser.objects.bulk_create(
+                [DailyActiveUser(date=day, user_id=user_id) for day, user_id in days if user_id in existing],
+                batch_size=500,
+                ignore_conflicts=True,
+            )
+            # Until the rows are committed, a rollback must leave the days to write again
+            transaction.on_commit(lambda: _mark_recorded(days))
+    except Exception:
+        _restore(last_seen, days)
+        raise
+    return len(user_ids)
+
+
+def _mark_recorded(days):
+    with _lock:
+        _recorded_days.update(days)
+
+
+def _restore(last_seen, days):
+    """Put a failed flush back into the buffer, keeping anything newer recorded since"""
+    with _lock:
+        for user_id, seen in last_seen.items():
+            _last_seen[user_id] = max(seen, _last_seen.get(user_id, seen))
+        _pending_days.update(days - _recorded_days)
+
+
+class ActivityMiddleware:
+    """Record activity for authenticated requests; goes after AuthenticationMiddleware"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            record_activity(user.pk)
+        return response
+
+
+# ------------------------------------------------------------
+# Metrics
+# ------------------------------------------------------------
+
+def active_user_count(start, end):
+    """Distinct users active between two dates, inclusive"""
+    from .models import DailyActiveUser
+
+    return DailyActiveUser.objects.filter(date__gte=start, date__lte=end).values('user_id').distinct().count()
+
+
+def retention(cohort_date, offsets=(1, 7, 30)):
+    """
+    Share of users who joined on cohort_date that were active again
+    N days later, as {N: fraction}
+    """
+    from django.contrib.auth.models import User
+    from .models import DailyActiveUser
+
+    # A range on date_joined can use its index, unlike date_joined__date
+    start = timezone.make_aware(datetime.combine(cohort_date, datetime.min.time()))
+    cohort = User.objects.filter(
+        date_joined__gte=start, date_joined__lt=start + timedelta(days=1),
+    ).values('id')
+    size = cohort.count()
+    result = {}
+    for offset in offsets:
+        if not size:
+            result[offset] = None
+            continue
+        returned = DailyActiveUser.objects.filter(
+            date=cohort_date + timedelta(days=offset), user_id__in=cohort
+        ).count()
+        result[offset] = returned / size
+    return result
+
+
+def get_activity_summary():
+    """DAU/WAU/MAU for today and the retention of last month's cohort, cached briefly for the control panel"""
+    summary = cache.get(ACTIVITY_SUMMARY_CACHE_KEY)
+    if summary is None:
+        today = timezone.localdate()
+        summary = {
+            'dau': active_user_count(today, today),
+            'wau': active_user_count(today - timedelta(days=6), today),
+            'mau': active_user_count(today - timedelta(days=29), today),
+        }
+        summary['stickiness'] = round(summary['dau'] / summary['mau'] * 100) if summary['mau'] else 0
+        # The most recent signup day whose 30-day mark has already passed
+        summary['cohort_date'] = today - timedelta(days=31)
+        summary['retention'] = {
+            f'd{offset}': None if share is None else round(share * 100)
+            for offset, share in retention(summary['cohort_date']).items()
+        }
+        cache.set(ACTIVITY_SUMMARY_CACHE_KEY, summary, 60)
+    return summary
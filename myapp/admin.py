@@ -1,11 +1,106 @@
-from django.contrib import admin
-from .models import Food, Consume, UserProfile, SubscriptionPlan, SubscriptionPurchase, PaymentLog, WeightLog
+from django.contrib import admin, messages
+from django.contrib.auth.models import User
+from django.http import QueryDict
+from .models import Food, Consume, UserProfile, SubscriptionPlan, SubscriptionPurchase, PaymentLog, WeightLog, ScheduledJob, JobRun, UserDeletion, WebhookEvent, AuditLog, ConsumeArchiveDay, EnergyEstimate, FoodServingUnit
+from .partitions import is_partitioned, partition_aliases, partition_for_user
 
 # Register your models here.
-admin.site.register(Food)
-admin.site.register(Consume)
 admin.site.register(UserProfile)
-admin.site.register(WeightLog)
+
+
+class PartitionedAdminMixin:
+    """
+    With the food log partitioned (partitions.py), rows can only be listed
+    one user's partition at a time: the changelist needs a user filter
+    (?user__id__exact=<id>), which change views keep in their
+    _changelist_filters. Without one it lists nothing instead of the
+    unpartitioned table in default.
+    """
+    USER_FILTER = 'user__id__exact'
+
+    def filtered_user_id(self, request):
+        user_id = request.GET.get(self.USER_FILTER)
+        if user_id is None:
+            preserved = QueryDict(request.GET.get('_changelist_filters', ''))
+            user_id = preserved.get(self.USER_FILTER)
+        return int(user_id) if user_id and user_id.isdigit() else None
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if not is_partitioned(self.model):
+            return queryset
+        user_id = self.filtered_user_id(request)
+        if user_id is None:
+            return queryset.using(partition_aliases()[0]).none()
+        return queryset.using(partition_for_user(user_id)).filter(user_id=user_id)
+
+    def lookup_allowed(self, lookup, value, request=None):
+        return lookup == self.USER_FILTER or super().lookup_allowed(lookup, value, request)
+
+    def changelist_view(self, request, extra_context=None):
+        if is_partitioned(self.model) and self.filtered_user_id(request) is None:
+            self.message_user(
+                request,
+                f'{self.model._meta.verbose_name_plural.capitalize()} are partitioned by user: '
+                f'add ?{self.USER_FILTER}=<user id> to the address to list one user\'s rows.',
+                messages.WARNING,
+            )
+        return super().changelist_view(request, extra_context)
+
+
+@admin.register(Consume)
+class ConsumeAdmin(PartitionedAdminMixin, admin.ModelAdmin):
+    list_display = ('user', 'food_consumed', 'meal_type', 'servings', 'date_consumed')
+    list_select_related = ('user', 'food_consumed')
+    raw_id_fields = ('user', 'food_consumed')
+
+
+@admin.register(WeightLog)
+class WeightLogAdmin(PartitionedAdminMixin, admin.ModelAdmin):
+    list_display = ('user', 'date', 'weight', 'trend')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+
+
+class FoodServingUnitInline(admin.TabularInline):
+    """Parsed from the serving size on save (see servings.py)"""
+    model = FoodServingUnit
+    extra = 0
+    can_delete = False
+    readonly_fields = ('name', 'grams')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Food)
+class FoodAdmin(admin.ModelAdmin):
+    list_display = ('name', 'serving_size', 'serving_grams', 'calories', 'user')
+    list_select_related = ('user',)
+    search_fields = ('name',)
+    readonly_fields = ('serving_grams',)
+    inlines = [FoodServingUnitInline]
+
+
+class CrossDatabaseUserSearchMixin:
+    """
+    Search audit-database models by username/email. The user table lives in
+    the default database, so user__username can't be joined: look the ids up
+    there first and filter on user_id. Also turns off the automatic
+    select_related() for the user column.
+    """
+    list_select_related = ()
+    user_search_fields = ('username__icontains', 'email__icontains')
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            user_ids = set()
+            for lookup in self.user_search_fields:
+                user_ids.update(User.objects.filter(**{lookup: search_term}).values_list('id', flat=True)[:1000])
+            if user_ids:
+                results |= queryset.filter(user_id__in=user_ids)
+        return results, may_have_duplicates
 
 
 @admin.register(SubscriptionPlan)
@@ -33,10 +128,10 @@ class SubscriptionPlanAdmin(admin.ModelAdmin):
 
 
 @admin.register(SubscriptionPurchase)
-class SubscriptionPurchaseAdmin(admin.ModelAdmin):
+class SubscriptionPurchaseAdmin(CrossDatabaseUserSearchMixin, admin.ModelAdmin):
     list_display = ('user', 'plan', 'status', 'amount', 'start_date', 'end_date', 'created_at')
     list_filter = ('status', 'created_at', 'plan')
-    search_fields = ('user__username', 'user__email', 'stripe_session_id')
+    search_fields = ('stripe_session_id',)
     readonly_fields = ('stripe_session_id', 'stripe_payment_intent_id', 'created_at', 'updated_at')
     date_hierarchy = 'created_at'
     
@@ -66,10 +161,10 @@ class SubscriptionPurchaseAdmin(admin.ModelAdmin):
 
 
 @admin.register(PaymentLog)
-class PaymentLogAdmin(admin.ModelAdmin):
+class PaymentLogAdmin(CrossDatabaseUserSearchMixin, admin.ModelAdmin):
     list_display = ('user', 'transaction_type', 'amount', 'status', 'created_at')
     list_filter = ('transaction_type', 'status', 'created_at')
-    search_fields = ('user__username', 'stripe_charge_id')
+    search_fields = ('stripe_charge_id',)
     readonly_fields = ('stripe_charge_id', 'created_at', 'details')
     date_hierarchy = 'created_at'
     
@@ -96,3 +191,76 @@ class PaymentLogAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request):
         # Prevent deletion of payment logs (audit trail)
         return False
+
+
+@admin.register(ScheduledJob)
+class ScheduledJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'schedule', 'is_enabled', 'last_run_at', 'last_status', 'last_duration_ms', 'next_run_at')
+    list_filter = ('is_enabled', 'last_status')
+    readonly_fields = ('last_run_at', 'last_status', 'last_duration_ms', 'locked_by', 'locked_until')
+
+
+@admin.register(JobRun)
+class JobRunAdmin(admin.ModelAdmin):
+    list_display = ('job', 'scheduled_for', 'started_at', 'duration_ms', 'status')
+    list_filter = ('status', 'job')
+    readonly_fields = ('job', 'scheduled_for', 'started_at', 'finished_at', 'duration_ms', 'status', 'result')
+    date_hierarchy = 'started_at'
+
+
+@admin.register(UserDeletion)
+class UserDeletionAdmin(admin.ModelAdmin):
+    list_display = ('username', 'user_id', 'status', 'current_step', 'rows_deleted', 'total_rows', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('username',)
+    readonly_fields = ('user_id', 'username', 'requested_by', 'rows_deleted', 'total_rows', 'error', 'created_at', 'started_at', 'finished_at')
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('stripe_event_id', 'event_type', 'status', 'received_at', 'processed_at')
+    list_filter = ('status', 'event_type')
+    search_fields = ('stripe_event_id',)
+    readonly_fields = ('stripe_event_id', 'event_type', 'payload', 'status', 'error', 'received_at', 'processed_at')
+    date_hierarchy = 'received_at'
+
+
+@admin.register(AuditLog)
+class AuditLogAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'actor_username', 'action', 'target_username')
+    list_filter = ('action',)
+    search_fields = ('actor_username', 'target_username')
+    readonly_fields = ('actor_id', 'actor_username', 'action', 'target_user_id', 'target_username', 'details', 'created_at')
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # Audit trail
+        return False
+
+
+@admin.register(ConsumeArchiveDay)
+class ConsumeArchiveDayAdmin(admin.ModelAdmin):
+    list_display = ('user', 'date', 'entry_count', 'calories', 'archived_at')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user',)
+    # The entries are packed (see archive.py); they can only be read through the app
+    exclude = ('entries',)
+    readonly_fields = ('entry_count', 'calories', 'carbs', 'protein', 'fats', 'food_ids', 'archived_at')
+    date_hierarchy = 'date'
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(EnergyEstimate)
+class EnergyEstimateAdmin(admin.ModelAdmin):
+    list_display = ('user', 'tdee', 'confidence', 'weight_trend', 'target_date', 'suggested_calories', 'updated_at')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user',)
+    # Computed (see energy.py); refreshed shortly after every log and nightly
+    readonly_fields = (
+        'tdee', 'confidence', 'intake_average', 'weight_trend', 'trend_weight', 'days_logged', 'weigh_ins',
+        'suggested_calories', 'target_date', 'computed_for', 'updated_at',
+    )
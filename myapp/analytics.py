@@ -0,0 +1,202 @@
+"""
+Series for the advanced analytics page
+
+Everything is computed from the user's columnar history (history.py). It
+works as an in-memory daily rollup: per-day totals come from one bincount,
+and rolling averages, the weekday/weekend split, meal shares and adherence
+streaks are vectorized operations over those totals. The page therefore
+costs the same few queries however long the history is: the history itself
+(none once cached, otherwise one for the hot log and one for the archive)
+and the weight log for the range.
+
+A day counts as on target when its calories are within
+ANALYTICS_GOAL_TOLERANCE (10%) of the profile's daily goal, the same rule
+the dashboard uses for its goal-met banner.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .downsample import bucket_means
+from .history import FIELDS
+
+DEFAULT_RANGE_DAYS = 90
+# Ten years of days; keeps hand-written ranges from allocating without bound
+MAX_RANGE_DAYS = 3660
+# Earliest day a range may start; rolling windows reach back before the
+# start, which overflows near date.min
+MIN_DATE = date(1900, 1, 1)
+RANGE_PRESETS = {'30': 30, '90': 90, '180': 180, '365': 365}
+RANGE_CHOICES = [('30', '30 days'), ('90', '90 days'), ('180', '6 months'), ('365', '1 year'), ('all', 'All time')]
+
+
+def parse_range(params, first_day, default_days=DEFAULT_RANGE_DAYS, today=None, strict=False):
+    """
+    (start, end, preset) from ?range=30|90|180|365|all, ?days=N or
+    ?start=&end= (YYYY-MM-DD). first_day() gives the start for "all" (None
+    if nothing is logged). Ranges start no earlier than MIN_DATE. Missing
+    values give the last default_days, and so do bad ones unless strict,
+    which raises ValueError for them.
+    """
+    today = today or timezone.localdate()
+    preset = params.get('range', '')
+    if preset == 'all':
+        return max(min(first_day() or today, today), MIN_DATE), today, preset
+    if preset in RANGE_PRESETS:
+        return today - timedelta(days=RANGE_PRESETS[preset] - 1), today, preset
+    try:
+        if 'days' in params:
+            days = min(max(int(params['days']), 1), MAX_RANGE_DAYS)
+            return today - timedelta(days=days - 1), today, ''
+        start = date.fromisoformat(params['start'])
+        end = date.fromisoformat(params.get('end') or today.isoformat())
+    except (KeyError, ValueError, OverflowError) as error:
+        if strict and not isinstance(error, KeyError):
+            raise ValueError('Invalid date range') from error
+        return today - timedelta(days=default_days - 1), today, str(default_days)
+    start, end = sorted((max(start, MIN_DATE), max(end, MIN_DATE)))
+    return max(start, end - timedelta(days=MAX_RANGE_DAYS - 1)), end, ''
+
+
+def _round(values, digits=0):
+    """Rounded list for JSON, with None for days without data"""
+    return [None if np.isnan(value) else round(float(value), digits) for value in values]
+
+
+def _nullable(values):
+    return [None if np.isnan(value) else float(value) for value in values]
+
+
+def _chart(labels, series, goal):
+    """
+    The chart's aligned daily series. Ranges longer than CHART_POINTS days
+    are averaged into equal buckets of days (each bucket is labelled with
+    its first day), so a multi-year range draws as many points as a short one.
+    """
+    size = -(-len(labels) // getattr(settings, 'CHART_POINTS', 200))
+    if size > 1:
+        labels = labels[::size]
+        series = {name: bucket_means(values, size) if values else values for name, values in series.items()}
+    digits = {'calories': 0, 'calories_7': 0, 'calories_30': 0, 'weight': 1, 'weight_trend': 1, 'on_target': 2}
+    chart = {
+        name: [None if value is None else round(value, digits.get(name, 1)) for value in values]
+        for name, values in series.items()
+    }
+    # Days (or buckets) where most days were on target
+    chart['on_target'] = [bool(value and value >= 0.5) for value in chart['on_target']]
+    return {'labels': labels, 'bucket_days': size, 'goal': goal, **chart}
+
+
+def _runs(mask):
+    """(longest run of True, run of True at the end)"""
+    if not mask.any():
+        return 0, 0
+    padded = np.concatenate(([0], mask.astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    lengths = edges[1::2] - edges[::2]
+    current = int(lengths[-1]) if mask[-1] else 0
+    return int(lengths.max()), current
+
+
+def adherence(calories, counts, goal, tolerance):
+    """Goal adherence over the logged days of a range of daily totals"""
+    logged = counts > 0
+    on_target = logged & (np.abs(calories - goal) <= goal * tolerance)
+    longest, current = _runs(on_target)
+    if len(logged) > 1 and not logged[-1]:
+        # The last day (usually today) may just not be logged yet
+        current = _runs(on_target[:-1])[1]
+    days_logged = int(logged.sum())
+    return {
+        'days_on_target': int(on_target.sum()),
+        'days_logged': days_logged,
+        'rate': round(100 * int(on_target.sum()) / days_logged) if days_logged else 0,
+        'longest_streak': longest,
+        'current_streak': current,
+        'on_target': on_target,
+    }
+
+
+def weight_series(user, start, end):
+    """
+    (weights, trends): the last weight logged on each day of the range and
+    the smoothed trend after it (see weight_trend.py), None on other days
+    """
+    from .models import WeightLog
+
+    weights = [None] * ((end - start).days + 1)
+    trends = [None] * len(weights)
+    rows = WeightLog.objects.filter(user=user, date__range=(start, end)).order_by('date', 'id')
+    for day, weight, trend in rows.values_list('date', 'weight', 'trend'):
+        weights[(day - start).days] = weight
+        trends[(day - start).days] = trend
+    return weights, trends
+
+
+def build_analytics(user, profile, history, start, end):
+    """Everything the page shows for days start..end"""
+    from .models import MEAL_TYPE_CHOICES
+
+    goal = profile.daily_calorie_goal or 0
+    tolerance = getattr(settings, 'ANALYTICS_GOAL_TOLERANCE', 0.1)
+    length = (end - start).days + 1
+    labels = [(start + timedelta(days=offset)).isoformat() for offset in range(length)]
+
+    daily = {}
+    rolling = {}
+    for field in FIELDS:
+        daily[field], counts = history.daily_totals(field, start, end)
+        rolling[field] = {window: history.rolling_mean(field, window, start, end) for window in (7, 30)}
+    logged = counts > 0
+    days_logged = int(logged.sum())
+
+    averages = []
+    splits = []
+    for field in FIELDS:
+        last_7, last_30 = _round([rolling[field][7][-1], rolling[field][30][-1]], 1)
+        averages.append({
+            'field': field,
+            'last_7': last_7,
+            'last_30': last_30,
+            'range': round(float(daily[field][logged].mean()), 1) if days_logged else None,
+        })
+        split = history.weekday_split(field, start, end)
+        if split['weekday'] and split['weekend'] is not None:
+            split['difference'] = 100 * (split['weekend'] - split['weekday']) / split['weekday']
+        else:
+            split['difference'] = None
+        splits.append(dict(field=field, **split))
+    meal_labels = dict(MEAL_TYPE_CHOICES)
+    shares = history.meal_shares('calories', start, end)
+    goal_adherence = adherence(daily['calories'], counts, goal, tolerance) if goal else None
+    on_target = goal_adherence.pop('on_target') if goal else None
+
+    weights, trends = weight_series(user, start, end)
+    return {
+        'start': start,
+        'end': end,
+        'range_choices': RANGE_CHOICES,
+        'days_logged': days_logged,
+        'averages': averages,
+        'weekday_split': splits,
+        'meal_shares': [
+            {'meal': meal_labels[meal], 'percent': round(share * 100, 1)} for meal, share in shares.items()
+        ],
+        'adherence': goal_adherence,
+        'calorie_goal': goal,
+        'goal_tolerance': round(tolerance * 100),
+        'weights_logged': sum(weight is not None for weight in weights),
+        'chart': _chart(labels, {
+            'calories': [float(value) if count else None for value, count in zip(daily['calories'], counts)],
+            'calories_7': _nullable(rolling['calories'][7]),
+            'calories_30': _nullable(rolling['calories'][30]),
+            'protein_7': _nullable(rolling['protein'][7]),
+            'carbs_7': _nullable(rolling['carbs'][7]),
+            'fats_7': _nullable(rolling['fats'][7]),
+            'on_target': on_target.astype(float).tolist() if goal else [],
+            'weight': weights,
+            'weight_trend': trends,
+        }, goal),
+    }
@@ -0,0 +1,327 @@
+"""
+Cold storage for old food log entries
+
+Dashboard, planner and goal queries only look at the last few weeks, but
+Consume kept every entry forever. The archive_food_log job moves entries
+older than CONSUME_ARCHIVE_AFTER_DAYS into ConsumeArchiveDay: one row per
+user and day, with the day's entries packed into a small binary blob
+(ENTRY below, about 50 bytes an entry) and the day's nutrition totals
+alongside. The hot table keeps only recent entries, so it and its indexes
+stay small enough to live in the page cache.
+
+Archiving is a move, not a deletion. The hot rows are removed without the
+Consume signals, so lifetime stats, streaks and achievements are untouched.
+The lifetime stats helpers in stats.py count archived days as well.
+Archived entries keep the food's nutrition from when they were archived, so
+later edits or deletion of a food don't rewrite old history.
+
+iter_entries() and recent_entries() read across both stores. Archived
+entries come back as unsaved Consume instances with their food attached,
+so templates and exports treat them like any other entry.
+"""
+import heapq
+import struct
+import time
+from collections import namedtuple
+from datetime import timedelta
+from itertools import groupby, islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .partitions import model_databases
+
+# Dashboard, planner and goal periods reach back at most a month
+MIN_ARCHIVE_AFTER_DAYS = 35
+FORMAT_VERSION = 1
+# food id, meal type, servings, time of day in microseconds, then calories,
+# carbs, protein and fats per serving, then the byte length of the notes
+# that follow (NO_NOTES for None)
+ENTRY = struct.Struct('<qBdQffffI')
+NO_NOTES = 0xFFFFFFFF
+
+PackedEntry = namedtuple(
+    'PackedEntry', 'food_id meal_type servings time calories carbs protein fats notes'
+)
+
+
+def archive_after_days():
+    return max(getattr(settings, 'CONSUME_ARCHIVE_AFTER_DAYS', 180), MIN_ARCHIVE_AFTER_DAYS)
+
+
+def archive_cutoff(today=None):
+    """Entries dated before this day get archived"""
+    return (today or timezone.localdate()) - timedelta(days=archive_after_days())
+
+
+# ------------------------------------------------------------
+# Packing
+# ------------------------------------------------------------
+
+def _meal_types():
+    from .models import MEAL_TYPE_CHOICES
+
+    return [value for value, _ in MEAL_TYPE_CHOICES]
+
+
+def _micros(value):
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * 1_000_000 + value.microsecond
+
+
+def _time(micros):
+    from datetime import time as time_of_day
+
+    seconds, microsecond = divmod(micros, 1_000_000)
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    return time_of_day(hour, minute, second, microsecond)
+
+
+def pack_entries(entries):
+    meal_types = _meal_types()
+    parts = [bytes([FORMAT_VERSION])]
+    for entry in entries:
+        notes = None if entry.notes is None else entry.notes.encode()
+        parts.append(ENTRY.pack(
+            entry.food_id,
+            # Anything outside the choices is stored as the default, snack
+            meal_types.index(entry.meal_type) if entry.meal_type in meal_types else meal_types.index('snack'),
+            entry.servings,
+            _micros(entry.time),
+            entry.calories, entry.carbs, entry.protein, entry.fats,
+            NO_NOTES if notes is None else len(notes),
+        ))
+        if notes:
+            parts.append(notes)
+    return b''.join(parts)
+
+
+def unpack_entries(data):
+    data = bytes(data)
+    if not data:
+        return []
+    if data[0] != FORMAT_VERSION:
+        raise ValueError(f'Unknown archive format {data[0]}')
+    meal_types = _meal_types()
+    entries = []
+    offset = 1
+    while offset < len(data):
+        food_id, meal, servings, micros, calories, carbs, protein, fats, length = ENTRY.unpack_from(data, offset)
+        offset += ENTRY.size
+        notes = None
+        if length != NO_NOTES:
+            notes = data[offset:offset + length].decode()
+            offset += length
+        entries.append(PackedEntry(
+            food_id, meal_types[meal], servings, _time(micros), calories, carbs, protein, fats, notes
+        ))
+    return entries
+
+
+def _entry_key(entry):
+    # Nutrition is left out: it went through float32 once archived
+    return entry.food_id, entry.meal_type, entry.servings, entry.time, entry.notes
+
+
+def _food_ids(text):
+    return {int(food_id) for food_id in text.split(',') if food_id}
+
+
+# ------------------------------------------------------------
+# Archiving
+# ------------------------------------------------------------
+
+def _merge_day(user_id, day, entries):
+    """Add entries to the user's archive row for day"""
+    from .models import ConsumeArchiveDay
+
+    archived = ConsumeArchiveDay.objects.select_for_update().filter(user_id=user_id, date=day).first()
+    if archived is None:
+        archived = ConsumeArchiveDay(user_id=user_id, date=day)
+        existing = []
+    else:
+        existing = unpack_entries(archived.entries)
+    # An earlier run may have archived these already but stopped before
+    # deleting them from the hot table
+    seen = {_entry_key(entry) for entry in existing}
+    entries = [entry for entry in entries if _entry_key(entry) not in seen]
+    if not entries:
+        return
+    for entry in entries:
+        archived.entry_count += 1
+        archived.calories += entry.calories * entry.servings
+        archived.carbs += entry.carbs * entry.servings
+        archived.protein += entry.protein * entry.servings
+        archived.fats += entry.fats * entry.servings
+    food_ids = _food_ids(archived.food_ids) | {entry.food_id for entry in entries}
+    archived.food_ids = ',' + ''.join(f'{food_id},' for food_id in sorted(food_ids))
+    archived.entries = pack_entries(existing + entries)
+    archived.save()
+
+
+def archive_user_entries(user_id, using, cutoff):
+    """Move one user's entries dated before cutoff from database `using` to the archive"""
+    from .models import Consume
+
+    hot = Consume._base_manager.using(using).filter(user_id=user_id, date_consumed__lt=cutoff)
+    rows = list(hot.order_by('date_consumed', 'time_consumed', 'pk').values_list(
+        'pk', 'date_consumed',
+        'food_consumed_id', 'meal_type', 'servings', 'time_consumed',
+        'food_consumed__calories', 'food_consumed__carbs', 'food_consumed__protein', 'food_consumed__fats',
+        'notes',
+    ))
+    if not rows:
+        return 0
+    # The archive commits first (it's the inner transaction when the food log
+    # is in another database), so a failure can only leave rows in both
+    # places, which the next run merges away
+    with transaction.atomic(using=using):
+        with transaction.atomic():
+            for day, day_rows in groupby(rows, key=lambda row: row[1]):
+                _merge_day(user_id, day, [PackedEntry(*row[2:]) for row in day_rows])
+        pks = [row[0] for row in rows]
+        for start in range(0, len(pks), 500):
+            Consume._base_manager.using(using).filter(pk__in=pks[start:start + 500])._raw_delete(using)
+    return len(rows)
+
+
+def archive_old_entries(time_budget=None):
+    """Archive everything past the horizon, user by user; returns (users, entries)"""
+    from .models import Consume
+
+    if time_budget is None:
+        time_budget = getattr(settings, 'CONSUME_ARCHIVE_TIME_BUDGET', 300)
+    deadline = time.monotonic() + time_budget
+    cutoff = archive_cutoff()
+    users = entries = 0
+    for using in model_databases(Consume):
+        old = Consume._base_manager.using(using).filter(date_consumed__lt=cutoff)
+        for user_id in list(old.order_by().values_list('user_id', flat=True).distinct()):
+            if time.monotonic() >= deadline:
+                return users, entries
+            entries += archive_user_entries(user_id, using, cutoff)
+            users += 1
+    return users, entries
+
+
+# ------------------------------------------------------------
+# Reading across hot and archived entries
+# ------------------------------------------------------------
+
+def _archived_consumes(user_id, days):
+    """Unsaved Consume instances for the entries of the given archive rows"""
+    from .models import Consume, Food
+
+    food_field = Consume._meta.get_field('food_consumed')
+    days = iter(days)
+    while True:
+        chunk = [(day.date, unpack_entries(day.entries)) for day in islice(days, 100)]
+        if not chunk:
+            return
+        food_ids = {entry.food_id for _, entries in chunk for entry in entries}
+        names = dict(Food.objects.filter(id__in=food_ids).values_list('id', 'name'))
+        for day, entries in chunk:
+            for entry in entries:
+                consume = Consume(
+                    user_id=user_id,
+                    food_consumed_id=entry.food_id,
+                    meal_type=entry.meal_type,
+                    servings=entry.servings,
+                    date_consumed=day,
+                    time_consumed=entry.time,
+                    notes=entry.notes,
+                )
+                food_field.set_cached_value(consume, Food(
+                    id=entry.food_id,
+                    name=names.get(entry.food_id, 'Deleted food'),
+                    calories=round(entry.calories),
+                    carbs=entry.carbs,
+                    protein=entry.protein,
+                    fats=entry.fats,
+                ))
+                yield consume
+
+
+def _entry_order(consume):
+    return consume.date_consumed, consume.time_consumed
+
+
+def iter_entries(user_id):
+    """The user's whole food log, hot and archived, oldest first"""
+    from .models import Consume, ConsumeArchiveDay
+
+    hot = (
+        Consume.objects.filter(user_id=user_id)
+        .select_related('food_consumed')
+        .order_by('date_consumed', 'time_consumed', 'pk')
+        .iterator(chunk_size=500)
+    )
+    days = ConsumeArchiveDay.objects.filter(user_id=user_id).order_by('date').iterator(chunk_size=100)
+    return heapq.merge(_archived_consumes(user_id, days), hot, key=_entry_order)
+
+
+def recent_entries(user_id, limit=10):
+    """The user's latest entries, newest first, reaching into the archive if needed"""
+    from .models import Consume, ConsumeArchiveDay
+
+    recent = list(
+        Consume.objects.filter(user_id=user_id)
+        .select_related('food_consumed')
+        .order_by('-date_consumed', '-time_consumed')[:limit]
+    )
+    if len(recent) < limit:
+        # Every archive row has at least one entry
+        days = ConsumeArchiveDay.objects.filter(user_id=user_id).order_by('-date')[:limit]
+        recent = sorted(recent + list(_archived_consumes(user_id, days)), key=_entry_order, reverse=True)[:limit]
+    return recent
+
+
+# ------------------------------------------------------------
+# Lifetime stats (see stats.py)
+# ------------------------------------------------------------
+
+def has_archived_day(user_id, day):
+    from .models import ConsumeArchiveDay
+
+    return ConsumeArchiveDay.objects.filter(user_id=user_id, date=day).exists()
+
+
+def has_archived_food(user_id, food_id):
+    from .models import ConsumeArchiveDay
+
+    return ConsumeArchiveDay.objects.filter(user_id=user_id, food_ids__contains=f',{food_id},').exists()
+
+
+def add_archived_totals(user_id, totals):
+    """Extend lifetime totals computed over the hot table with the archived days"""
+    from .models import Consume, ConsumeArchiveDay
+
+    days = list(
+        ConsumeArchiveDay.objects.filter(user_id=user_id).values_list('date', 'entry_count', 'calories', 'food_ids')
+    )
+    if not days:
+        return totals
+    hot = Consume.objects.filter(user_id=user_id).order_by()
+    dates = set(hot.values_list('date_consumed', flat=True).distinct())
+    food_ids = set(hot.values_list('food_consumed_id', flat=True).distinct())
+    for day, entry_count, calories, day_food_ids in days:
+        dates.add(day)
+        food_ids |= _food_ids(day_food_ids)
+        totals['total_entries'] += entry_count
+        totals['total_calories'] = (totals['total_calories'] or 0) + calories
+    totals['days_logged'] = len(dates)
+    totals['distinct_foods'] = len(food_ids)
+    totals['first_log_date'] = min(dates)
+    totals['last_log_date'] = max(dates)
+    return totals
+
+
+def archived_date_range(user_id):
+    """(first, last) archived day, or (None, None)"""
+    from django.db.models import Max, Min
+
+    from .models import ConsumeArchiveDay
+
+    result = ConsumeArchiveDay.objects.filter(user_id=user_id).aggregate(first=Min('date'), last=Max('date'))
+    return result['first'], result['last']
@@ -0,0 +1,15 @@
+"""
+Admin action audit trail, stored in the audit database (see routers.py)
+"""
+from .models import AuditLog
+
+
+def log_admin_action(actor, action, target=None, **details):
+    AuditLog.objects.create(
+        actor_id=actor.pk if actor else None,
+        actor_username=actor.username if actor else '',
+        action=action,
+        target_user_id=target.pk if target else None,
+        target_username=target.username if target else '',
+        details=details,
+    )
@@ -0,0 +1,19 @@
+"""
+PostgreSQL backend for a separate audit database (POSTGRES_AUDIT_DB)
+
+The audit models refer to User and SubscriptionPlan, whose tables are in the
+main database (see routers.py). Their early migrations still create those
+foreign keys with constraints, which PostgreSQL refuses to create without the
+referenced tables (SQLite doesn't check). This backend creates no foreign key
+constraints, so the audit database can be migrated from scratch; the signals
+and the deletion pipeline keep the references consistent instead.
+"""
+from django.db.backends.postgresql import base, features
+
+
+class DatabaseFeatures(features.DatabaseFeatures):
+    supports_foreign_keys = False
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    features_class = DatabaseFeatures
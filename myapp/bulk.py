@@ -0,0 +1,124 @@
+"""
+Bulk user actions for the control panel
+
+Each action runs as set-based UPDATEs (and bulk_create for subscription
+records) over chunks of user ids, one transaction per chunk, instead of
+loading and saving every user. queryset.update() skips model signals, so the
+platform counters are adjusted here directly.
+
+Users queued for deletion stay inactive and non-premium, as in the
+single-user views: activate and grant_premium skip them and return their
+ids alongside the count.
+"""
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import router, transaction
+from django.utils import timezone
+
+from .deletion import pending_deletion_ids, queue_user_deletions
+from .models import SubscriptionPurchase, UserProfile
+from .stats import adjust_platform_stats
+
+BULK_CHUNK_SIZE = 1000
+
+BULK_ACTIONS = [
+    ('activate', 'Activate'),
+    ('deactivate', 'Deactivate'),
+    ('grant_premium', 'Grant premium'),
+    ('revoke_premium', 'Revoke premium'),
+    ('delete', 'Delete'),
+]
+
+
+def chunks(ids, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def allowed_user_ids(acting_user, user_ids):
+    """
+    Drop ids the acting admin may not touch in bulk: themselves, and
+    superusers unless they are a superuser too (same rules as the single-user views).
+    """
+    ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id != acting_user.id]
+    if not acting_user.is_superuser:
+        protected = set()
+        for chunk in chunks(ids):
+            protected.update(User.objects.filter(id__in=chunk, is_superuser=True).values_list('id', flat=True))
+        ids = [user_id for user_id in ids if user_id not in protected]
+    return ids
+
+
+def _skip_pending_deletions(chunk, skipped):
+    pending = pending_deletion_ids(chunk)
+    skipped.extend(user_id for user_id in chunk if user_id in pending)
+    return [user_id for user_id in chunk if user_id not in pending]
+
+
+def bulk_set_active(user_ids, is_active):
+    """Returns (changed, skipped ids); only activation skips anyone"""
+    changed = 0
+    skipped = []
+    for chunk in chunks(user_ids):
+        with transaction.atomic():
+            if is_active:
+                chunk = _skip_pending_deletions(chunk, skipped)
+            changed += User.objects.filter(id__in=chunk).exclude(is_active=is_active).update(is_active=is_active)
+    adjust_platform_stats(active_users=changed if is_active else -changed)
+    return changed, skipped
+
+
+def bulk_grant_premium(user_ids, plan):
+    """Returns (granted, skipped ids)"""
+    start_date = timezone.now()
+    end_date = start_date + timedelta(days=plan.duration_days)
+    granted = 0
+    newly_premium = 0
+    skipped = []
+    purchases_db = router.db_for_write(SubscriptionPurchase)
+    for chunk in chunks(user_ids):
+        # Purchase records may live in the audit database: a transaction on
+        # each, the purchases' innermost so they commit first. A failure
+        # before that rolls back both, so no one is granted premium without
+        # a purchase record.
+        with transaction.atomic(), transaction.atomic(using=purchases_db):
+            chunk = _skip_pending_deletions(chunk, skipped)
+            profiles = UserProfile.objects.filter(user_id__in=chunk)
+            newly_granted = profiles.filter(is_premium=False).update(is_premium=True, premium_until=end_date)
+            profiles.filter(is_premium=True).update(premium_until=end_date)
+            granted_ids = list(profiles.values_list('user_id', flat=True))
+            SubscriptionPurchase.objects.bulk_create([
+                SubscriptionPurchase(
+                    user_id=user_id,
+                    plan=plan,
+                    status='active',
+                    amount=0,  # Admin assigned, no payment
+                    start_date=start_date,
+                    end_date=end_date,
+                )
+                for user_id in granted_ids
+            ])
+        newly_premium += newly_granted
+        granted += len(granted_ids)
+    adjust_platform_stats(premium_users=newly_premium)
+    return granted, skipped
+
+
+def bulk_revoke_premium(user_ids):
+    revoked = 0
+    for chunk in chunks(user_ids):
+        with transaction.atomic():
+            revoked += UserProfile.objects.filter(user_id__in=chunk, is_premium=True).update(
+                is_premium=False, premium_until=None
+            )
+    adjust_platform_stats(premium_users=-revoked)
+    return revoked
+
+
+def bulk_delete_users(user_ids, requested_by=None):
+    """Deactivate and queue the users for background deletion (see deletion.py)"""
+    queued = 0
+    for chunk in chunks(user_ids):
+        queued += len(queue_user_deletions(chunk, requested_by))
+    return queued
@@ -0,0 +1,148 @@
+"""
+JSON data for the dashboard charts
+
+The dashboard used to build its calorie, weight and macro chart data on
+every render and inline it into the page, although the charts sit below the
+fold. It now renders without them. Each chart fetches /charts/<series>/
+after the page has loaded, and can ask for a longer range (?days=N or the
+analytics page's ?range= and ?start=&end=); a malformed range or point
+count gets a 400.
+
+Series longer than ?points= (default CHART_POINTS) are downsampled with
+LTTB (see downsample.py), so a chart of years of history sends and draws no
+more points than one of two weeks. The JSON for each version, range and
+point count is cached, so redrawing a long range doesn't downsample again.
+
+Responses carry an ETag built from version numbers that change whenever
+the data behind them does:
+- calories and macros use the history version (see history.py)
+- weight uses a per-user version bumped by the WeightLog signals
+Checking If-None-Match costs one cache lookup and no queries. Responses are
+private and must be revalidated, so a chart never shows data older than
+the last write.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .analytics import parse_range, weight_series
+from .downsample import downsample
+from .history import FIELDS, bump_version, get_history, history_version
+
+WEIGHT_VERSION_KEY = 'weight_version:{}'
+DATA_CACHE_KEY = 'chart_data:{}:{}'
+# LTTB keeps the first and last points and needs a bucket between them
+MIN_POINTS = 3
+MAX_POINTS = 2000
+
+# Series name: default range in days
+SERIES = {
+    'calories': 14,
+    'weight': 30,
+    'macros': 1,
+}
+
+
+def weight_version(user_id):
+    key = WEIGHT_VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    return version if version is not None else bump_version(key)
+
+
+def invalidate_weight_series(user_id):
+    bump_version(WEIGHT_VERSION_KEY.format(user_id))
+
+
+def _first_weight_day(user):
+    from django.db.models import Min
+
+    from .models import WeightLog
+
+    return WeightLog.objects.filter(user=user).aggregate(first=Min('date'))['first']
+
+
+def series_range(series, user, params):
+    """(start, end) of the chart; raises ValueError for a bad ?days= or ?start=&end="""
+    if series == 'weight':
+        first_day = lambda: _first_weight_day(user)
+    else:
+        first_day = lambda: get_history(user.pk).first_day()
+    start, end, _ = parse_range(params, first_day, default_days=SERIES[series], strict=True)
+    return start, end
+
+
+def series_points(params):
+    """Most points to send, from ?points=; raises ValueError if it isn't a number"""
+    try:
+        points = int(params.get('points', getattr(settings, 'CHART_POINTS', 200)))
+    except ValueError as error:
+        raise ValueError('Invalid point count') from error
+    return min(max(points, MIN_POINTS), MAX_POINTS)
+
+
+def series_etag(series, user, start, end, points):
+    if series == 'weight':
+        version = weight_version(user.pk)
+    else:
+        version = history_version(user.pk)
+    return f'"{series}-{version}-{start.isoformat()}-{end.isoformat()}-{points}"'
+
+
+def series_data(series, user, start, end, points):
+    """The JSON for a chart, cached under its ETag"""
+    key = DATA_CACHE_KEY.format(user.pk, series_etag(series, user, start, end, points).strip('"'))
+    data = cache.get(key)
+    if data is None:
+        data = BUILDERS[series](user, start, end, points)
+        cache.set(key, data, getattr(settings, 'CHART_DATA_CACHE_SECONDS', 24 * 60 * 60))
+    return data
+
+
+def _daily_series(start, end, values, points, **aligned):
+    """
+    Dates, labels and values of a daily series, downsampled to at most
+    points. aligned series are sent for the same days as values.
+    """
+    label_format = '%b %d' if (end - start).days < 365 else '%b %d, %Y'
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    keep = downsample(values, points)
+    return {
+        'dates': [days[i].isoformat() for i in keep],
+        'labels': [days[i].strftime(label_format) for i in keep],
+        'values': [values[i] for i in keep],
+        **{name: [series[i] for i in keep] for name, series in aligned.items()},
+        'downsampled': len(keep) < len(values),
+    }
+
+
+def calorie_data(user, start, end, points):
+    """Calories per day, None on days without entries"""
+    totals, counts = get_history(user.pk).daily_totals('calories', start, end)
+    values = [round(float(total)) if count else None for total, count in zip(totals, counts)]
+    return _daily_series(start, end, values, points)
+
+
+def weight_data(user, start, end, points):
+    """The last weight of each day and the trend after it, None on days without one"""
+    weights, trends = weight_series(user, start, end)
+    return _daily_series(start, end, weights, points, trend=[
+        None if trend is None else round(trend, 2) for trend in trends
+    ])
+
+
+def macro_data(user, start, end, points):
+    """Total carbs, protein and fats over the range, in grams"""
+    history = get_history(user.pk)
+    totals = {}
+    for field in FIELDS[1:]:
+        day_totals, _ = history.daily_totals(field, start, end)
+        totals[field] = round(float(day_totals.sum()), 1)
+    return {'start': start.isoformat(), 'end': end.isoformat(), **totals}
+
+
+BUILDERS = {
+    'calories': calorie_data,
+    'weight': weight_data,
+    'macros': macro_data,
+}
@@ -0,0 +1,28 @@
+"""
+System checks for deployment settings the app relies on
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Cache backends that keep their data inside one process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_session_cache(app_configs, **kwargs):
+    """cached_db sessions must live in a cache every worker shares"""
+    if settings.SESSION_ENGINE != 'django.contrib.sessions.backends.cached_db':
+        return []
+    alias = getattr(settings, 'SESSION_CACHE_ALIAS', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Error(
+        f"SESSION_MODE=cached_db with the process-local cache '{alias}' ({backend})",
+        hint="A logout in one worker would leave the session cached in the others. "
+             "Set REDIS_URL for a shared cache, or use SESSION_MODE=db.",
+        id='myapp.E001',
+    )]
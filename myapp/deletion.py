@@ -0,0 +1,219 @@
+"""
+Background user deletion
+
+user.delete() makes Django's collector load every dependent row (food log,
+weight log, meal plans, custom foods, payments, ...) into memory and delete it
+in one long transaction, which stalls the request and holds the SQLite write
+lock. Instead, queue_user_deletion() only deactivates the user and records a
+UserDeletion; the process_user_deletions job then removes dependents in
+_steps() order (children before parents) with raw DELETE ... WHERE id IN
+batches, one short transaction per batch, and finally deletes the user row,
+whose collector only finds empty tables by then.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .partitions import model_databases
+from .stats import adjust_platform_stats, rebuild_user_lifetime_stats
+
+QUEUED_STATUSES = ('pending', 'running')
+# The user row still exists in all of these
+ACTIVE_STATUSES = QUEUED_STATUSES + ('failed',)
+
+
+def _steps():
+    from .models import (
+        Consume, ConsumeArchiveDay, DailyActiveUser, EnergyEstimate, EnergyRefresh, FavoriteFood, Food,
+        FoodServingUnit, MealPlan, MealPlanItem, NutritionGoal, PaymentLog, Recipe, RecipeIngredient,
+        SubscriptionPurchase, UserAchievement, UserLifetimeStats, UserProfile, UserSearchPrefix, UserSearchTrigram,
+        UserStreak, WeightLog,
+    )
+
+    def own(user_id):
+        return Q(user_id=user_id)
+
+    # (label, model, condition). Rows of other users that point at this user's
+    # custom foods go too, as they would with on_delete=CASCADE.
+    return [
+        ('meal plan items', MealPlanItem, lambda user_id: Q(meal_plan__user_id=user_id) | Q(food__user_id=user_id)),
+        ('recipe ingredients', RecipeIngredient, lambda user_id: Q(recipe__user_id=user_id) | Q(food__user_id=user_id)),
+        ('favorite foods', FavoriteFood, lambda user_id: Q(user_id=user_id) | Q(food__user_id=user_id)),
+        ('food log', Consume, lambda user_id: Q(user_id=user_id) | Q(food_consumed__user_id=user_id)),
+        ('food log archive', ConsumeArchiveDay, own),
+        ('weight log', WeightLog, own),
+        ('meal plans', MealPlan, own),
+        ('recipes', Recipe, own),
+        ('nutrition goals', NutritionGoal, own),
+        ('payment logs', PaymentLog, own),
+        ('subscriptions', SubscriptionPurchase, own),
+        ('achievements', UserAchievement, own),
+        ('activity', DailyActiveUser, own),
+        ('search index', UserSearchPrefix, own),
+        ('search index', UserSearchTrigram, own),
+        ('streak', UserStreak, own),
+        ('lifetime stats', UserLifetimeStats, own),
+        ('energy estimate', EnergyEstimate, own),
+        ('energy estimate', EnergyRefresh, own),
+        ('profile', UserProfile, own),
+        ('custom food units', FoodServingUnit, lambda user_id: Q(food__user_id=user_id)),
+        ('custom foods', Food, own),
+    ]
+
+
+def is_pending_deletion(user_id):
+    from .models import UserDeletion
+
+    return UserDeletion.objects.filter(user_id=user_id, status__in=ACTIVE_STATUSES).exists()
+
+
+def pending_deletion_ids(user_ids):
+    """The ids among user_ids queued for deletion (or failed), as is_pending_deletion() decides"""
+    from .models import UserDeletion
+
+    return set(
+        UserDeletion.objects.filter(user_id__in=user_ids, status__in=ACTIVE_STATUSES)
+        .values_list('user_id', flat=True)
+    )
+
+
+def queue_user_deletions(user_ids, requested_by=None):
+    """
+    Deactivate the users and queue them for deletion. Runs in the request, so
+    it only issues a few set-based statements regardless of how much data the
+    users have (callers pass ids in chunks, see bulk.py). Failed deletions are
+    queued again.
+    """
+    from .models import UserDeletion, UserProfile
+
+    with transaction.atomic():
+        queued = set(
+            UserDeletion.objects.filter(user_id__in=user_ids, status__in=QUEUED_STATUSES)
+            .values_list('user_id', flat=True)
+        )
+        user_ids = [user_id for user_id in user_ids if user_id not in queued]
+        users = User.objects.filter(id__in=user_ids)
+        # Inactive users can't log in, and their sessions stop authenticating
+        deactivated = users.filter(is_active=True).update(is_active=False)
+        # Don't count them as premium while they wait
+        unpremium = UserProfile.objects.filter(user_id__in=user_ids, is_premium=True).update(is_premium=False)
+        UserDeletion.objects.filter(user_id__in=user_ids).delete()
+        deletions = UserDeletion.objects.bulk_create([
+            UserDeletion(user_id=user_id, username=username, requested_by=requested_by)
+            for user_id, username in users.values_list('id', 'username')
+        ])
+    adjust_platform_stats(active_users=-deactivated, premium_users=-unpremium)
+    return deletions
+
+
+def queue_user_deletion(user, requested_by=None):
+    deletions = queue_user_deletions([user.id], requested_by)
+    return deletions[0] if deletions else None
+
+
+def count_user_rows(user_id):
+    return sum(
+        model._base_manager.using(using).filter(condition(user_id)).count()
+        for _, model, condition in _steps()
+        for using in model_databases(model)
+    )
+
+
+def _delete_batch(model, condition, batch_size, using):
+    """Delete up to batch_size matching rows; returns (deleted, user ids the rows belonged to)"""
+    has_user = any(field.name == 'user' for field in model._meta.fields)
+    with transaction.atomic(using=using):
+        rows = model._base_manager.using(using).filter(condition)
+        if has_user:
+            rows = list(rows.values_list('pk', 'user_id')[:batch_size])
+            pks = [pk for pk, _ in rows]
+            owners = {owner for _, owner in rows}
+        else:
+            pks = list(rows.values_list('pk', flat=True)[:batch_size])
+            owners = set()
+        if pks:
+            # Dependents are already gone (steps run children first), so skip
+            # the collector and its signals and issue a plain DELETE
+            model._base_manager.using(using).filter(pk__in=pks)._raw_delete(using)
+    return len(pks), owners
+
+
+def process_deletion(deletion, deadline=None):
+    """
+    Work through one queued deletion until it is done or the deadline passes.
+    Safe to resume: every batch re-selects whatever rows are left.
+    """
+    from .models import UserDeletion
+
+    batch_size = getattr(settings, 'USER_DELETION_BATCH_SIZE', 500)
+    progress = UserDeletion.objects.filter(pk=deletion.pk)
+
+    if deletion.status != 'running':
+        deletion.status = 'running'
+        deletion.started_at = deletion.started_at or timezone.now()
+        deletion.error = ''
+        if deletion.total_rows is None:
+            deletion.total_rows = count_user_rows(deletion.user_id)
+        deletion.save(update_fields=['status', 'started_at', 'error', 'total_rows'])
+
+    for label, model, condition in _steps():
+        progress.update(current_step=label)
+        deletion.current_step = label
+        # Payment records live in the audit database, a partitioned food log
+        # in every partition (other users' entries may use the custom foods)
+        for using in model_databases(model):
+            if not _delete_rows(deletion, model, condition, batch_size, using, deadline):
+                return False
+
+    # Everything that pointed at the user is gone; the collector now only
+    # finds empty relations (and catches anything not listed in the steps)
+    User.objects.filter(pk=deletion.user_id).delete()
+    deletion.status = 'done'
+    deletion.current_step = ''
+    deletion.finished_at = timezone.now()
+    deletion.save(update_fields=['status', 'current_step', 'finished_at'])
+    return True
+
+
+def _delete_rows(deletion, model, condition, batch_size, using, deadline):
+    """One step in one database; False if the deadline passed first"""
+    from .models import Consume, UserDeletion
+
+    progress = UserDeletion.objects.filter(pk=deletion.pk)
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        deleted, owners = _delete_batch(model, condition(deletion.user_id), batch_size, using)
+        if not deleted:
+            return True
+        deletion.rows_deleted += deleted
+        progress.update(rows_deleted=deletion.rows_deleted)
+        if model is Consume:
+            # Other users lose entries that used this user's custom foods
+            for owner in owners - {deletion.user_id}:
+                rebuild_user_lifetime_stats(owner)
+
+
+def process_user_deletions(time_budget=None):
+    """Process queued deletions oldest first within time_budget seconds; returns (done, remaining)"""
+    from .models import UserDeletion
+
+    if time_budget is None:
+        time_budget = getattr(settings, 'USER_DELETION_TIME_BUDGET', 45)
+    deadline = time.monotonic() + time_budget
+    done = 0
+    for deletion in UserDeletion.objects.filter(status__in=QUEUED_STATUSES).order_by('created_at'):
+        try:
+            finished = process_deletion(deletion, deadline)
+        except Exception as e:
+            UserDeletion.objects.filter(pk=deletion.pk).update(status='failed', error=str(e))
+            raise
+        if not finished:
+            break
+        done += 1
+    remaining = UserDeletion.objects.filter(status__in=QUEUED_STATUSES).count()
+    return done, remaining
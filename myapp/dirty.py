@@ -0,0 +1,76 @@
+"""
+Dirty-field tracking for models
+
+DirtyFieldsMixin remembers the field values a model instance was loaded with.
+save() then writes only the columns that changed (UPDATE ... SET changed
+columns) and skips the query entirely when nothing did, so code paths that
+save "just in case" cost nothing.
+"""
+from django.core.exceptions import ValidationError
+from django.db.models.fields.files import FieldFile
+
+
+class DirtyFieldsMixin:
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._reset_dirty_tracking()
+
+    def _tracked_value(self, field):
+        value = self.__dict__[field.attname]
+        if isinstance(value, FieldFile):
+            # A newly assigned upload is always a change
+            return value.name if value._committed else object()
+        try:
+            # So e.g. a date string from a form equals the loaded date
+            return field.to_python(value)
+        except ValidationError:
+            return value
+
+    def _tracked_fields(self):
+        # Deferred fields aren't in __dict__ and can't have been changed without loading them
+        return [
+            field for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname in self.__dict__
+        ]
+
+    def _reset_dirty_tracking(self, fields=None):
+        if fields is None:
+            self._loaded_values = {}
+            fields = self._tracked_fields()
+        for field in fields:
+            if field.attname in self.__dict__:
+                self._loaded_values[field.attname] = self._tracked_value(field)
+
+    def get_dirty_fields(self):
+        """Names of fields changed since the instance was loaded or last saved"""
+        return [
+            field.name for field in self._tracked_fields()
+            if field.attname not in self._loaded_values
+            or self._loaded_values[field.attname] != self._tracked_value(field)
+        ]
+
+    def is_dirty(self):
+        return bool(self.get_dirty_fields())
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not args:
+            dirty = self.get_dirty_fields()
+            if not dirty:
+                return
+            kwargs['update_fields'] = dirty
+        super().save(*args, **kwargs)
+        self._reset_dirty_tracking(self._fields_named(kwargs.get('update_fields')))
+
+    def refresh_from_db(self, *args, fields=None, **kwargs):
+        super().refresh_from_db(*args, fields=fields, **kwargs)
+        self._reset_dirty_tracking(self._fields_named(fields))
+
+    def _fields_named(self, names):
+        if names is None:
+            return None
+        names = set(names)
+        return [
+            field for field in self._meta.concrete_fields
+            if field.name in names or field.attname in names
+        ]
@@ -0,0 +1,343 @@
+"""
+Adaptive energy expenditure (TDEE) estimates and goal forecasts
+
+The profile's daily calorie goal is a number the user typed in, but the
+food log and the weight log together say what the user actually burns:
+whatever they ate beyond it shows up as weight gained, at about
+KCAL_PER_KG per kilogram. For each WINDOW_DAYS window ending on one of the
+last FIT_DAYS complete days, the weight slope is the least-squares line
+through the window's weigh-ins and the intake is the mean over its logged
+days (servings-weighted, from the columnar history in history.py). All the
+windows come out of cumulative sums over dense daily arrays, so the fit is
+a handful of vectorized operations however many windows there are. The
+window estimates (intake - slope * KCAL_PER_KG) are averaged with weights
+halving every HALF_LIFE_DAYS, so recent weeks count most.
+
+Until the logs say enough, the estimate leans on the Mifflin-St Jeor
+formula times the activity factor. Confidence (0-1, from how fully the
+latest usable window is logged and weighed, and how recent it is) sets the
+blend. The weight trend gives the date the user reaches their target
+weight, and the estimate plus the goal's rate a suggested calorie goal.
+
+Estimates are stored in EnergyEstimate, so the dashboard reads one row.
+Food and weight logs and profile edits queue their user in EnergyRefresh
+when their transaction commits (one write per transaction, or per
+savepoint inside it, however many rows it wrote), and the refresh_queued_energy_estimates job refits the
+queued users every minute, off the request path; a refit reads the history
+and a few weeks of weight log. `python manage.py refresh_energy_estimates`
+refreshes every user on a thread pool, and a nightly job runs it so
+estimates move on with the days.
+"""
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import repeat
+
+import numpy as np
+from django.db import connections, transaction
+from django.db.utils import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from .history import UserHistory, get_history
+from .replica import use_primary
+
+logger = logging.getLogger(__name__)
+
+KCAL_PER_KG = 7700
+WINDOW_DAYS = 28
+# Windows ending on each of the last FIT_DAYS days are fitted and averaged
+FIT_DAYS = 28
+HALF_LIFE_DAYS = 14
+# A window is usable with this much logged in it
+MIN_INTAKE_DAYS = 10
+MIN_WEIGH_INS = 4
+# Standard deviation of the weigh-in days, so a few weigh-ins on consecutive
+# days can't make a slope; weighing across two weeks or more is enough
+MIN_WEIGH_SPREAD_DAYS = 4
+# Full confidence needs a weigh-in every few days
+FULL_WEIGH_INS = 8
+# Window estimates outside this range come from logs with gaps, not from people
+MIN_TDEE = 800
+MAX_TDEE = 6000
+MIN_SUGGESTED_CALORIES = 1200
+MAX_FORECAST_DAYS = 5 * 365
+# The formula prior: Mifflin-St Jeor has +5 for men and -161 for women and
+# the profile records neither, so it uses the midpoint; without a birth date
+# the age is DEFAULT_AGE
+SEX_OFFSET = -78
+DEFAULT_AGE = 35
+
+ACTIVITY_FACTORS = {
+    'sedentary': 1.2,
+    'light': 1.375,
+    'moderate': 1.55,
+    'very': 1.725,
+    'super': 1.9,
+}
+
+# Weight goal: kg per week
+GOAL_RATES = {
+    'lose': -0.5,
+    'maintain': 0.0,
+    'gain': 0.25,
+}
+
+
+def _window_sums(values, window):
+    """Sums of each run of window consecutive values"""
+    sums = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    return sums[window:] - sums[:-window]
+
+
+def fit(intake, logged, weights, window=WINDOW_DAYS):
+    """
+    Fit expenditure from dense daily arrays ending on the last complete day:
+    calorie totals, whether food was logged and weights (nan on days without
+    a weigh-in). Returns a dict of the fields EnergyEstimate stores; tdee is
+    None when no window is usable.
+    """
+    x = np.arange(len(weights), dtype=np.float64)
+    weighed = ~np.isnan(weights)
+    y = np.where(weighed, weights, 0.0)
+    w = weighed.astype(np.float64)
+    n = _window_sums(w, window)
+    sum_x = _window_sums(x * w, window)
+    sum_y = _window_sums(y, window)
+    sum_xx = _window_sums(x * x * w, window)
+    sum_xy = _window_sums(x * y, window)
+    days_logged = _window_sums(logged, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # n^2 times the variance of the weigh-in days
+        spread = n * sum_xx - sum_x * sum_x
+        slope = (n * sum_xy - sum_x * sum_y) / spread
+        intercept = (sum_y - slope * sum_x) / n
+        intake_mean = _window_sums(np.where(logged, intake, 0.0), window) / days_logged
+        tdee = intake_mean - slope * KCAL_PER_KG
+        usable = (
+            (n >= MIN_WEIGH_INS)
+            & (spread >= (n * MIN_WEIGH_SPREAD_DAYS) ** 2)
+            & (days_logged >= MIN_INTAKE_DAYS)
+            & (tdee >= MIN_TDEE)
+            & (tdee <= MAX_TDEE)
+        )
+
+    last = len(n) - 1
+    result = {
+        'tdee': None,
+        'confidence': 0.0,
+        'intake_average': float(intake_mean[last]) if days_logged[last] else None,
+        'weight_trend': None,
+        'trend_weight': float(weights[weighed][-1]) if weighed.any() else None,
+        'days_logged': int(days_logged[last]),
+        'weigh_ins': int(n[last]),
+    }
+    index = np.flatnonzero(usable)
+    if not len(index):
+        return result
+    decay = 0.5 ** ((last - index) / HALF_LIFE_DAYS)
+    latest = index[-1]
+    result.update({
+        'tdee': float(np.dot(tdee[index], decay) / decay.sum()),
+        'confidence': float(
+            min(days_logged[latest] / window, 1) * min(n[latest] / FULL_WEIGH_INS, 1) * decay[-1]
+        ),
+        'intake_average': float(intake_mean[latest]),
+        'weight_trend': float(slope[latest] * 7),
+        # The latest fitted line, extended to the last day
+        'trend_weight': float(intercept[latest] + slope[latest] * (len(weights) - 1)),
+        'days_logged': int(days_logged[latest]),
+        'weigh_ins': int(n[latest]),
+    })
+    return result
+
+
+def formula_tdee(profile, weight, today):
+    """Mifflin-St Jeor times the activity factor, None without height and weight"""
+    if not (profile.height and weight):
+        return None
+    age = DEFAULT_AGE
+    if profile.date_of_birth:
+        born = profile.date_of_birth
+        age = today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+    bmr = 10 * weight + 6.25 * profile.height - 5 * age + SEX_OFFSET
+    return bmr * ACTIVITY_FACTORS.get(profile.activity_level, ACTIVITY_FACTORS['moderate'])
+
+
+def forecast(trend_weight, weight_trend, target_weight, today):
+    """The day the weight trend reaches target_weight; None if it isn't heading there"""
+    if trend_weight is None or target_weight is None:
+        return None
+    remaining = target_weight - trend_weight
+    if abs(remaining) < 0.1:
+        return today
+    if not weight_trend:
+        return None
+    days = remaining / (weight_trend / 7)
+    if days <= 0 or days > MAX_FORECAST_DAYS:
+        return None
+    return today + timedelta(days=math.ceil(days))
+
+
+def suggested_calories(tdee, weight_goal):
+    """Daily calories for the goal's weekly rate, to the nearest 10"""
+    if tdee is None:
+        return None
+    calories = tdee + GOAL_RATES.get(weight_goal, 0.0) * KCAL_PER_KG / 7
+    return max(MIN_SUGGESTED_CALORIES, int(round(calories, -1)))
+
+
+def compute_estimate(user_id, today=None, use_cache=True, profile=None):
+    """
+    The EnergyEstimate fields for a user, None if they have no profile.
+    use_cache=False loads the history without putting it in this process's
+    cache, for batch runs over every user.
+    """
+    from .models import UserProfile, WeightLog
+
+    today = today or timezone.localdate()
+    if profile is None:
+        profile = UserProfile.objects.filter(user_id=user_id).first()
+        if profile is None:
+            return None
+    # Today isn't over, so its intake would read low
+    last = today - timedelta(days=1)
+    start = last - timedelta(days=FIT_DAYS + WINDOW_DAYS - 2)
+    history = get_history(user_id) if use_cache else UserHistory.load(user_id)
+    intake, counts = history.daily_totals('calories', start, last)
+
+    weights = np.full(len(intake), np.nan)
+    rows = WeightLog.objects.filter(user_id=user_id, date__range=(start, last)).order_by('date', 'id')
+    for day, weight in rows.values_list('date', 'weight'):
+        weights[(day - start).days] = weight
+
+    result = fit(intake, counts > 0, weights)
+    prior = formula_tdee(profile, result['trend_weight'] or profile.weight, today)
+    fitted = result['tdee']
+    if fitted is None:
+        result['tdee'] = prior
+    elif prior is not None:
+        result['tdee'] = result['confidence'] * fitted + (1 - result['confidence']) * prior
+    if result['tdee'] is not None:
+        result['tdee'] = round(result['tdee'])
+    result['target_date'] = forecast(result['trend_weight'], result['weight_trend'], profile.target_weight, today)
+    result['suggested_calories'] = suggested_calories(result['tdee'], profile.weight_goal)
+    result['computed_for'] = today
+    return result
+
+
+def refresh_energy_estimate(user_id, today=None, use_cache=True):
+    """Recompute and store a user's estimate"""
+    from .models import EnergyEstimate
+
+    # From the primary: it is written straight back
+    with use_primary():
+        values = compute_estimate(user_id, today, use_cache=use_cache)
+    if values is None:
+        return None
+    estimate, _ = EnergyEstimate.objects.update_or_create(user_id=user_id, defaults=values)
+    return estimate
+
+
+class _QueuedRefreshes:
+    """The users a transaction has logged for, at one savepoint level, queued when it commits"""
+
+    def __init__(self, user_id):
+        self.user_ids = {user_id}
+        self.committed = False
+
+    def __call__(self):
+        self.committed = True
+        try:
+            queue_refreshes(self.user_ids)
+        except Exception:
+            # The log itself is committed; the nightly run catches up
+            logger.exception(f"Queueing energy estimate refreshes of users {sorted(self.user_ids)} failed")
+
+
+def schedule_refresh(user_id, using=None):
+    """
+    Queue a refresh of the user's estimate for when the current transaction
+    on using commits (straight away outside one), with one queue write per
+    transaction and savepoint level however many users and log rows it touches
+    """
+    connection = transaction.get_connection(using or DEFAULT_DB_ALIAS)
+    if connection.in_atomic_block:
+        # Join the callback registered under the same savepoints, if any, so
+        # rolling one of them back drops exactly the users logged for while
+        # it was active, and none logged for outside it
+        savepoints = set(connection.savepoint_ids)
+        for sids, func, _ in reversed(connection.run_on_commit):
+            if isinstance(func, _QueuedRefreshes) and sids == savepoints and not func.committed:
+                func.user_ids.add(user_id)
+                return
+    transaction.on_commit(_QueuedRefreshes(user_id), using=connection.alias)
+
+
+def queue_refreshes(user_ids):
+    from .models import EnergyRefresh
+
+    EnergyRefresh.objects.bulk_create(
+        [EnergyRefresh(user_id=user_id) for user_id in user_ids], ignore_conflicts=True,
+    )
+
+
+def refresh_queued_estimates():
+    """Refresh the estimates queued by schedule_refresh() before this run; returns how many"""
+    from .models import EnergyRefresh
+
+    started = timezone.now()
+    count = 0
+    while True:
+        user_ids = list(
+            EnergyRefresh.objects.filter(queued_at__lte=started).order_by('queued_at')
+            .values_list('user_id', flat=True)[:500]
+        )
+        if not user_ids:
+            return count
+        # Dequeue first, so a log written during the refit queues its user again
+        EnergyRefresh.objects.filter(user_id__in=user_ids).delete()
+        for user_id in user_ids:
+            try:
+                # Not from this process's history cache: the logs were written by others
+                refresh_energy_estimate(user_id, use_cache=False)
+            except Exception:
+                logger.exception(f"Refreshing the energy estimate of user {user_id} failed")
+        count += len(user_ids)
+
+
+def _compute_batch(user_ids, today):
+    """Estimates for a batch of users, on a worker thread's own connections"""
+    from .models import UserProfile
+
+    try:
+        profiles = UserProfile.objects.filter(user_id__in=user_ids)
+        return [
+            (profile.user_id, compute_estimate(profile.user_id, today, use_cache=False, profile=profile))
+            for profile in profiles
+        ]
+    finally:
+        connections.close_all()
+
+
+def refresh_all_estimates(workers=4, batch_size=500, today=None):
+    """
+    Refresh every user's estimate. Worker threads compute batches of users
+    (the work is mostly waiting on queries) and this thread writes each
+    batch with one upsert. Returns the number of estimates written.
+    """
+    from .models import EnergyEstimate, UserProfile
+
+    today = today or timezone.localdate()
+    user_ids = list(UserProfile.objects.order_by('user_id').values_list('user_id', flat=True))
+    batches = [user_ids[i:i + batch_size] for i in range(0, len(user_ids), batch_size)]
+    fields = [field.name for field in EnergyEstimate._meta.concrete_fields if field.name not in ('id', 'user')]
+    count = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for results in pool.map(_compute_batch, batches, repeat(today)):
+            rows = [EnergyEstimate(user_id=user_id, **values) for user_id, values in results]
+            EnergyEstimate.objects.bulk_create(
+                rows, update_conflicts=True, unique_fields=['user'], update_fields=fields,
+            )
+            count += len(rows)
+    return count
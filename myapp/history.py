@@ -0,0 +1,340 @@
+"""
+Columnar per-user food log history for analytics
+
+Analytics questions (7-day rolling calories, protein on weekdays vs
+weekends, percentiles of daily intake) used to mean a new aggregate query
+over the Consume/Food join for each one. UserHistory loads a user's whole
+log, hot and archived (see archive.py), once into NumPy columns: day
+number, meal type code and the servings-weighted calories, carbs, protein
+and fats of each entry, sorted by day. Each question is then a few
+vectorized operations over those arrays.
+
+Histories are kept per process in an LRU cache bounded by
+ANALYTICS_HISTORY_CACHE_BYTES. Every change to a user's log bumps a
+version number in the Django cache, which is shared between processes when
+Redis is configured; a cached history whose version is out of date is
+rebuilt. New log entries are appended to the cached history in place (the
+signals in signals.py call record_consume_created), edits and deletions
+invalidate it, and so does changing the nutrients of a food the user logged.
+
+`python manage.py bench_history` compares this with the ORM queries.
+"""
+import random
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .nutrients import NUTRIENTS
+from .replica import use_primary
+
+FIELDS = NUTRIENTS
+EPOCH = date(1970, 1, 1)
+VERSION_KEY = 'history_version:{}'
+
+
+def _meal_types():
+    from .models import MEAL_TYPE_CHOICES
+
+    return [value for value, _ in MEAL_TYPE_CHOICES]
+
+
+def day_number(value):
+    return (value - EPOCH).days
+
+
+def from_day_number(number):
+    return EPOCH + timedelta(days=int(number))
+
+
+class UserHistory:
+    """One user's food log as columns sorted by day"""
+
+    __slots__ = ('user_id', 'version', '_size', '_days', '_meals', '_values')
+
+    def __init__(self, user_id, days, meals, values, version=None):
+        order = np.argsort(days, kind='stable')
+        self.user_id = user_id
+        self.version = version
+        self._size = len(days)
+        self._days = np.asarray(days, dtype=np.int32)[order]
+        self._meals = np.asarray(meals, dtype=np.int8)[order]
+        self._values = np.asarray(values, dtype=np.float32).reshape(len(FIELDS), -1)[:, order]
+
+    @classmethod
+    def load(cls, user_id, version=None):
+        """Read the user's hot and archived entries"""
+        from .archive import unpack_entries
+        from .models import Consume, ConsumeArchiveDay
+
+        meal_codes = {meal: code for code, meal in enumerate(_meal_types())}
+        snack = meal_codes['snack']
+        hot = (
+            Consume.objects.filter(user_id=user_id)
+            .order_by()
+            .annotate(**{f'total_{field}': F(f'food_consumed__{field}') * F('servings') for field in FIELDS})
+            .values_list('date_consumed', 'meal_type', *(f'total_{field}' for field in FIELDS))
+        )
+        days, meals, values = [], [], []
+        for day, meal, *totals in hot:
+            days.append(day_number(day))
+            meals.append(meal_codes.get(meal, snack))
+            values.append(totals)
+        for day, packed in ConsumeArchiveDay.objects.filter(user_id=user_id).values_list('date', 'entries'):
+            number = day_number(day)
+            for entry in unpack_entries(packed):
+                days.append(number)
+                meals.append(meal_codes[entry.meal_type])
+                values.append([getattr(entry, field) * entry.servings for field in FIELDS])
+        values = np.array(values, dtype=np.float32).reshape(-1, len(FIELDS)).T
+        return cls(user_id, days, meals, values, version)
+
+    def __len__(self):
+        return self._size
+
+    def first_day(self):
+        return from_day_number(self._days[0]) if self._size else None
+
+    @property
+    def nbytes(self):
+        return self._days.nbytes + self._meals.nbytes + self._values.nbytes
+
+    @property
+    def days(self):
+        return self._days[:self._size]
+
+    @property
+    def meals(self):
+        return self._meals[:self._size]
+
+    def column(self, field):
+        return self._values[FIELDS.index(field), :self._size]
+
+    def append(self, day, meal_type, totals):
+        """Add one entry, keeping the columns sorted; the arrays grow by doubling"""
+        number = day_number(day)
+        if self._size == len(self._days):
+            capacity = max(16, 2 * len(self._days))
+            self._days = np.resize(self._days, capacity)
+            self._meals = np.resize(self._meals, capacity)
+            values = np.zeros((len(FIELDS), capacity), dtype=np.float32)
+            values[:, :self._size] = self._values[:, :self._size]
+            self._values = values
+        # Usually the end; backdated entries shift the later ones along
+        at = int(np.searchsorted(self.days, number, side='right'))
+        end = self._size
+        self._days[at + 1:end + 1] = self._days[at:end]
+        self._meals[at + 1:end + 1] = self._meals[at:end]
+        self._values[:, at + 1:end + 1] = self._values[:, at:end]
+        meal_types = _meal_types()
+        self._days[at] = number
+        self._meals[at] = meal_types.index(meal_type) if meal_type in meal_types else meal_types.index('snack')
+        self._values[:, at] = totals
+        self._size += 1
+
+    def _bounds(self, start, end):
+        """Entry index range for days start..end (dates, inclusive; None for open)"""
+        days = self.days
+        lo = 0 if start is None else int(np.searchsorted(days, day_number(start), side='left'))
+        hi = self._size if end is None else int(np.searchsorted(days, day_number(end), side='right'))
+        return lo, hi
+
+    def _day_range(self, start, end):
+        if start is None:
+            start = from_day_number(self.days[0]) if self._size else date.today()
+        if end is None:
+            end = from_day_number(self.days[-1]) if self._size else start
+        return start, end
+
+    def daily_totals(self, field='calories', start=None, end=None):
+        """
+        (totals, entry_counts) per calendar day from start to end inclusive,
+        zero on days without entries
+        """
+        start, end = self._day_range(start, end)
+        length = max(day_number(end) - day_number(start) + 1, 0)
+        lo, hi = self._bounds(start, end)
+        offsets = self.days[lo:hi] - day_number(start)
+        totals = np.bincount(offsets, weights=self.column(field)[lo:hi], minlength=length)
+        counts = np.bincount(offsets, minlength=length)
+        return totals[:length], counts[:length]
+
+    def rolling_mean(self, field='calories', window=7, start=None, end=None):
+        """
+        For each day from start to end, the mean daily total over the window
+        of days ending on it, counting only days with entries (nan if none)
+        """
+        start, end = self._day_range(start, end)
+        totals, counts = self.daily_totals(field, start - timedelta(days=window - 1), end)
+        logged = (counts > 0).astype(np.int64)
+        window_totals = np.convolve(totals, np.ones(window), mode='valid')
+        window_days = np.convolve(logged, np.ones(window, dtype=np.int64), mode='valid')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(window_days > 0, window_totals / window_days, np.nan)
+
+    def logged_daily_totals(self, field='calories', start=None, end=None):
+        """(day numbers, totals) for the days with entries"""
+        lo, hi = self._bounds(start, end)
+        days = self.days[lo:hi]
+        if not len(days):
+            return days, np.zeros(0)
+        # Sorted, so each day's entries are one run
+        first = np.flatnonzero(np.concatenate(([True], days[1:] != days[:-1])))
+        return days[first], np.add.reduceat(self.column(field)[lo:hi].astype(np.float64), first)
+
+    def weekday_split(self, field='calories', start=None, end=None):
+        """Mean daily total on logged weekdays and on logged weekend days"""
+        days, totals = self.logged_daily_totals(field, start, end)
+        # 1970-01-01 was a Thursday, so this is Monday=0 ... Sunday=6
+        weekend = (days + 3) % 7 >= 5
+        return {
+            'weekday': float(totals[~weekend].mean()) if (~weekend).any() else None,
+            'weekend': float(totals[weekend].mean()) if weekend.any() else None,
+        }
+
+    def percentiles(self, field='calories', q=(10, 50, 90), start=None, end=None):
+        """Percentiles of the daily totals over logged days"""
+        _, totals = self.logged_daily_totals(field, start, end)
+        if not len(totals):
+            return {p: None for p in q}
+        return dict(zip(q, (float(value) for value in np.percentile(totals, q))))
+
+    def meal_shares(self, field='calories', start=None, end=None):
+        """Each meal type's share of the total (0..1)"""
+        lo, hi = self._bounds(start, end)
+        meal_types = _meal_types()
+        totals = np.bincount(self.meals[lo:hi], weights=self.column(field)[lo:hi], minlength=len(meal_types))
+        overall = totals.sum()
+        return {meal: float(total / overall) if overall else 0.0 for meal, total in zip(meal_types, totals)}
+
+
+class HistoryCache:
+    """Per-process LRU of UserHistory objects, bounded by their array sizes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._histories = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version):
+        with self._lock:
+            history = self._histories.get(user_id)
+            if history is None:
+                return None
+            if history.version != version:
+                self._remove(user_id)
+                return None
+            self._histories.move_to_end(user_id)
+            return history
+
+    def put(self, history):
+        with self._lock:
+            self._remove(history.user_id)
+            if history.nbytes > self.max_bytes:
+                return
+            self._histories[history.user_id] = history
+            self.nbytes += history.nbytes
+            self._evict()
+
+    def update(self, user_id, old_version, new_version, change):
+        """Apply change(history) if the cached history is at old_version, else drop it"""
+        with self._lock:
+            history = self._histories.get(user_id)
+            if history is None:
+                return
+            if history.version != old_version:
+                self._remove(user_id)
+                return
+            self.nbytes -= history.nbytes
+            change(history)
+            history.version = new_version
+            self.nbytes += history.nbytes
+            self._evict()
+
+    def discard(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._histories.clear()
+            self.nbytes = 0
+
+    def _remove(self, user_id):
+        history = self._histories.pop(user_id, None)
+        if history is not None:
+            self.nbytes -= history.nbytes
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self._histories:
+            _, history = self._histories.popitem(last=False)
+            self.nbytes -= history.nbytes
+
+
+_cache = HistoryCache(getattr(settings, 'ANALYTICS_HISTORY_CACHE_BYTES', 32 * 1024 * 1024))
+
+
+def bump_version(key):
+    """Increment a shared version number and return the new value"""
+    # Versions start at random, so one that was evicted from the cache and
+    # starts again doesn't match histories built before
+    cache.add(key, random.getrandbits(48), timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        version = random.getrandbits(48)
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def history_version(user_id):
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    return bump_version(key) if version is None else version
+
+
+def get_history(user_id):
+    """The user's UserHistory, from this process's cache when it is current"""
+    version = history_version(user_id)
+    history = _cache.get(user_id, version)
+    if history is None:
+        # Built with the version read before loading, so a write during the
+        # load makes it stale straight away rather than lost. From the
+        # primary: a lagging replica would be cached as current.
+        with use_primary():
+            history = UserHistory.load(user_id, version)
+        _cache.put(history)
+    return history
+
+
+def invalidate_history(user_id):
+    bump_version(VERSION_KEY.format(user_id))
+    _cache.discard(user_id)
+
+
+def invalidate_food_histories(user_ids):
+    """After a food's nutrients change: the histories of the users who logged it have stale totals"""
+    for user_id in user_ids:
+        invalidate_history(user_id)
+
+
+def record_consume_created(consume):
+    """Append a new entry to the cached history instead of rebuilding it"""
+    food = consume.food_consumed
+    totals = [getattr(food, field) * consume.servings for field in FIELDS]
+    log_date = consume._meta.get_field('date_consumed').to_python(consume.date_consumed)
+    new_version = bump_version(VERSION_KEY.format(consume.user_id))
+    # If another process wrote in between, old_version won't match and the
+    # history is dropped instead
+    _cache.update(
+        consume.user_id,
+        new_version - 1,
+        new_version,
+        lambda history: history.append(log_date, consume.meal_type, totals),
+    )
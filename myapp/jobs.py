@@ -0,0 +1,149 @@
+"""
+Periodic operational jobs, run by `python manage.py run_scheduler`
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .scheduler import job
+from .stats import adjust_platform_stats, reconcile_lifetime_stats, reconcile_platform_stats
+
+DB_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+@job('*/15 * * * *', jitter=30)
+def expire_premium_subscriptions():
+    """Turn off the premium flag for users whose subscription has ended"""
+    from .models import UserProfile
+
+    expired = UserProfile.objects.filter(is_premium=True, premium_until__lt=timezone.now())
+    count = expired.update(is_premium=False)
+    # queryset.update() skips signals, so adjust the counters here
+    adjust_platform_stats(premium_users=-count)
+    return f"Expired {count} subscriptions"
+
+
+@job('30 3 * * *', jitter=300)
+def clear_expired_sessions():
+    """
+    Delete expired database sessions in batches, each in its own short
+    transaction, instead of one DELETE over the whole table like `clearsessions`
+    """
+    from django.contrib.sessions.models import Session
+
+    if settings.SESSION_ENGINE not in DB_SESSION_ENGINES:
+        # Cookie and cache sessions expire on their own
+        return "Nothing to purge"
+
+    batch_size = getattr(settings, 'SESSION_PURGE_BATCH_SIZE', 1000)
+    now = timezone.now()
+    deleted = 0
+    while True:
+        keys = list(
+            Session.objects.filter(expire_date__lt=now).values_list('session_key', flat=True)[:batch_size]
+        )
+        if not keys:
+            break
+        with transaction.atomic():
+            count, _ = Session.objects.filter(session_key__in=keys).delete()
+        deleted += count
+    return f"Deleted {deleted} sessions"
+
+
+@job('*/30 * * * *', jitter=60)
+def reconcile_stats():
+    """Correct any drift in the incrementally maintained platform counters"""
+    stats = reconcile_platform_stats()
+    return f"{stats.total_users} users, {stats.active_users} active, {stats.premium_users} premium"
+
+
+@job('20 * * * *', jitter=120)
+def reconcile_user_stats():
+    """Rebuild recently active users' lifetime stats, which the Consume signals only adjust"""
+    count = reconcile_lifetime_stats()
+    return f"Rebuilt lifetime stats of {count} users"
+
+
+@job('*/5 * * * *', catch_up='skip')
+def flush_activity():
+    """Write the activity buffered in this process; web processes flush from their own thread"""
+    from .activity import flush_activity as flush
+
+    count = flush()
+    return f"Flushed activity of {count} users"
+
+
+@job('0 4 * * *', catch_up='skip')
+def prune_job_history():
+    """Keep scheduler run history bounded"""
+    from .models import JobRun
+
+    cutoff = timezone.now() - timedelta(days=getattr(settings, 'SCHEDULER_HISTORY_DAYS', 30))
+    deleted, _ = JobRun.objects.filter(started_at__lt=cutoff).delete()
+    return f"Deleted {deleted} old runs"
+
+
+@job('* * * * *', catch_up='skip')
+def process_user_deletions():
+    """Delete users queued from the control panel, in bounded batches"""
+    from .deletion import process_user_deletions as process
+
+    done, remaining = process()
+    return f"Deleted {done} users, {remaining} queued"
+
+
+@job('45 2 * * *', jitter=300)
+def archive_food_log():
+    """Move food log entries past CONSUME_ARCHIVE_AFTER_DAYS into the per-day archive"""
+    from .archive import archive_old_entries
+
+    users, entries = archive_old_entries()
+    return f"Archived {entries} entries of {users} users"
+
+
+@job('* * * * *', catch_up='skip')
+def refresh_queued_energy_estimates():
+    """Refit the energy estimates of users whose logs or profile changed since the last run"""
+    from .energy import refresh_queued_estimates
+
+    count = refresh_queued_estimates()
+    return f"Refreshed {count} energy estimates"
+
+
+@job('0 4 * * *', jitter=300)
+def refresh_energy_estimates():
+    """Refit every user's energy estimate, so the fitted windows and forecasts move on with the days"""
+    from .energy import refresh_all_estimates
+
+    count = refresh_all_estimates()
+    return f"Refreshed {count} energy estimates"
+
+
+@job('15 5 * * *', jitter=300)
+def optimize_database():
+    """Refresh SQLite's query planner statistics where they have gone stale"""
+    from django.db import connection
+
+    if connection.vendor != 'sqlite':
+        return "Not SQLite"
+    with connection.cursor() as cursor:
+        # Bound the work ANALYZE does per index so this stays quick on big tables
+        cursor.execute('PRAGMA analysis_limit=1000')
+        cursor.execute('PRAGMA optimize')
+    return "Optimized"
+
+
+@job('* * * * *', catch_up='skip')
+def refresh_replica_snapshot():
+    """Refresh the SQLite snapshot used as a read replica (REPLICA_MODE=snapshot)"""
+    from .replica import is_snapshot_replica, refresh_replica_snapshot as refresh
+
+    if not is_snapshot_replica():
+        return "No snapshot replica"
+    size = refresh()
+    return f"Snapshot refreshed ({size // 1024} KB)"
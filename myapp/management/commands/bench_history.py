@@ -0,0 +1,135 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import F, Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from myapp.history import UserHistory, _cache, get_history
+from myapp.models import MEAL_TYPE_CHOICES, Consume, Food
+
+
+def orm_answers(user_id, today):
+    """The analytics questions answered with ORM aggregates, as the views did"""
+    entries = Consume.objects.filter(user_id=user_id)
+    start = today - timedelta(days=89)
+
+    def daily(field, since=None):
+        rows = entries.filter(date_consumed__gte=since) if since else entries
+        rows = rows.values('date_consumed').annotate(total=Sum(F(f'food_consumed__{field}') * F('servings')))
+        return {row['date_consumed']: row['total'] for row in rows.order_by()}
+
+    calories = daily('calories', start - timedelta(days=6))
+    rolling = []
+    for offset in range(90):
+        day = start + timedelta(days=offset)
+        window = [calories[day - timedelta(days=i)] for i in range(7) if day - timedelta(days=i) in calories]
+        rolling.append(sum(window) / len(window) if window else None)
+
+    protein = daily('protein')
+    weekday = [total for day, total in protein.items() if day.weekday() < 5]
+    weekend = [total for day, total in protein.items() if day.weekday() >= 5]
+    split = {'weekday': statistics.fmean(weekday), 'weekend': statistics.fmean(weekend)}
+
+    percentiles = statistics.quantiles(daily('calories').values(), n=10, method='inclusive')
+
+    shares = entries.values('meal_type').annotate(total=Sum(F('food_consumed__calories') * F('servings')))
+    shares = {row['meal_type']: row['total'] for row in shares.order_by()}
+    return rolling, split, (percentiles[0], percentiles[4], percentiles[8]), shares
+
+
+def history_answers(history, today):
+    start = today - timedelta(days=89)
+    return (
+        history.rolling_mean('calories', 7, start, today),
+        history.weekday_split('protein'),
+        history.percentiles('calories', (10, 50, 90)),
+        history.meal_shares('calories'),
+    )
+
+
+class Command(BaseCommand):
+    help = 'Compare analytics over the columnar history cache with the ORM queries (run against a dev database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=3 * 365)
+        parser.add_argument('--per-day', type=int, default=6, help='Food log entries per day')
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Committed rather than rolled back: a partition's connection only
+        # sees committed foods through the attached main database
+        user = User.objects.create(username='bench_history', email='bench_history@example.com')
+        try:
+            self.seed(user, options['days'], options['per_day'])
+            self.stdout.write(f"{options['days']} days x {options['per_day']} entries, {options['rounds']} rounds\n")
+            self.compare(user.pk, options['rounds'])
+        finally:
+            entries = Consume.objects.filter(user=user)
+            entries._raw_delete(entries.db)
+            user.delete()
+            _cache.discard(user.pk)
+
+    def seed(self, user, days, per_day):
+        foods = [
+            Food(user=user, name=f'bench food {i}', calories=random.randint(50, 700),
+                 carbs=random.uniform(0, 80), protein=random.uniform(0, 40), fats=random.uniform(0, 30))
+            for i in range(50)
+        ]
+        Food.objects.bulk_create(foods)
+        foods = list(Food.objects.filter(user=user))
+        meals = [value for value, _ in MEAL_TYPE_CHOICES]
+        today = timezone.localdate()
+        Consume.objects.bulk_create(
+            (
+                Consume(
+                    user=user, food_consumed=random.choice(foods), meal_type=random.choice(meals),
+                    servings=random.choice([0.5, 1, 1, 1.5, 2]), date_consumed=today - timedelta(days=day),
+                )
+                for day in range(days) for _ in range(per_day)
+            ),
+            batch_size=2000,
+        )
+
+    def measure(self, label, user_id, rounds, func):
+        alias = Consume.objects.filter(user_id=user_id).db
+        with CaptureQueriesContext(connections[alias]) as queries:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                func()
+            elapsed = (time.perf_counter() - start) / rounds
+        self.stdout.write(f'  {label:<34}{elapsed * 1000:9.2f} ms{len(queries) / rounds:8.1f} queries')
+        return elapsed
+
+    def compare(self, user_id, rounds):
+        today = timezone.localdate()
+        self.stdout.write(self.style.MIGRATE_HEADING('ORM'))
+        orm = self.measure('4 questions', user_id, rounds, lambda: orm_answers(user_id, today))
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Columnar history'))
+        self.measure('build from the database', user_id, max(rounds // 4, 1), lambda: UserHistory.load(user_id))
+        _cache.discard(user_id)
+        history = get_history(user_id)
+        self.stdout.write(f'  {len(history)} entries, {history.nbytes / 1024:.0f} KB')
+        cached = self.measure('4 questions (cached)', user_id, rounds, lambda: history_answers(get_history(user_id), today))
+        self.stdout.write(self.style.SUCCESS(f'{orm / cached:.0f}x faster once cached'))
+
+        # Both paths must agree
+        rolling, split, percentiles, shares = orm_answers(user_id, today)
+        h_rolling, h_split, h_percentiles, h_shares = history_answers(history, today)
+        total = sum(shares.values())
+        mismatches = [
+            name for name, same in (
+                ('rolling', all(abs(a - b) < 1e-3 * max(a, 1) for a, b in zip(rolling, h_rolling) if a is not None)),
+                ('weekday split', all(abs(split[k] - h_split[k]) < 1e-3 * split[k] for k in split)),
+                ('percentiles', all(abs(a - b) < 1e-3 * a for a, b in zip(percentiles, h_percentiles.values()))),
+                ('meal shares', all(abs(shares.get(k, 0) / total - v) < 1e-4 for k, v in h_shares.items())),
+            ) if not same
+        ]
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"Results differ: {', '.join(mismatches)}"))
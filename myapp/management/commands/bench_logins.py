@@ -0,0 +1,76 @@
+import time
+from collections import Counter
+
+from django.contrib.auth import login
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from myapp.models import UserProfile
+
+BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+def legacy_profile_save(sender, instance, created, **kwargs):
+    """The old create_user_profile behaviour: rewrite the whole profile on every user save"""
+    if not created and hasattr(instance, 'userprofile'):
+        fields = [field.name for field in UserProfile._meta.concrete_fields if not field.primary_key]
+        instance.userprofile.save(update_fields=fields)
+
+
+class Command(BaseCommand):
+    help = 'Measure queries and throughput of the login write path (run against a dev database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--rounds', type=int, default=3)
+
+    def handle(self, *args, **options):
+        # Everything runs in a transaction that is rolled back at the end
+        with transaction.atomic():
+            users = [
+                User.objects.create(username=f'bench_login_{i}', email=f'bench_login_{i}@example.com')
+                for i in range(options['users'])
+            ]
+            self.stdout.write(f'{len(users)} users x {options["rounds"]} rounds\n')
+
+            post_save.connect(legacy_profile_save, sender=User, dispatch_uid='bench_legacy_profile_save')
+            try:
+                self.report('previous (profile rewritten)', users, options['rounds'])
+            finally:
+                post_save.disconnect(sender=User, dispatch_uid='bench_legacy_profile_save')
+            self.report('current', users, options['rounds'])
+
+            transaction.set_rollback(True)
+
+    def report(self, label, users, rounds):
+        factory = RequestFactory()
+        user_ids = [user.id for user in users]
+        statements = Counter()
+        logins = 0
+        elapsed = 0.0
+        for _ in range(rounds):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for user in User.objects.filter(id__in=user_ids):
+                    request = factory.post('/login/')
+                    request.session = SessionStore()
+                    login(request, user, backend=BACKEND)
+                    logins += 1
+                elapsed += time.perf_counter() - start
+            for query in queries.captured_queries:
+                sql = query['sql'].lstrip().upper()
+                verb = sql.split(None, 1)[0]
+                table = ''
+                if verb in ('UPDATE', 'INSERT', 'DELETE'):
+                    table = sql.split('"')[1].lower() if '"' in sql else ''
+                statements[(verb, table)] += 1
+
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        self.stdout.write(f'  {logins / elapsed:,.0f} logins/s')
+        for (verb, table), count in sorted(statements.items()):
+            self.stdout.write(f'  {verb:<9}{table:<28}{count / logins:.2f} per login')
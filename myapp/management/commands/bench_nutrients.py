@@ -0,0 +1,102 @@
+import random
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from myapp.models import Food
+from myapp.nutrients import NUTRIENTS, NutrientVector
+
+
+def dict_totals(items):
+    """The loop meal_planner used: four products and four dict updates per item"""
+    summary = {'total_calories': 0, 'total_protein': 0, 'total_carbs': 0, 'total_fats': 0}
+    for food, servings in items:
+        calories = food.calories * servings
+        protein = food.protein * servings
+        carbs = food.carbs * servings
+        fats = food.fats * servings
+        summary['total_calories'] += calories
+        summary['total_protein'] += protein
+        summary['total_carbs'] += carbs
+        summary['total_fats'] += fats
+    return summary
+
+
+def vector_totals(items):
+    totals = NutrientVector()
+    for food, servings in items:
+        totals.add_scaled(food, servings)
+    return totals
+
+
+def dict_rows(items):
+    """Per-item nutrients as the dicts the views built"""
+    return [
+        {
+            'calories': food.calories * servings,
+            'carbs': food.carbs * servings,
+            'protein': food.protein * servings,
+            'fats': food.fats * servings,
+        }
+        for food, servings in items
+    ]
+
+
+def vector_rows(items):
+    return [NutrientVector.of(food, servings) for food, servings in items]
+
+
+class Command(BaseCommand):
+    help = 'Compare NutrientVector with the dict-of-floats loops it replaced (in memory, no database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        foods = [
+            Food(name=f'food {i}', calories=random.randint(50, 700), carbs=random.uniform(0, 80),
+                 protein=random.uniform(0, 40), fats=random.uniform(0, 30))
+            for i in range(500)
+        ]
+        items = [(random.choice(foods), random.choice([0.5, 1, 1.5, 2])) for _ in range(options['items'])]
+        count = len(items)
+        self.stdout.write(f"{count} items, {options['rounds']} rounds\n")
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Running totals'))
+        old = self.timed('dict of floats', options['rounds'], count, lambda: dict_totals(items))
+        new = self.timed('NutrientVector.add_scaled', options['rounds'], count, lambda: vector_totals(items))
+        # The batch form: one array for every row, one vectorized product and sum
+        values = np.array([[getattr(food, name) for name in NUTRIENTS] for food, _ in items])
+        servings = np.array([factor for _, factor in items])
+        self.timed('nutrient array', options['rounds'], count, lambda: NutrientVector.from_array(values * servings[:, None]))
+        self.stdout.write(self.style.SUCCESS(f'add_scaled: {old / new:.1f}x the speed of the dict loop'))
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Per-item nutrients kept'))
+        old = self.allocated('dicts', lambda: dict_rows(items), count)
+        new = self.allocated('NutrientVector', lambda: vector_rows(items), count)
+        self.stdout.write(self.style.SUCCESS(f'{old / new:.1f}x less memory per item'))
+
+        totals = vector_totals(items)
+        summary = dict_totals(items)
+        if any(abs(summary['total_' + name] - totals[name]) > 1e-6 * abs(totals[name]) for name in NUTRIENTS):
+            self.stdout.write(self.style.ERROR('Totals differ'))
+
+    def timed(self, label, rounds, count, func):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        elapsed = (time.perf_counter() - start) / rounds
+        self.stdout.write(f'  {label:<28}{elapsed * 1000:9.2f} ms{elapsed / count * 1e9:9.0f} ns/item')
+        return elapsed
+
+    def allocated(self, label, func, count):
+        tracemalloc.start()
+        rows = func()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del rows
+        self.stdout.write(f'  {label:<28}{size / count:9.0f} bytes/item')
+        return size
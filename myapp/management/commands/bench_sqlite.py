@@ -0,0 +1,137 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+SCHEMA = """
+CREATE TABLE consume (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    food_id INTEGER NOT NULL,
+    servings REAL NOT NULL,
+    date_consumed DATE NOT NULL
+);
+CREATE INDEX consume_user_date ON consume (user_id, date_consumed);
+"""
+
+READ_SQL = (
+    "SELECT date_consumed, SUM(servings) FROM consume "
+    "WHERE user_id = ? AND date_consumed >= date('now', '-30 day') GROUP BY date_consumed"
+)
+WRITE_SQL = "INSERT INTO consume (user_id, food_id, servings, date_consumed) VALUES (?, ?, ?, date('now'))"
+
+
+class Profile:
+    """How the app talks to SQLite: connection reuse, pragmas, busy timeout and BEGIN mode"""
+
+    def __init__(self, name, persistent, options):
+        self.name = name
+        self.persistent = persistent
+        self.timeout = options.get('timeout', 5)
+        self.begin = f"BEGIN {options['transaction_mode']}" if options.get('transaction_mode') else 'BEGIN'
+        self.init_commands = [c for c in options.get('init_command', '').split(';') if c.strip()]
+
+    def connect(self, path):
+        conn = sqlite3.connect(path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        for command in self.init_commands:
+            conn.execute(command)
+        return conn
+
+
+class Command(BaseCommand):
+    help = 'Concurrent read/write benchmark of the default vs production SQLite settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--rows', type=int, default=200000, help='Rows to seed before measuring')
+
+    def handle(self, *args, **options):
+        profiles = [
+            Profile('default', persistent=False, options={}),
+            Profile('production', persistent=True, options=settings.SQLITE_PRODUCTION_OPTIONS),
+        ]
+        self.stdout.write(
+            f"{options['readers']} readers, {options['writers']} writers, "
+            f"{options['seconds']}s, {options['rows']} seeded rows\n"
+        )
+        for profile in profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                self.seed(path, profile, options['rows'])
+                self.report(profile, self.run(path, profile, options))
+
+    def seed(self, path, profile, rows):
+        conn = profile.connect(path)
+        conn.executescript(SCHEMA)
+        conn.execute('BEGIN')
+        conn.executemany(
+            "INSERT INTO consume (user_id, food_id, servings, date_consumed) "
+            "VALUES (?, ?, ?, date('now', ? || ' day'))",
+            ((random.randint(1, 1000), random.randint(1, 500), 1.0, -random.randint(0, 365)) for _ in range(rows)),
+        )
+        conn.execute('COMMIT')
+        conn.close()
+
+    def run(self, path, profile, options):
+        deadline = time.monotonic() + options['seconds']
+        results = {'read': [], 'write': [], 'errors': 0}
+        lock = threading.Lock()
+
+        def worker(kind):
+            latencies = []
+            errors = 0
+            conn = profile.connect(path) if profile.persistent else None
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                # Without persistent connections every request opens its own
+                db = conn or profile.connect(path)
+                try:
+                    user_id = random.randint(1, 1000)
+                    if kind == 'read':
+                        db.execute(READ_SQL, (user_id,)).fetchall()
+                    else:
+                        db.execute(profile.begin)
+                        db.execute(WRITE_SQL, (user_id, random.randint(1, 500), 1.0))
+                        db.execute('COMMIT')
+                    latencies.append(time.perf_counter() - start)
+                except sqlite3.OperationalError:
+                    errors += 1
+                    if db.in_transaction:
+                        db.execute('ROLLBACK')
+                finally:
+                    if db is not conn:
+                        db.close()
+            if conn:
+                conn.close()
+            with lock:
+                results[kind].extend(latencies)
+                results['errors'] += errors
+
+        threads = [threading.Thread(target=worker, args=('read',)) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=worker, args=('write',)) for _ in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results['seconds'] = options['seconds']
+        return results
+
+    def report(self, profile, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(profile.name))
+        for kind in ('read', 'write'):
+            latencies = sorted(results[kind])
+            if not latencies:
+                self.stdout.write(f'  {kind:<6} no successful operations')
+                continue
+            p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+            self.stdout.write(
+                f'  {kind:<6} {len(latencies) / results["seconds"]:>9,.0f} ops/s   p95 {p95:>7.2f} ms'
+            )
+        self.stdout.write(f'  errors {results["errors"]:>9} (database is locked)')
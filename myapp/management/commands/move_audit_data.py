@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from myapp.models import PaymentLog, SubscriptionPurchase
+from myapp.routers import AUDIT_DATABASE, audit_database
+
+
+class Command(BaseCommand):
+    help = 'Copy payment records written before the audit database existed from default into it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--purge', action='store_true', help='Delete the copied rows from default afterwards')
+
+    def handle(self, *args, **options):
+        if audit_database() != AUDIT_DATABASE:
+            raise CommandError('No audit database is configured')
+
+        existing = connections['default'].introspection.table_names()
+        # Purchases first: payment logs point at them
+        for model in (SubscriptionPurchase, PaymentLog):
+            if model._meta.db_table not in existing:
+                continue
+            copied = self.copy(model, options['batch_size'])
+            self.stdout.write(f'{model._meta.verbose_name_plural}: copied {copied}')
+            if options['purge']:
+                with transaction.atomic(using='default'):
+                    model._base_manager.using('default').all()._raw_delete('default')
+
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def copy(self, model, batch_size):
+        # Keep primary keys so payment logs still point at their purchases;
+        # rows copied by an earlier run are skipped
+        rows = model._base_manager.using('default').order_by('pk')
+        batch = []
+        copied = 0
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                copied += len(model._base_manager.using(AUDIT_DATABASE).bulk_create(batch, ignore_conflicts=True))
+                batch = []
+        if batch:
+            copied += len(model._base_manager.using(AUDIT_DATABASE).bulk_create(batch, ignore_conflicts=True))
+        return copied
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.models import Food, FoodServingUnit, RecipeIngredient
+from myapp.partitions import model_databases
+from myapp.servings import backfill
+
+
+class Command(BaseCommand):
+    help = "Parse every food's serving size into grams and units (see myapp/servings.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per statement')
+
+    def handle(self, *args, **options):
+        for using in model_databases(Food):
+            start = time.perf_counter()
+            count = backfill(Food, FoodServingUnit, RecipeIngredient, using, batch_size=options['batch_size'])
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.SUCCESS(f'{using}: parsed {count} foods in {elapsed:.1f}s'))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from myapp.partitions import partition_aliases, partition_for_user, partitioned_models
+
+
+class Command(BaseCommand):
+    help = 'Move food log rows into the partition their user hashes to (see myapp/partitions.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would move')
+
+    def handle(self, *args, **options):
+        models = partitioned_models()
+        if not models:
+            raise CommandError('Partitioning is off (CONSUME_PARTITIONS is 1)')
+
+        for model in models:
+            # The unpartitioned table in default first, then rows left in the
+            # wrong partition by a change of CONSUME_PARTITIONS
+            for source in ['default'] + partition_aliases():
+                if model._meta.db_table not in connections[source].introspection.table_names():
+                    continue
+                users = model._base_manager.using(source).order_by().values_list('user_id', flat=True).distinct()
+                moved = 0
+                for user_id in list(users):
+                    target = partition_for_user(user_id)
+                    if target == source:
+                        continue
+                    if options['dry_run']:
+                        moved += model._base_manager.using(source).filter(user_id=user_id).count()
+                    else:
+                        moved += self.move_user_rows(model, user_id, source, target, options['batch_size'])
+                if moved:
+                    self.stdout.write(f'{model._meta.verbose_name}: {moved} rows from {source}')
+
+        self.stdout.write(self.style.SUCCESS('Dry run done' if options['dry_run'] else 'Rebalanced'))
+
+    def move_user_rows(self, model, user_id, source, target, batch_size):
+        """
+        Copy one user's rows to their partition, then delete them from the
+        source. The copy commits first, so an interruption can leave copies
+        behind but never loses rows; a rerun skips rows the target already
+        has (ids are per partition, so rows are compared by their fields).
+        """
+        fields = [field.attname for field in model._meta.concrete_fields if not field.primary_key]
+        source_rows = model._base_manager.using(source).filter(user_id=user_id)
+        with transaction.atomic(using=source):
+            rows = list(source_rows.values_list('pk', *fields))
+            existing = set(model._base_manager.using(target).filter(user_id=user_id).values_list(*fields))
+            copies = [model(**dict(zip(fields, row[1:]))) for row in rows if tuple(row[1:]) not in existing]
+            with transaction.atomic(using=target):
+                model._base_manager.using(target).bulk_create(copies, batch_size=batch_size)
+            pks = [row[0] for row in rows]
+            for start in range(0, len(pks), batch_size):
+                source_rows.filter(pk__in=pks[start:start + batch_size])._raw_delete(source)
+        return len(rows)
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from myapp.models import UserSearchPrefix, UserSearchTrigram
+from myapp.search import token_prefixes, token_trigrams, user_tokens, uses_pg_trigram
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the control panel user search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        UserSearchPrefix.objects.all().delete()
+        UserSearchTrigram.objects.all().delete()
+
+        users = User.objects.only('id', 'username', 'email', 'first_name', 'last_name').order_by('id')
+        batch = []
+        count = 0
+        for user in users.iterator(chunk_size=batch_size):
+            batch.append(user)
+            if len(batch) >= batch_size:
+                count += self.index_batch(batch)
+                batch = []
+        if batch:
+            count += self.index_batch(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} users'))
+
+    @transaction.atomic
+    def index_batch(self, users):
+        prefixes = []
+        trigrams = []
+        for user in users:
+            tokens = user_tokens(user)
+            prefixes.extend(UserSearchPrefix(user_id=user.pk, prefix=p) for p in token_prefixes(tokens))
+            if not uses_pg_trigram():
+                trigrams.extend(UserSearchTrigram(user_id=user.pk, trigram=g) for g in token_trigrams(tokens))
+        UserSearchPrefix.objects.bulk_create(prefixes, batch_size=5000)
+        UserSearchTrigram.objects.bulk_create(trigrams, batch_size=5000)
+        return len(users)
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.models import WeightLog
+from myapp.partitions import model_databases
+from myapp.weight_trend import recompute_all
+
+
+class Command(BaseCommand):
+    help = 'Recompute the smoothed weight trend of every weight log entry (see myapp/weight_trend.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Users per query')
+
+    def handle(self, *args, **options):
+        for using in model_databases(WeightLog):
+            start = time.perf_counter()
+            count = recompute_all(using, batch_size=options['batch_size'])
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.SUCCESS(f'{using}: recomputed {count} entries in {elapsed:.1f}s'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.energy import refresh_all_estimates, refresh_energy_estimate
+
+
+class Command(BaseCommand):
+    help = "Refit users' energy expenditure estimates and goal forecasts from their logs (see myapp/energy.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--user', type=int, help='Only this user id')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['user']:
+            estimate = refresh_energy_estimate(options['user'])
+            count = 1 if estimate else 0
+        else:
+            count = refresh_all_estimates(workers=options['workers'], batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {count} estimates in {elapsed:.1f}s'))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.models import ScheduledJob
+from myapp.scheduler import get_owner, run_pending, seconds_until_next_run, sync_jobs
+
+
+class Command(BaseCommand):
+    help = 'Run the in-app periodic job scheduler (see myapp/jobs.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run due jobs once and exit')
+        parser.add_argument('--list', action='store_true', help='List registered jobs and exit')
+        parser.add_argument('--interval', type=int, default=30, help='Maximum seconds between checks')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            sync_jobs()
+            for state in ScheduledJob.objects.all():
+                self.stdout.write(
+                    f"{state.name:<32} {state.schedule:<16} next: {state.next_run_at:%Y-%m-%d %H:%M:%S} "
+                    f"last: {state.last_status or '-'}"
+                )
+            return
+
+        owner = get_owner()
+        self.stdout.write(self.style.SUCCESS(f'Scheduler started as {owner}'))
+
+        try:
+            while True:
+                for run in run_pending(owner):
+                    style = self.style.SUCCESS if run.status == 'success' else self.style.ERROR
+                    self.stdout.write(style(
+                        f"{run.job.name}: {run.status} in {run.duration_ms} ms {run.result}".rstrip()
+                    ))
+                if options['once']:
+                    break
+                time.sleep(seconds_until_next_run(options['interval']))
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Scheduler stopped'))
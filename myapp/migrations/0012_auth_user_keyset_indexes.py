@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:49
+
+from django.db import migrations
+
+# Composite (sort column, id) indexes backing the keyset-paginated control panel
+# user list. auth_user belongs to django.contrib.auth, so they are added here.
+KEYSET_INDEXES = [
+    ("myapp_auth_user_date_joined_id", "date_joined, id"),
+    ("myapp_auth_user_email_id", "email, id"),
+    ("myapp_auth_user_last_login_id", "last_login, id"),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("myapp", "0011_scheduledjob_jobrun"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=f"CREATE INDEX IF NOT EXISTS {name} ON auth_user ({columns});",
+            reverse_sql=f"DROP INDEX IF EXISTS {name};",
+        )
+        for name, columns in KEYSET_INDEXES
+    ]
@@ -0,0 +1,129 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:50
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Frozen copies of the tokenization in myapp/search.py as of this migration,
+# so that later changes there can't change what it does
+MAX_PREFIX_LENGTH = 10
+SEARCH_FIELDS = ("username", "email", "first_name", "last_name")
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def user_tokens(user):
+    tokens = set()
+    for field in SEARCH_FIELDS:
+        text = unicodedata.normalize("NFKD", getattr(user, field) or "")
+        text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+        tokens.update(TOKEN_RE.findall(text))
+    return tokens
+
+
+def token_prefixes(tokens):
+    return {
+        token[:length]
+        for token in tokens
+        for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1)
+    }
+
+
+def token_trigrams(tokens):
+    grams = set()
+    for token in tokens:
+        padded = f"  {token} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def build_search_index(apps, schema_editor):
+    User = apps.get_model("auth", "User")
+    UserSearchPrefix = apps.get_model("myapp", "UserSearchPrefix")
+    UserSearchTrigram = apps.get_model("myapp", "UserSearchTrigram")
+
+    for user in User.objects.iterator(chunk_size=2000):
+        tokens = user_tokens(user)
+        UserSearchPrefix.objects.bulk_create(
+            UserSearchPrefix(user_id=user.pk, prefix=prefix)
+            for prefix in token_prefixes(tokens)
+        )
+        UserSearchTrigram.objects.bulk_create(
+            UserSearchTrigram(user_id=user.pk, trigram=gram)
+            for gram in token_trigrams(tokens)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0012_auth_user_keyset_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserSearchPrefix",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("prefix", models.CharField(max_length=10)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_prefixes",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["prefix", "user"], name="myapp_users_prefix_8eb959_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="UserSearchTrigram",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("trigram", models.CharField(max_length=3)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_trigrams",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["trigram", "user"],
+                        name="myapp_users_trigram_a62a4c_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0013_user_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PlatformStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("total_users", models.IntegerField(default=0)),
+                ("active_users", models.IntegerField(default=0)),
+                ("premium_users", models.IntegerField(default=0)),
+                ("new_users_date", models.DateField(blank=True, null=True)),
+                ("new_users_today", models.IntegerField(default=0)),
+                ("reconciled_at", models.DateTimeField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "Platform stats",
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0014_platformstats"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserLifetimeStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("total_entries", models.IntegerField(default=0)),
+                ("total_calories", models.FloatField(default=0)),
+                ("days_logged", models.IntegerField(default=0)),
+                ("distinct_foods", models.IntegerField(default=0)),
+                ("first_log_date", models.DateField(blank=True, null=True)),
+                ("last_log_date", models.DateField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "User lifetime stats",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="consume",
+            index=models.Index(
+                fields=["user", "date_consumed"], name="myapp_consu_user_id_35ef07_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="consume",
+            index=models.Index(
+                fields=["user", "food_consumed"], name="myapp_consu_user_id_c5a8f7_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="userlifetimestats",
+            name="user",
+            field=models.OneToOneField(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="lifetime_stats",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-19 08:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0016_userdeletion"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="weightlog",
+            index=models.Index(
+                fields=["user", "date"], name="myapp_weigh_user_id_269e78_idx"
+            ),
+        ),
+    ]
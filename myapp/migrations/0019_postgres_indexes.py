@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+# GIN trigram indexes on the searchable auth_user columns for the admin user
+# search (see myapp/search.py). PostgreSQL only; elsewhere the UserSearchTrigram
+# table does this job.
+TRIGRAM_INDEXES = [
+    ("myapp_auth_user_username_trgm", "username"),
+    ("myapp_auth_user_email_trgm", "email"),
+    ("myapp_auth_user_first_name_trgm", "first_name"),
+    ("myapp_auth_user_last_name_trgm", "last_name"),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON auth_user USING gin ({column} gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0018_activity_tracking"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="userprofile",
+            index=models.Index(
+                condition=models.Q(("is_premium", True)),
+                fields=["premium_until"],
+                name="profile_active_premium_idx",
+            ),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0020_audit_database"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConsumeArchiveDay",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("entry_count", models.PositiveIntegerField(default=0)),
+                ("calories", models.FloatField(default=0)),
+                ("carbs", models.FloatField(default=0)),
+                ("protein", models.FloatField(default=0)),
+                ("fats", models.FloatField(default=0)),
+                ("food_ids", models.TextField(default=",")),
+                ("entries", models.BinaryField()),
+                ("archived_at", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_days",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "date")},
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0021_consume_archive"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userprofile",
+            name="target_weight",
+            field=models.FloatField(
+                blank=True, help_text="Target weight in kg", null=True
+            ),
+        ),
+        migrations.CreateModel(
+            name="EnergyEstimate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tdee", models.FloatField(blank=True, null=True)),
+                ("confidence", models.FloatField(default=0)),
+                ("intake_average", models.FloatField(blank=True, null=True)),
+                ("weight_trend", models.FloatField(blank=True, null=True)),
+                ("trend_weight", models.FloatField(blank=True, null=True)),
+                ("days_logged", models.IntegerField(default=0)),
+                ("weigh_ins", models.IntegerField(default=0)),
+                ("suggested_calories", models.IntegerField(blank=True, null=True)),
+                ("target_date", models.DateField(blank=True, null=True)),
+                ("computed_for", models.DateField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="energy_estimate",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+    ]
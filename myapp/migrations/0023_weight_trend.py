@@ -0,0 +1,89 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:42
+
+import math
+
+import numpy as np
+from django.db import migrations, models
+
+# Frozen copy of the smoothing in myapp/weight_trend.py as of this
+# migration, so that later changes there can't change what it does
+ALPHA = 0.1
+LOG_KEEP = math.log1p(-ALPHA)
+MAX_GAP_DAYS = 365
+BLOCK_LOG = 600.0
+BATCH_SIZE = 500
+
+
+def smooth(weights, day_gaps):
+    """Trend after each weigh-in, starting at the first weight"""
+    trends = np.empty_like(weights)
+    seed = weights[0]
+    log_keep = np.clip(day_gaps, 1, MAX_GAP_DAYS) * LOG_KEEP
+    cumulative = np.cumsum(log_keep)
+    start = 0
+    while start < len(weights):
+        base = cumulative[start - 1] if start else 0.0
+        end = int(np.searchsorted(-cumulative, BLOCK_LOG - base, side="right"))
+        log_k = cumulative[start:end] - base
+        gain = -np.expm1(log_keep[start:end])
+        trends[start:end] = np.exp(log_k) * (
+            seed + np.cumsum(gain * weights[start:end] * np.exp(-log_k))
+        )
+        seed = trends[end - 1]
+        start = end
+    return trends
+
+
+def compute_trends(apps, schema_editor):
+    WeightLog = apps.get_model("myapp", "WeightLog")
+    connection = schema_editor.connection
+    entries = WeightLog._base_manager.using(connection.alias)
+    table = connection.ops.quote_name(WeightLog._meta.db_table)
+    user_ids = list(
+        entries.order_by("user_id").values_list("user_id", flat=True).distinct()
+    )
+    for offset in range(0, len(user_ids), BATCH_SIZE):
+        rows = list(
+            entries.filter(user_id__in=user_ids[offset : offset + BATCH_SIZE])
+            .order_by("user_id", "date", "id")
+            .values_list("user_id", "id", "date", "weight")
+        )
+        if not rows:
+            continue
+        users, ids, days, weights = zip(*rows)
+        users = np.array(users)
+        days = np.array([day.toordinal() for day in days], dtype=np.int64)
+        weights = np.array(weights, dtype=np.float64)
+        starts = np.flatnonzero(np.concatenate(([True], users[1:] != users[:-1])))
+        day_gaps = np.diff(days, prepend=days[0])
+        day_gaps[starts] = 0
+        trends = np.empty_like(weights)
+        for start, end in zip(starts, np.append(starts[1:], len(rows))):
+            trends[start:end] = smooth(weights[start:end], day_gaps[start:end])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {table} SET trend = %s WHERE id = %s",
+                [(float(trend), entry_id) for entry_id, trend in zip(ids, trends)],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0022_energy_estimate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="weightlog",
+            name="trend",
+            field=models.FloatField(
+                blank=True, editable=False, help_text="Smoothed weight in kg", null=True
+            ),
+        ),
+        migrations.RunPython(
+            compute_trends,
+            migrations.RunPython.noop,
+            hints={"model_name": "weightlog"},
+        ),
+    ]
@@ -0,0 +1,191 @@
+# Generated by Django 5.2.8 on 2026-10-19 09:50
+
+import re
+from fractions import Fraction
+
+import django.db.models.deletion
+import numpy as np
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+# Frozen copy of the parsing and backfill in myapp/servings.py as of this
+# migration, so that later changes there can't change what it does
+DEFAULT_SERVING_GRAMS = 100.0
+BATCH_SIZE = 500
+UNIT_NAME_LENGTH = 30
+
+UNIT_GRAMS = {
+    "g": 1.0,
+    "mg": 0.001,
+    "kg": 1000.0,
+    "oz": 28.3495,
+    "lb": 453.592,
+    "ml": 1.0,
+    "l": 1000.0,
+    "tsp": 4.93,
+    "tbsp": 14.79,
+    "fl oz": 29.57,
+    "cup": 240.0,
+}
+
+UNIT_ALIASES = {
+    "gram": "g", "grams": "g", "gr": "g", "grs": "g",
+    "milligram": "mg", "milligrams": "mg",
+    "kilogram": "kg", "kilograms": "kg", "kgs": "kg",
+    "ounce": "oz", "ounces": "oz",
+    "pound": "lb", "pounds": "lb", "lbs": "lb",
+    "milliliter": "ml", "milliliters": "ml", "millilitre": "ml", "millilitres": "ml",
+    "liter": "l", "liters": "l", "litre": "l", "litres": "l",
+    "teaspoon": "tsp", "teaspoons": "tsp",
+    "tablespoon": "tbsp", "tablespoons": "tbsp",
+    "fluid ounce": "fl oz", "fluid ounces": "fl oz", "floz": "fl oz",
+    "cups": "cup",
+}  # fmt: skip
+
+SERVING_PATTERN = re.compile(
+    r"^\s*(?P<amount>\d+\s+\d+/\d+|\d+/\d+|\d*\.?\d+)?\s*"
+    r"(?P<unit>[^\d()]*?)\s*"
+    r"(?:\(\s*(?P<inner_amount>\d*\.?\d+)\s*(?P<inner_unit>[^\d()]*?)\s*\))?\s*$"
+)
+
+
+def normalize_unit(name):
+    name = " ".join(name.lower().strip(" .").split())
+    name = UNIT_ALIASES.get(name, name)
+    if (
+        name not in UNIT_GRAMS
+        and len(name) > 3
+        and name.endswith("s")
+        and not name.endswith("ss")
+    ):
+        name = name[:-1]
+    return name[:UNIT_NAME_LENGTH]
+
+
+def parse_serving(text):
+    """(grams, unit, unit_grams) of a serving size, None where it doesn't say"""
+    match = SERVING_PATTERN.match(text or "")
+    if not match or not (match["amount"] or match["unit"]):
+        return None, None, None
+    amount = (
+        float(sum(Fraction(part) for part in match["amount"].split()))
+        if match["amount"]
+        else 1.0
+    )
+    unit = normalize_unit(match["unit"] or "")
+    grams = None
+    if match["inner_amount"]:
+        inner_unit = normalize_unit(match["inner_unit"] or "g")
+        if inner_unit in UNIT_GRAMS:
+            grams = float(match["inner_amount"]) * UNIT_GRAMS[inner_unit]
+    elif unit in UNIT_GRAMS:
+        grams = amount * UNIT_GRAMS[unit]
+    if not grams or grams <= 0:
+        return None, None, None
+    if match["inner_amount"] and unit and unit not in ("g", "mg", "kg") and amount > 0:
+        return grams, unit, grams / amount
+    return grams, None, None
+
+
+def parse_serving_sizes(apps, schema_editor):
+    Food = apps.get_model("myapp", "Food")
+    FoodServingUnit = apps.get_model("myapp", "FoodServingUnit")
+    RecipeIngredient = apps.get_model("myapp", "RecipeIngredient")
+    using = schema_editor.connection.alias
+
+    foods = Food._base_manager.using(using)
+    rows = list(foods.order_by("id").values_list("id", "serving_size"))
+    units = FoodServingUnit._base_manager.using(using)
+    units.all().delete()
+    if rows:
+        ids = np.array([food_id for food_id, _ in rows])
+        texts = np.array([text or "" for _, text in rows], dtype=str)
+        # Each distinct text is parsed once
+        distinct, inverse = np.unique(texts, return_inverse=True)
+        parsed = [parse_serving(text) for text in distinct]
+        grams = np.array(
+            [
+                DEFAULT_SERVING_GRAMS if weight is None else weight
+                for weight, _, _ in parsed
+            ]
+        )[inverse]
+        names = np.array([unit or "" for _, unit, _ in parsed], dtype=object)[inverse]
+        unit_grams = np.array(
+            [np.nan if weight is None else weight for _, _, weight in parsed]
+        )[inverse]
+        for value in np.unique(grams):
+            matching = ids[grams == value].tolist()
+            for offset in range(0, len(matching), BATCH_SIZE):
+                (
+                    foods.filter(id__in=matching[offset : offset + BATCH_SIZE])
+                    .exclude(serving_grams=value)
+                    .update(serving_grams=float(value))
+                )
+        defined = names != ""
+        units.bulk_create(
+            [
+                FoodServingUnit(food_id=food_id, name=name, grams=float(weight))
+                for food_id, name, weight in zip(
+                    ids[defined].tolist(), names[defined], unit_grams[defined]
+                )
+            ],
+            batch_size=BATCH_SIZE,
+        )
+    serving_weight = Subquery(
+        foods.filter(id=OuterRef("food_id")).values("serving_grams")[:1]
+    )
+    RecipeIngredient._base_manager.using(using).update(
+        servings=F("quantity") / serving_weight
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0023_weight_trend"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="food",
+            name="serving_grams",
+            field=models.FloatField(default=100, editable=False),
+        ),
+        migrations.AddField(
+            model_name="recipeingredient",
+            name="servings",
+            field=models.FloatField(default=1.0, editable=False),
+        ),
+        migrations.CreateModel(
+            name="FoodServingUnit",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=30)),
+                ("grams", models.FloatField()),
+                (
+                    "food",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="serving_units",
+                        to="myapp.food",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("food", "name")},
+            },
+        ),
+        migrations.RunPython(
+            parse_serving_sizes,
+            migrations.RunPython.noop,
+            hints={"model_name": "food"},
+        ),
+    ]
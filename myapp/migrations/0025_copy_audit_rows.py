@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-19 10:40
+
+from django.db import connections, migrations
+
+BATCH_SIZE = 2000
+
+
+def copy_audit_rows(apps, schema_editor):
+    """
+    Copy payment history written to `default` before the audit database
+    existed, when this migration runs on the audit database. Primary keys are
+    kept, so rows already copied (by move_audit_data or an earlier run) are
+    skipped. The old rows stay in `default` until `move_audit_data --purge`.
+    Run it (migrate --database=audit) before the app is started with the audit
+    database configured; see SQLITE_AUDIT_DB in mysite/settings.py.
+    """
+    alias = schema_editor.connection.alias
+    if alias == "default":
+        return
+    default = connections["default"]
+    tables = default.introspection.table_names()
+    # Purchases first: payment logs point at them
+    for name in ("SubscriptionPurchase", "PaymentLog"):
+        model = apps.get_model("myapp", name)
+        table = model._meta.db_table
+        if table not in tables:
+            continue
+        # Only the columns the old table has; later fields take their defaults
+        with default.cursor() as cursor:
+            columns = {
+                column.name
+                for column in default.introspection.get_table_description(cursor, table)
+            }
+        fields = [f.attname for f in model._meta.concrete_fields if f.column in columns]
+        rows = model._base_manager.using("default").order_by("pk").values(*fields)
+        batch = []
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            batch.append(model(**row))
+            if len(batch) >= BATCH_SIZE:
+                model._base_manager.using(alias).bulk_create(
+                    batch, ignore_conflicts=True
+                )
+                batch = []
+        if batch:
+            model._base_manager.using(alias).bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0024_serving_grams"),
+    ]
+
+    operations = [
+        # The router only runs this on the database holding the audit models
+        migrations.RunPython(
+            copy_audit_rows,
+            migrations.RunPython.noop,
+            hints={"model_name": "subscriptionpurchase"},
+        ),
+    ]
@@ -2,7 +2,9 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Sum
+from .dirty import DirtyFieldsMixin
+from .nutrients import NutrientVector
+from .partitions import PartitionedManager
 
 # Choices Constants
 MEAL_TYPE_CHOICES = [
@@ -22,17 +24,38 @@ class Food(models.Model):
     fiber = models.FloatField(default=0)
     sugar = models.FloatField(default=0)
     serving_size = models.CharField(max_length=50, default='100g')
+    # Parsed from serving_size (servings.py); nutrients are per serving
+    serving_grams = models.FloatField(default=100, editable=False)
     category = models.CharField(max_length=50, blank=True)
     
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'serving_size' in update_fields:
+            # The parse_serving_size signal sets serving_grams to match
+            kwargs['update_fields'] = {*update_fields, 'serving_grams'}
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['name']
         verbose_name = 'Food'
         verbose_name_plural = 'Foods'
 
-class UserProfile(models.Model):
+class FoodServingUnit(models.Model):
+    """A unit a food's serving size defines ('1 cup (240g)': cup = 240 g)"""
+    food = models.ForeignKey(Food, on_delete=models.CASCADE, related_name='serving_units')
+    name = models.CharField(max_length=30)
+    grams = models.FloatField()
+
+    class Meta:
+        unique_together = ['food', 'name']
+
+    def __str__(self):
+        return f"{self.food.name}: 1 {self.name} = {self.grams:g} g"
+
+class UserProfile(DirtyFieldsMixin, models.Model):
     ACTIVITY_CHOICES = [
         ('sedentary', 'Sedentary (little or no exercise)'),
         ('light', 'Lightly active (light exercise/sports 1-3 days/week)'),
@@ -53,6 +76,7 @@ class UserProfile(models.Model):
     weight = models.FloatField(help_text="Weight in kg", null=True, blank=True)
     activity_level = models.CharField(max_length=20, choices=ACTIVITY_CHOICES, default='moderate')
     weight_goal = models.CharField(max_length=10, choices=GOAL_CHOICES, default='maintain')
+    target_weight = models.FloatField(help_text="Target weight in kg", null=True, blank=True)
     daily_calorie_goal = models.IntegerField(default=2000)
     profile_picture = models.ImageField(upload_to='profile_pics/', null=True, blank=True)
     phone_number = models.CharField(max_length=15, blank=True, null=True, help_text="Phone number")
@@ -62,6 +86,19 @@ class UserProfile(models.Model):
     premium_until = models.DateTimeField(null=True, blank=True)
     stripe_customer_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
     stripe_subscription_id = models.CharField(max_length=255, blank=True, null=True)
+
+    # Flushed in batches from the activity buffer (see activity.py)
+    last_seen_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Partial index: only the (few) premium rows, for expiry checks and premium counts
+            models.Index(
+                fields=['premium_until'],
+                condition=models.Q(is_premium=True),
+                name='profile_active_premium_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.username}'s Profile"
@@ -84,9 +121,15 @@ class WeightLog(models.Model):
     weight = models.FloatField(help_text="Weight in kg")
     date = models.DateField(default=timezone.now)
     notes = models.TextField(blank=True, null=True)
+    # Kept current by the WeightLog signals (see weight_trend.py)
+    trend = models.FloatField(help_text="Smoothed weight in kg", null=True, blank=True, editable=False)
+
+    # Routes per-user queries to the user's partition (see partitions.py)
+    objects = PartitionedManager()
 
     class Meta:
         ordering = ['-date']
+        indexes = [models.Index(fields=['user', 'date'])]
 
 class Recipe(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -100,23 +143,15 @@ class Recipe(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def calculate_nutrition(self):
-        totals = {
-            'calories': 0,
-            'carbs': 0,
-            'protein': 0,
-            'fats': 0
-        }
-        for ingredient in self.recipeingredient_set.all():
-            totals['calories'] += ingredient.food.calories * (ingredient.quantity / 100)
-            totals['carbs'] += ingredient.food.carbs * (ingredient.quantity / 100)
-            totals['protein'] += ingredient.food.protein * (ingredient.quantity / 100)
-            totals['fats'] += ingredient.food.fats * (ingredient.quantity / 100)
-        return totals
+        """NutrientVector of the whole recipe, summed in SQL"""
+        return NutrientVector.total(self.recipeingredient_set.all(), 'food__', 'servings')
 
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
     food = models.ForeignKey(Food, on_delete=models.CASCADE)
     quantity = models.FloatField(help_text="Quantity in grams")
+    # quantity / food.serving_grams, kept current by the signals
+    servings = models.FloatField(default=1.0, editable=False)
     notes = models.CharField(max_length=100, blank=True)
 
 class MealPlan(models.Model):
@@ -187,25 +222,18 @@ class NutritionGoal(models.Model):
             start = date.replace(day=1)
             end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
             
-        consumption = Consume.objects.filter(
-            user=self.user,
-            date_consumed__range=[start, end]
-        ).aggregate(
-            total_calories=Sum('food_consumed__calories'),
-            total_carbs=Sum('food_consumed__carbs'),
-            total_protein=Sum('food_consumed__protein'),
-            total_fats=Sum('food_consumed__fats')
+        consumed = NutrientVector.total(
+            Consume.objects.filter(user=self.user, date_consumed__range=[start, end]),
+            'food_consumed__', 'servings',
+        )
+        target = NutrientVector(
+            self.target_calories or 0, self.target_carbs or 0, self.target_protein or 0, self.target_fats or 0,
         )
         
         return {
             'period': {'start': start, 'end': end},
-            'consumed': consumption,
-            'remaining': {
-                'calories': (self.target_calories or 0) - (consumption['total_calories'] or 0),
-                'carbs': (self.target_carbs or 0) - (consumption['total_carbs'] or 0),
-                'protein': (self.target_protein or 0) - (consumption['total_protein'] or 0),
-                'fats': (self.target_fats or 0) - (consumption['total_fats'] or 0)
-            }
+            'consumed': consumed.as_dict('total_'),
+            'remaining': (target - consumed).as_dict(),
         }
 
 class Consume(models.Model):
@@ -217,8 +245,39 @@ class Consume(models.Model):
     time_consumed = models.TimeField(default=timezone.now)
     notes = models.TextField(blank=True, null=True)
 
+    # Routes per-user queries to the user's partition (see partitions.py)
+    objects = PartitionedManager()
+
     class Meta:
         ordering = ['-date_consumed', '-time_consumed']
+        indexes = [
+            models.Index(fields=['user', 'date_consumed']),
+            models.Index(fields=['user', 'food_consumed']),
+        ]
+
+
+class ConsumeArchiveDay(models.Model):
+    """
+    One user's archived food log entries for one day (see archive.py). The
+    entries are packed into `entries`; the day's totals (servings-weighted)
+    are kept alongside so history needs no unpacking.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_days')
+    date = models.DateField()
+    entry_count = models.PositiveIntegerField(default=0)
+    calories = models.FloatField(default=0)
+    carbs = models.FloatField(default=0)
+    protein = models.FloatField(default=0)
+    fats = models.FloatField(default=0)
+    food_ids = models.TextField(default=',')  # ",12,45," so one food can be found with LIKE
+    entries = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'date']
+
+    def __str__(self):
+        return f"{self.user_id} {self.date}: {self.entry_count} entries"
 
 
 class SubscriptionPlan(models.Model):
@@ -256,8 +315,12 @@ class SubscriptionPurchase(models.Model):
         ('failed', 'Failed'),
     ]
     
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions')
-    plan = models.ForeignKey(SubscriptionPlan, on_delete=models.SET_NULL, null=True)
+    # Lives in the audit database (see routers.py): no cross-database constraints,
+    # and the CASCADE / SET_NULL behaviour is done by signals instead
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='subscriptions'
+    )
+    plan = models.ForeignKey(SubscriptionPlan, on_delete=models.DO_NOTHING, db_constraint=False, null=True)
     stripe_session_id = models.CharField(max_length=255, blank=True)  # Stripe Checkout Session ID
     stripe_payment_intent_id = models.CharField(max_length=255, blank=True)  # Stripe Payment Intent ID
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -284,7 +347,9 @@ class PaymentLog(models.Model):
         ('dispute', 'Dispute'),
     ]
     
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payment_logs')
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='payment_logs'
+    )
     subscription_purchase = models.ForeignKey(
         SubscriptionPurchase, 
         on_delete=models.SET_NULL, 
@@ -384,4 +449,242 @@ class UserAchievement(models.Model):
         ordering = ['-earned_at']
     
     def __str__(self):
-        return f"{self.user.username} earned {self.achievement.name}"
\ No newline at end of file
+        return f"{self.user.username} earned {self.achievement.name}"
+
+class ScheduledJob(models.Model):
+    """State and lock for a periodic job registered in myapp.scheduler"""
+    CATCH_UP_CHOICES = [
+        ('skip', 'Skip missed runs'),
+        ('once', 'Run once for all missed runs'),
+        ('all', 'Run every missed run'),
+    ]
+
+    name = models.CharField(max_length=100, unique=True)
+    schedule = models.CharField(max_length=100)  # cron expression, e.g. "*/5 * * * *"
+    catch_up = models.CharField(max_length=10, choices=CATCH_UP_CHOICES, default='once')
+    is_enabled = models.BooleanField(default=True)
+    next_run_at = models.DateTimeField(null=True, blank=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    last_status = models.CharField(max_length=20, blank=True)
+    last_duration_ms = models.IntegerField(null=True, blank=True)
+
+    # Per-job lock so only one scheduler instance runs a job at a time
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return f"{self.name} ({self.schedule})"
+
+
+class JobRun(models.Model):
+    """Run history for scheduled jobs"""
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('success', 'Success'),
+        ('failed', 'Failed'),
+    ]
+
+    job = models.ForeignKey(ScheduledJob, on_delete=models.CASCADE, related_name='runs')
+    scheduled_for = models.DateTimeField()
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.IntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    result = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.job.name} @ {self.started_at:%Y-%m-%d %H:%M} ({self.status})"
+
+
+class UserSearchPrefix(models.Model):
+    """Prefixes of normalized username/email/name tokens for control panel search"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_prefixes')
+    prefix = models.CharField(max_length=10)
+
+    class Meta:
+        indexes = [models.Index(fields=['prefix', 'user'])]
+
+
+class UserSearchTrigram(models.Model):
+    """Trigrams of the same tokens, used for fuzzy matching when no prefix matches"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_trigrams')
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        indexes = [models.Index(fields=['trigram', 'user'])]
+
+
+class PlatformStats(models.Model):
+    """
+    Single-row counter store for the control panel header.
+    Maintained incrementally by signals (see stats.py) and periodically reconciled.
+    """
+    total_users = models.IntegerField(default=0)
+    active_users = models.IntegerField(default=0)
+    premium_users = models.IntegerField(default=0)
+    new_users_date = models.DateField(null=True, blank=True)
+    new_users_today = models.IntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Platform stats'
+
+    def __str__(self):
+        return f"{self.total_users} users, {self.premium_users} premium"
+
+    def get_new_users_today(self):
+        if self.new_users_date == timezone.localdate():
+            return self.new_users_today
+        return 0
+
+
+class UserLifetimeStats(models.Model):
+    """
+    Precomputed per-user totals over the whole food log.
+    Maintained incrementally by the Consume signals (see stats.py).
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='lifetime_stats')
+    total_entries = models.IntegerField(default=0)
+    total_calories = models.FloatField(default=0)  # servings-weighted
+    days_logged = models.IntegerField(default=0)
+    distinct_foods = models.IntegerField(default=0)
+    first_log_date = models.DateField(null=True, blank=True)
+    last_log_date = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'User lifetime stats'
+
+    def __str__(self):
+        return f"{self.user.username}'s lifetime stats"
+
+    @property
+    def average_daily_calories(self):
+        """Average intake over the days the user actually logged food"""
+        if not self.days_logged:
+            return 0
+        return self.total_calories / self.days_logged
+
+
+class EnergyEstimate(models.Model):
+    """
+    A user's energy expenditure as fitted from their intake and weight log,
+    and where it takes them (see energy.py). Refreshed shortly after each log.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='energy_estimate')
+    tdee = models.FloatField(null=True, blank=True)  # kcal/day
+    confidence = models.FloatField(default=0)  # 0 = formula only, 1 = fully from the logs
+    intake_average = models.FloatField(null=True, blank=True)  # kcal/day over the latest window
+    weight_trend = models.FloatField(null=True, blank=True)  # kg/week
+    trend_weight = models.FloatField(null=True, blank=True)  # kg, smoothed, as of computed_for
+    days_logged = models.IntegerField(default=0)
+    weigh_ins = models.IntegerField(default=0)
+    suggested_calories = models.IntegerField(null=True, blank=True)
+    target_date = models.DateField(null=True, blank=True)
+    computed_for = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.tdee or '?'} kcal/day"
+
+
+class EnergyRefresh(models.Model):
+    """A user whose energy estimate is out of date, queued for the scheduler (see energy.py)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    queued_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class UserDeletion(models.Model):
+    """
+    A user queued for background deletion (see deletion.py).
+    Keeps a plain user id since the user row is deleted at the end.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    user_id = models.IntegerField(db_index=True)
+    username = models.CharField(max_length=150)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    current_step = models.CharField(max_length=50, blank=True)
+    rows_deleted = models.IntegerField(default=0)
+    total_rows = models.IntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Delete {self.username} ({self.status})"
+
+    @property
+    def progress_percent(self):
+        if self.status == 'done':
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(99, int(self.rows_deleted * 100 / self.total_rows))
+
+
+class DailyActiveUser(models.Model):
+    """One row per user per day they were active; DAU/WAU/MAU are counts over this table"""
+    date = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='active_days')
+
+    class Meta:
+        unique_together = ['date', 'user']
+        indexes = [models.Index(fields=['user', 'date'])]
+
+
+class WebhookEvent(models.Model):
+    """Every Stripe webhook event received, stored once (audit database)"""
+    STATUS_CHOICES = [
+        ('received', 'Received'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    stripe_event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='received')
+    error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-received_at']
+
+    def __str__(self):
+        return f"{self.event_type} ({self.stripe_event_id})"
+
+
+class AuditLog(models.Model):
+    """Admin actions on user accounts (audit database; users kept by id and name)"""
+    actor_id = models.IntegerField(null=True, blank=True)
+    actor_username = models.CharField(max_length=150, blank=True)
+    action = models.CharField(max_length=50)
+    target_user_id = models.IntegerField(null=True, blank=True, db_index=True)
+    target_username = models.CharField(max_length=150, blank=True)
+    details = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.actor_username} {self.action} {self.target_username}".strip()
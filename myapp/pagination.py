@@ -0,0 +1,180 @@
+"""
+Keyset (cursor) pagination for large tables
+
+Instead of COUNT(*) + OFFSET, each page seeks past the last row of the previous
+page using an index on (sort column, id), so page 50,000 costs the same as page 1.
+Totals come from an approximate count that is cached for a short while.
+"""
+import base64
+import hashlib
+import json
+import math
+
+from django.core.cache import cache
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+COUNT_CACHE_TIMEOUT = 60  # seconds
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, pk, page):
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    raw = json.dumps({'v': value, 'id': pk, 'p': page}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return data['v'], int(data['id']), int(data['p'])
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor(f"Invalid cursor '{cursor}'")
+
+
+def approximate_count(queryset, key, timeout=COUNT_CACHE_TIMEOUT):
+    """COUNT(*) cached per filter, so repeated page loads don't rescan the table"""
+    cache_key = 'approx_count:' + hashlib.md5(key.encode()).hexdigest()
+    count = cache.get(cache_key)
+    if count is None:
+        count = queryset.count()
+        cache.set(cache_key, count, timeout)
+    return count
+
+
+class KeysetPage:
+    """One page of results, with cursors to the neighbouring pages"""
+
+    def __init__(self, object_list, number, has_previous, has_next, prev_cursor, next_cursor, total_count, per_page):
+        self.object_list = object_list
+        self.number = number
+        self._has_previous = has_previous
+        self._has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.total_count = total_count
+        self.total_pages = max(1, math.ceil(total_count / per_page), number)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset ordered by a single column plus the primary key.
+
+    Usage:
+        paginator = KeysetPaginator(users, '-date_joined', per_page=10, count_key='admin_users')
+        page = paginator.page(request.GET.get('cursor'), direction=request.GET.get('direction', 'next'))
+    """
+
+    def __init__(self, queryset, ordering, per_page=10, count_key=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.descending = ordering.startswith('-')
+        self.field_name = ordering.lstrip('-')
+        field = queryset.model._meta.get_field(self.field_name)
+        self.nullable = field.null
+        # A unique column orders rows on its own; no id tie-breaker needed
+        self.unique = field.unique or field.primary_key
+        self.count_key = count_key or str(queryset.query)
+
+    def _ordering(self, descending, nulls_last):
+        expressions = []
+        if self.nullable:
+            nulls = {'nulls_last': True} if nulls_last else {'nulls_first': True}
+            expressions.append(F(self.field_name).desc(**nulls) if descending else F(self.field_name).asc(**nulls))
+        else:
+            expressions.append(F(self.field_name).desc() if descending else F(self.field_name).asc())
+        if not self.unique:
+            expressions.append(F('pk').desc() if descending else F('pk').asc())
+        return expressions
+
+    def _seek(self, value, pk, descending, nulls_last):
+        """Q for rows strictly after (value, pk) in the given ordering"""
+        op = 'lt' if descending else 'gt'
+        field = self.field_name
+        if value is None:
+            in_null_tail = Q(**{f'{field}__isnull': True, f'pk__{op}': pk})
+            if nulls_last:
+                return in_null_tail
+            return Q(**{f'{field}__isnull': False}) | in_null_tail
+
+        condition = Q(**{f'{field}__{op}': value})
+        if not self.unique:
+            condition |= Q(**{field: value, f'pk__{op}': pk})
+        if self.nullable and nulls_last:
+            condition |= Q(**{f'{field}__isnull': True})
+        return condition
+
+    def _parse_value(self, value):
+        if isinstance(value, str) and self.field_name in ('date_joined', 'last_login'):
+            return parse_datetime(value)
+        return value
+
+    def page(self, cursor=None, direction='next'):
+        """
+        direction is 'next' or 'prev' relative to the cursor, or 'last' for the final page
+        (no cursor needed). Without a cursor the first page is returned.
+        """
+        total_count = approximate_count(self.queryset, self.count_key)
+        total_pages = max(1, math.ceil(total_count / self.per_page))
+
+        number = 1
+        descending, nulls_last = self.descending, True
+        queryset = self.queryset
+        reverse = direction in ('prev', 'last')
+
+        if direction == 'last':
+            number = total_pages
+            cursor = None
+        elif cursor:
+            value, pk, page_number = decode_cursor(cursor)
+            value = self._parse_value(value)
+            number = max(1, page_number - 1) if reverse else page_number + 1
+
+        if reverse:
+            # Walk the index backwards and flip the rows afterwards
+            descending, nulls_last = not descending, not nulls_last
+        if cursor and direction in ('next', 'prev'):
+            queryset = queryset.filter(self._seek(value, pk, descending, nulls_last))
+
+        rows = list(queryset.order_by(*self._ordering(descending, nulls_last))[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        if reverse:
+            has_previous, has_next = has_more, direction == 'prev'
+        else:
+            has_previous, has_next = bool(cursor), has_more
+        if not has_previous:
+            number = 1
+
+        prev_cursor = next_cursor = None
+        if rows:
+            first, last = rows[0], rows[-1]
+            if has_previous:
+                prev_cursor = encode_cursor(getattr(first, self.field_name), first.pk, number)
+            if has_next:
+                next_cursor = encode_cursor(getattr(last, self.field_name), last.pk, number)
+
+        return KeysetPage(rows, number, has_previous, has_next, prev_cursor, next_cursor, total_count, self.per_page)
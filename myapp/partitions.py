@@ -0,0 +1,203 @@
+"""
+User-hash partitioning of the food log
+
+Consume grows with every meal of every user, but every hot query is scoped
+to one user. With CONSUME_PARTITIONS = N > 1 (SQLite only), Consume (and,
+with PARTITION_WEIGHT_LOG, WeightLog) rows live in N extra SQLite files,
+aliases partition_0 ... partition_N-1, chosen by a hash of the user id.
+Each user's queries hit one small table and its indexes, and writes to one
+partition don't take the write lock of the others or of the main database.
+
+Routing (PartitionRouter in routers.py):
+- saves and deletes of instances go to their user's partition;
+- user.consume_set and friends go to the user's partition;
+- queries go there through PartitionedQuerySet, which picks the partition
+  from a user / user_id filter, a Q() of one, a user__in whose users all
+  share a partition, or a create() keyword. Any other query raises
+  UnroutedQueryError when it runs instead of reading the unpartitioned
+  table in default, so code that needs every user's rows has to loop over
+  partition_aliases() itself (see deletion.py, the Food/User signals and
+  PartitionedAdminMixin in admin.py) or name a database with using().
+
+Each partition connection ATTACHes the main database, so joins from the
+food log to myapp_food and auth_user (select_related('food_consumed'),
+Sum('food_consumed__calories')) still work in SQL. SQLite can't enforce
+foreign keys into an attached database, so they are off on partition
+connections and the cascades are done by signals instead.
+
+Ids are unique per partition only; nothing refers to these rows by id
+without also naming the user. After changing N, run `rebalance_partitions`
+to move existing rows (also from the unpartitioned table in default) to
+their new partition. Until it finishes, moved users see a partial history.
+"""
+import zlib
+
+from django.conf import settings
+from django.db import models
+
+PARTITION_PREFIX = 'partition_'
+USER_LOOKUPS = ('user', 'user_id', 'user__id', 'user__pk')
+USER_IN_LOOKUPS = tuple(lookup + '__in' for lookup in USER_LOOKUPS)
+
+
+class UnroutedQueryError(Exception):
+    """A query on a partitioned model that names neither a user nor a database"""
+
+
+def partition_count():
+    return getattr(settings, 'CONSUME_PARTITIONS', 1)
+
+
+def partitioning_enabled():
+    return partition_count() > 1
+
+
+def partition_aliases():
+    if not partitioning_enabled():
+        return []
+    return [f'{PARTITION_PREFIX}{index}' for index in range(partition_count())]
+
+
+def is_partition_alias(alias):
+    return alias in partition_aliases()
+
+
+def partitioned_labels():
+    labels = {'myapp.consume'}
+    if getattr(settings, 'PARTITION_WEIGHT_LOG', False):
+        labels.add('myapp.weightlog')
+    return labels
+
+
+def is_partitioned_label(label):
+    return partitioning_enabled() and label in partitioned_labels()
+
+
+def is_partitioned(model):
+    """Takes a model class or instance"""
+    return is_partitioned_label(model._meta.label_lower)
+
+
+def partitioned_models():
+    from django.apps import apps
+
+    return [apps.get_model(label) for label in sorted(partitioned_labels())] if partitioning_enabled() else []
+
+
+def partition_for_user(user_id):
+    # crc32 rather than hash(): it must be the same in every process
+    index = zlib.crc32(str(user_id).encode()) % partition_count()
+    return f'{PARTITION_PREFIX}{index}'
+
+
+def model_databases(model):
+    """Every database that holds rows of model"""
+    if is_partitioned(model):
+        return partition_aliases()
+    return [model._base_manager.db]
+
+
+def _plain_user_id(value):
+    """A user or user id as an id; None for expressions such as OuterRef('pk')"""
+    if isinstance(value, models.Model):
+        return value.pk
+    if isinstance(value, (int, str)):
+        return value
+    return None
+
+
+def _filter_lookups(args, kwargs):
+    """(lookup, value) pairs every matching row satisfies: kwargs and ANDed, non-negated Q()s"""
+    lookups = list(kwargs.items())
+    pending = list(args)
+    while pending:
+        condition = pending.pop()
+        if not isinstance(condition, models.Q) or condition.negated or condition.connector != models.Q.AND:
+            continue
+        for child in condition.children:
+            if isinstance(child, tuple):
+                lookups.append(child)
+            else:
+                pending.append(child)
+    return lookups
+
+
+def _user_id(args, kwargs):
+    """A user id whose partition holds every row the filter can match, or None"""
+    for lookup, value in _filter_lookups(args, kwargs):
+        if lookup in USER_LOOKUPS:
+            user_id = _plain_user_id(value)
+            if user_id is not None:
+                return user_id
+        elif lookup in USER_IN_LOOKUPS and isinstance(value, (list, tuple, set, frozenset)):
+            user_ids = [_plain_user_id(item) for item in value]
+            if user_ids and None not in user_ids and len({partition_for_user(u) for u in user_ids}) == 1:
+                return user_ids[0]
+    return None
+
+
+def disable_foreign_keys(connection):
+    if is_partition_alias(connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA foreign_keys = OFF')
+
+
+def attach_main_database(connection):
+    """Called for every new connection; sets up partition connections"""
+    if not is_partition_alias(connection.alias):
+        return
+    from django.db import connections
+
+    main = str(connections['default'].settings_dict['NAME'])
+    disable_foreign_keys(connection)
+    with connection.cursor() as cursor:
+        cursor.execute('ATTACH DATABASE %s AS main_db', [main])
+
+
+class PartitionedQuerySet(models.QuerySet):
+    """Routes itself to the user's partition when filtered or created by user"""
+
+    @property
+    def db(self):
+        if self._db is None and is_partitioned(self.model) and 'instance' not in self._hints:
+            raise UnroutedQueryError(
+                f'{self.model.__name__} is partitioned by user: filter by one user, '
+                f'or loop over partition_aliases() with using()'
+            )
+        return super().db
+
+    def _for_user_kwargs(self, kwargs, args=()):
+        if self._db is None and is_partitioned(self.model):
+            user_id = _user_id(args, kwargs)
+            if user_id is not None:
+                return self.using(partition_for_user(user_id))
+        return self
+
+    def _filter_or_exclude(self, negate, args, kwargs):
+        queryset = self if negate else self._for_user_kwargs(kwargs, args)
+        return super(PartitionedQuerySet, queryset)._filter_or_exclude(negate, args, kwargs)
+
+    def create(self, **kwargs):
+        return super(PartitionedQuerySet, self._for_user_kwargs(kwargs)).create(**kwargs)
+
+    def get_or_create(self, defaults=None, **kwargs):
+        return super(PartitionedQuerySet, self._for_user_kwargs(kwargs)).get_or_create(defaults, **kwargs)
+
+    def update_or_create(self, defaults=None, create_defaults=None, **kwargs):
+        return super(PartitionedQuerySet, self._for_user_kwargs(kwargs)).update_or_create(
+            defaults, create_defaults, **kwargs
+        )
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None or not is_partitioned(self.model):
+            return super().bulk_create(objs, *args, **kwargs)
+        by_partition = {}
+        for obj in objs:
+            by_partition.setdefault(partition_for_user(obj.user_id), []).append(obj)
+        created = []
+        for alias, partition_objs in by_partition.items():
+            created.extend(super(PartitionedQuerySet, self.using(alias)).bulk_create(partition_objs, *args, **kwargs))
+        return created
+
+
+PartitionedManager = models.Manager.from_queryset(PartitionedQuerySet)
@@ -0,0 +1,155 @@
+"""
+Read replica routing
+
+Heavy read-only pages (control-panel lists and stats, user detail,
+analytics, shopping lists) can read from a `replica` database so they don't
+compete with interactive writes on the primary. Nothing reads from the
+replica unless asked: views opt in with @read_from_replica, and other code
+can wrap queries in `with use_replica():`. Querysets are lazy, so they
+must be evaluated inside the block. Writes always go to `default` (see
+ReplicaRouter in routers.py).
+
+Read-your-writes: once a request writes (a non-GET request, or a model
+write routed during the request), ReplicaMiddleware sets a short-lived
+cookie. While the cookie is present, that browser's reads stay on the
+primary. It lasts REPLICA_STICKY_SECONDS, which should cover the replica's
+lag. Within a request, reads also go back to the primary after its first write.
+
+For local testing the replica can be a SQLite snapshot of the primary
+(REPLICA_MODE=snapshot). The refresh_replica_snapshot job copies it with
+SQLite's online backup API every minute and swaps the new file in
+atomically.
+"""
+import contextvars
+import os
+import sqlite3
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+REPLICA_DATABASE = 'replica'
+REPLICA_PIN_COOKIE = 'replica_pin'
+
+# Per request (or task): whether reads may use the replica right now,
+# whether this request/browser must read its own writes, and whether it wrote
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+_pinned = contextvars.ContextVar('replica_pinned', default=False)
+_wrote = contextvars.ContextVar('replica_wrote', default=None)
+
+
+def replica_configured():
+    return REPLICA_DATABASE in settings.DATABASES
+
+
+def is_snapshot_replica():
+    return replica_configured() and getattr(settings, 'REPLICA_SNAPSHOT', False)
+
+
+def replica_available():
+    if not replica_configured():
+        return False
+    if is_snapshot_replica() and not settings.DATABASES[REPLICA_DATABASE].get('TEST', {}).get('MIRROR'):
+        # No snapshot taken yet
+        return os.path.exists(settings.DATABASES[REPLICA_DATABASE]['NAME'])
+    return True
+
+
+def reads_from_replica():
+    """Whether reads routed right now should go to the replica"""
+    if not _use_replica.get() or _pinned.get():
+        return False
+    wrote = _wrote.get()
+    return not (wrote and wrote[0])
+
+
+def record_write():
+    wrote = _wrote.get()
+    if wrote is not None:
+        wrote[0] = True
+
+
+@contextmanager
+def use_replica():
+    """Route reads inside the block to the replica, if there is one"""
+    token = _use_replica.set(replica_available())
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Route reads inside the block to the primary, e.g. when they are written back"""
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def read_from_replica(view_func):
+    """View decorator: the view's reads go to the replica (after the auth checks)"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        # Load the session user from the primary first: someone who has just
+        # signed up isn't in the replica yet
+        if hasattr(request, 'user'):
+            request.user.is_authenticated  # resolves the lazy user
+        with use_replica():
+            return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaMiddleware:
+    """Keeps a browser's reads on the primary for a while after it writes"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = _pinned.set(REPLICA_PIN_COOKIE in request.COOKIES)
+        wrote = _wrote.set([False])
+        try:
+            response = self.get_response(request)
+            has_written = _wrote.get()[0] or request.method not in ('GET', 'HEAD', 'OPTIONS')
+        finally:
+            _pinned.reset(pinned)
+            _wrote.reset(wrote)
+        if has_written and replica_configured():
+            response.set_cookie(
+                REPLICA_PIN_COOKIE, '1',
+                max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 5),
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+
+def refresh_replica_snapshot():
+    """
+    Copy the primary SQLite database over the snapshot replica. The copy is
+    written next to the replica and renamed over it, so readers see either
+    the old or the new snapshot. Returns the snapshot size in bytes.
+    """
+    source = str(settings.DATABASES['default']['NAME'])
+    target = str(settings.DATABASES[REPLICA_DATABASE]['NAME'])
+    partial = f'{target}.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(partial)
+    try:
+        # Consistent copy even while the primary is being written to
+        src.backup(dst)
+        # The snapshot is never written, so it needs no WAL files
+        dst.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        dst.close()
+        src.close()
+    os.replace(partial, target)
+    # This process's replica connection may still have the old file open
+    connections[REPLICA_DATABASE].close()
+    return os.path.getsize(target)
@@ -0,0 +1,135 @@
+"""
+Database routing
+
+AuditRouter keeps append-mostly payment and audit tables (SubscriptionPurchase,
+PaymentLog, WebhookEvent, AuditLog) in the `audit` database when one is
+configured, so payment bursts and audit writes don't compete with food-log
+writes for SQLite's single write lock. Everything else stays on `default`.
+
+Django can't join or enforce foreign keys across databases, so the audit
+models point at User and SubscriptionPlan with db_constraint=False and
+on_delete=DO_NOTHING. The cleanup those cascades used to do is done by
+signals (see signals.py) and the user deletion pipeline, and nothing may
+select_related() across the two databases.
+
+PartitionRouter spreads the food log over per-user-hash partitions when
+CONSUME_PARTITIONS is set; see partitions.py. ReplicaRouter sends the reads
+of opted-in views to a read replica; see replica.py.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from .partitions import is_partition_alias, is_partitioned, is_partitioned_label, partition_for_user
+from .replica import REPLICA_DATABASE, reads_from_replica, record_write, replica_configured
+
+AUDIT_DATABASE = 'audit'
+AUDIT_MODELS = {
+    'myapp.subscriptionpurchase',
+    'myapp.paymentlog',
+    'myapp.webhookevent',
+    'myapp.auditlog',
+}
+
+
+def audit_database():
+    """Alias holding the audit models: `audit` if configured, else `default`"""
+    return AUDIT_DATABASE if AUDIT_DATABASE in settings.DATABASES else 'default'
+
+
+def is_audit_model(model):
+    """Takes a model class or instance"""
+    return model._meta.label_lower in AUDIT_MODELS
+
+
+class AuditRouter:
+
+    def db_for_read(self, model, **hints):
+        if is_audit_model(model):
+            return audit_database()
+        instance = hints.get('instance')
+        if instance is not None and is_audit_model(instance):
+            # purchase.user: Django would otherwise look in the instance's database
+            return 'default'
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Audit rows refer to users and plans by id across databases
+        if is_audit_model(obj1) or is_audit_model(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if audit_database() == 'default':
+            return None
+        is_audit = model_name is not None and f'{app_label}.{model_name}' in AUDIT_MODELS
+        if db == AUDIT_DATABASE:
+            # Only the audit tables; skips RunSQL/RunPython meant for the main schema
+            return is_audit
+        if is_audit:
+            return False
+        return None
+
+
+class PartitionRouter:
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if is_partitioned(model):
+            if instance is not None and is_partitioned(instance):
+                # Saving or deleting a row: its user's partition
+                return partition_for_user(instance.user_id)
+            if isinstance(instance, User):
+                # user.consume_set
+                return partition_for_user(instance.pk)
+            return None
+        if instance is not None and is_partitioned(instance):
+            # consume.food_consumed lives in the main database
+            return 'default'
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_partitioned(obj1) or is_partitioned(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if is_partition_alias(db):
+            # Only the partitioned tables; the default database keeps its own
+            # (unpartitioned) copies so partitioning can be switched off again
+            return model_name is not None and is_partitioned_label(f'{app_label}.{model_name}')
+        return None
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the replica inside use_replica() / @read_from_replica
+    views (see replica.py) and every write to the primary, including saves
+    of objects that were loaded from the replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        if reads_from_replica():
+            return REPLICA_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        if not replica_configured():
+            return None
+        record_write()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary
+        databases = {'default', REPLICA_DATABASE}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA_DATABASE:
+            return False
+        return None
@@ -0,0 +1,280 @@
+"""
+In-app periodic job scheduler
+
+Jobs are plain functions registered with the @job decorator (see myapp/jobs.py)
+and executed by the long-running `python manage.py run_scheduler` command, so
+operational tasks don't need an external cron paying Django startup each time.
+"""
+import logging
+import os
+import random
+import socket
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Registered jobs by name, filled in by the @job decorator
+_registry = {}
+
+
+class CronSchedule:
+    """
+    Minimal cron expression: "minute hour day-of-month month day-of-week".
+    Each field accepts *, */n, a-b, a-b/n, and comma separated lists.
+    Day-of-week uses cron numbering (0 = Sunday).
+    """
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Invalid cron expression '{expression}': expected 5 fields")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self._parse_field(part, low, high) for part, (low, high) in zip(parts, self.FIELD_RANGES)
+        ]
+        # Standard cron: if both day fields are restricted, either may match
+        self.days_restricted = parts[2] != '*'
+        self.weekdays_restricted = parts[4] != '*'
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        values = set()
+        for chunk in field.split(','):
+            step = 1
+            if '/' in chunk:
+                chunk, step = chunk.split('/')
+                step = int(step)
+            if chunk == '*':
+                start, end = low, high
+            elif '-' in chunk:
+                start, end = (int(v) for v in chunk.split('-'))
+            else:
+                start = end = int(chunk)
+                if step > 1:
+                    end = high
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Invalid cron field '{field}'")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt):
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, dt):
+        """Return the first matching minute strictly after dt"""
+        candidate = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 4)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (candidate.month == 12)
+                month = candidate.month % 12 + 1
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+
+class Job:
+    """A registered periodic job"""
+
+    def __init__(self, name, func, schedule, jitter=0, catch_up='once', max_catch_up=24,
+                 grace=60, lock_timeout=3600):
+        if catch_up not in ('skip', 'once', 'all'):
+            raise ValueError(f"Invalid catch-up policy '{catch_up}' for job {name}")
+        self.name = name
+        self.func = func
+        self.schedule = CronSchedule(schedule)
+        self.jitter = jitter  # seconds of random delay added to every run
+        self.catch_up = catch_up
+        self.max_catch_up = max_catch_up
+        self.grace = grace  # seconds after which a slot counts as missed
+        self.lock_timeout = lock_timeout
+
+    def next_run(self, after):
+        next_slot = self.schedule.next_after(after)
+        if self.jitter:
+            next_slot += timedelta(seconds=random.uniform(0, self.jitter))
+        return next_slot
+
+    def due_slots(self, next_run_at, now):
+        """Apply the catch-up policy to the slots between next_run_at and now"""
+        slots = []
+        slot = next_run_at
+        while slot <= now:
+            slots.append(slot)
+            slot = self.schedule.next_after(slot)
+
+        if not slots:
+            return []
+        if self.catch_up == 'all':
+            return slots[-self.max_catch_up:]
+        if self.catch_up == 'once':
+            return [slots[-1]]
+        # 'skip': only run a slot that is still within its grace period
+        return [s for s in slots[-1:] if (now - s).total_seconds() <= self.grace]
+
+
+def job(schedule, name=None, jitter=0, catch_up='once', max_catch_up=24, grace=60, lock_timeout=3600):
+    """
+    Register a function as a periodic job.
+
+    Usage:
+        @job('*/15 * * * *', jitter=30)
+        def expire_premium_subscriptions():
+            ...
+
+    The function's return value (if any) is stored on the JobRun as its result.
+    """
+    def decorator(func):
+        job_name = name or func.__name__
+        _registry[job_name] = Job(
+            job_name, func, schedule,
+            jitter=jitter, catch_up=catch_up, max_catch_up=max_catch_up,
+            grace=grace, lock_timeout=lock_timeout,
+        )
+        return func
+    return decorator
+
+
+def get_jobs():
+    """Return registered jobs, importing myapp.jobs so its decorators run"""
+    import_module('myapp.jobs')
+    return dict(_registry)
+
+
+def get_owner():
+    """Lock owner identifier for this scheduler process"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def sync_jobs(now=None):
+    """Create or update ScheduledJob rows to match the registry"""
+    from .models import ScheduledJob
+
+    now = now or timezone.now()
+    jobs = get_jobs()
+    states = {state.name: state for state in ScheduledJob.objects.filter(name__in=jobs)}
+
+    for name, registered in jobs.items():
+        state = states.get(name)
+        if state is None:
+            ScheduledJob.objects.create(
+                name=name,
+                schedule=registered.schedule.expression,
+                catch_up=registered.catch_up,
+                next_run_at=registered.next_run(now),
+            )
+        elif state.schedule != registered.schedule.expression or state.catch_up != registered.catch_up:
+            # Schedule changed: start counting from now instead of replaying old slots
+            state.schedule = registered.schedule.expression
+            state.catch_up = registered.catch_up
+            state.next_run_at = registered.next_run(now)
+            state.save(update_fields=['schedule', 'catch_up', 'next_run_at'])
+    return jobs
+
+
+def acquire_lock(name, owner, timeout):
+    """Atomically take the per-job lock. Returns True if this owner got it."""
+    from .models import ScheduledJob
+
+    now = timezone.now()
+    return ScheduledJob.objects.filter(name=name).filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now) | Q(locked_by=owner)
+    ).update(locked_by=owner, locked_until=now + timedelta(seconds=timeout)) == 1
+
+
+def release_lock(name, owner):
+    from .models import ScheduledJob
+
+    ScheduledJob.objects.filter(name=name, locked_by=owner).update(locked_by='', locked_until=None)
+
+
+def execute(registered, state, scheduled_for):
+    """Run a job once and record its run history"""
+    from .models import JobRun
+
+    run = JobRun.objects.create(job=state, scheduled_for=scheduled_for, started_at=timezone.now())
+    started = time.monotonic()
+    try:
+        result = registered.func()
+        run.status = 'success'
+        run.result = '' if result is None else str(result)
+    except Exception as e:
+        logger.exception(f"Scheduled job {registered.name} failed")
+        run.status = 'failed'
+        run.result = str(e)
+
+    run.duration_ms = int((time.monotonic() - started) * 1000)
+    run.finished_at = timezone.now()
+    run.save(update_fields=['status', 'result', 'duration_ms', 'finished_at'])
+    return run
+
+
+def run_pending(owner=None, now=None):
+    """
+    Run every job that is due. Returns the list of JobRun records created.
+    Safe to call from several scheduler instances at once thanks to the job locks.
+    """
+    from .models import ScheduledJob
+
+    owner = owner or get_owner()
+    now = now or timezone.now()
+    jobs = sync_jobs(now)
+    runs = []
+
+    due = ScheduledJob.objects.filter(name__in=jobs, is_enabled=True, next_run_at__lte=now)
+    for state in due:
+        registered = jobs[state.name]
+        if not acquire_lock(state.name, owner, registered.lock_timeout):
+            logger.info(f"Skipping job {state.name}: locked by {state.locked_by}")
+            continue
+
+        try:
+            state.refresh_from_db()
+            if state.next_run_at > now:
+                # Another instance ran it between our query and taking the lock
+                continue
+
+            slots = registered.due_slots(state.next_run_at, now)
+            if not slots:
+                logger.info(f"Skipping missed runs of job {state.name}")
+            for scheduled_for in slots:
+                run = execute(registered, state, scheduled_for)
+                runs.append(run)
+                state.last_run_at = run.started_at
+                state.last_status = run.status
+                state.last_duration_ms = run.duration_ms
+
+            state.next_run_at = registered.next_run(timezone.now())
+            state.save(update_fields=['next_run_at', 'last_run_at', 'last_status', 'last_duration_ms'])
+        finally:
+            release_lock(state.name, owner)
+
+    return runs
+
+
+def seconds_until_next_run(default=30):
+    """How long the scheduler loop can sleep before the next job is due"""
+    from .models import ScheduledJob
+
+    next_job = ScheduledJob.objects.filter(is_enabled=True, next_run_at__isnull=False).order_by('next_run_at').first()
+    if not next_job:
+        return default
+    wait = (next_job.next_run_at - timezone.now()).total_seconds()
+    return max(1, min(default, wait))
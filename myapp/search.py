@@ -0,0 +1,182 @@
+"""
+Control panel user search index
+
+Usernames, emails and names are split into normalized lowercase tokens. Every
+token prefix (up to MAX_PREFIX_LENGTH characters) is stored in UserSearchPrefix
+and every token trigram in UserSearchTrigram, so keystroke searches are indexed
+equality lookups instead of LIKE '%x%' scans over four columns.
+The index is kept in sync by the User post_save signal (see signals.py).
+
+On PostgreSQL, fuzzy matching uses pg_trgm instead: the auth_user columns
+have GIN trigram indexes (migration 0019), so the trigram table isn't needed.
+"""
+import hashlib
+import re
+import unicodedata
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import Greatest
+
+MAX_PREFIX_LENGTH = 10
+SEARCH_FIELDS = ('username', 'email', 'first_name', 'last_name')
+
+# Fuzzy matching: share at least this fraction of the query's trigrams
+FUZZY_THRESHOLD = 0.5
+FUZZY_LIMIT = 200
+
+# Identical searches within this window (repeated keystrokes, several admins
+# typing the same thing) share one result
+RESULT_CACHE_TIMEOUT = 10  # seconds
+
+_token_re = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text):
+    """Lowercase and strip accents"""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    return _token_re.findall(normalize(text))
+
+
+def user_tokens(user):
+    tokens = set()
+    for field in SEARCH_FIELDS:
+        tokens.update(tokenize(getattr(user, field)))
+    return tokens
+
+
+def token_prefixes(tokens):
+    return {token[:length] for token in tokens for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1)}
+
+
+def token_trigrams(tokens):
+    grams = set()
+    for token in tokens:
+        padded = f'  {token} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def uses_pg_trigram():
+    return connection.vendor == 'postgresql'
+
+
+def index_user(user):
+    """(Re)build the search rows for one user"""
+    from .models import UserSearchPrefix, UserSearchTrigram
+
+    tokens = user_tokens(user)
+    UserSearchPrefix.objects.filter(user=user).delete()
+    UserSearchPrefix.objects.bulk_create(
+        UserSearchPrefix(user_id=user.pk, prefix=prefix) for prefix in token_prefixes(tokens)
+    )
+    if uses_pg_trigram():
+        return
+    UserSearchTrigram.objects.filter(user=user).delete()
+    UserSearchTrigram.objects.bulk_create(
+        UserSearchTrigram(user_id=user.pk, trigram=gram) for gram in token_trigrams(tokens)
+    )
+
+
+def prefix_filter(tokens):
+    """Q matching users where every query token is a prefix of one of their tokens"""
+    from .models import UserSearchPrefix
+
+    condition = Q()
+    for token in tokens:
+        condition &= Q(id__in=UserSearchPrefix.objects.filter(prefix=token[:MAX_PREFIX_LENGTH]).values('user_id'))
+        if len(token) > MAX_PREFIX_LENGTH:
+            # Narrowed by the indexed prefix first, then checked in full
+            condition &= (
+                Q(username__icontains=token) | Q(email__icontains=token) |
+                Q(first_name__icontains=token) | Q(last_name__icontains=token)
+            )
+    return condition
+
+
+def fuzzy_user_ids(tokens):
+    """Ids of users sharing enough trigrams with the query, best matches first"""
+    from .models import UserSearchTrigram
+
+    if uses_pg_trigram():
+        return pg_fuzzy_user_ids(tokens)
+
+    grams = token_trigrams(tokens)
+    needed = max(1, int(len(grams) * FUZZY_THRESHOLD))
+    return list(
+        UserSearchTrigram.objects.filter(trigram__in=grams)
+        .values('user_id')
+        .annotate(hits=Count('id'))
+        .filter(hits__gte=needed)
+        .order_by('-hits')
+        .values_list('user_id', flat=True)[:FUZZY_LIMIT]
+    )
+
+
+def pg_fuzzy_user_ids(tokens):
+    """pg_trgm word similarity against the raw columns, served by their GIN indexes"""
+    from django.contrib.auth.models import User
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    query = ' '.join(tokens)
+    condition = Q()
+    for field in SEARCH_FIELDS:
+        condition |= Q(**{f'{field}__trigram_word_similar': query})
+    # Word similarity is the share of the query's trigrams found, so the same
+    # cut-off as the trigram table (pg_trgm's default of 0.6 is stricter),
+    # less half a trigram so float rounding can't drop a match at the cut-off
+    grams = len(token_trigrams(tokens))
+    threshold = (max(1, int(grams * FUZZY_THRESHOLD)) - 0.5) / grams
+    # SET LOCAL, so it also holds behind a transaction-pooling PgBouncer
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", [str(threshold)])
+        return list(
+            User.objects.filter(condition)
+            .annotate(similarity=Greatest(*[TrigramWordSimilarity(query, field) for field in SEARCH_FIELDS]))
+            .order_by('-similarity')
+            .values_list('id', flat=True)[:FUZZY_LIMIT]
+        )
+
+
+def search_users(queryset, query, fuzzy=True):
+    """
+    Filter a User queryset by a search string: prefix matches on any token,
+    falling back to trigram fuzzy matching when nothing matches by prefix.
+    Queries without indexable tokens ('@', non-Latin names) are matched
+    with icontains on the raw columns, as before the index.
+
+    fuzzy=False never falls back: bulk actions on "every matching user"
+    must not reach users who merely spell alike.
+    """
+    query = (query or '').strip()
+    if not query:
+        return queryset
+    tokens = tokenize(query)
+    if not tokens:
+        condition = Q()
+        for field in SEARCH_FIELDS:
+            condition |= Q(**{f'{field}__icontains': query})
+        return queryset.filter(condition)
+    if not fuzzy:
+        return queryset.filter(prefix_filter(tokens))
+
+    cache_key = 'user_search:' + hashlib.md5(' '.join(tokens).encode()).hexdigest()
+    cached = cache.get(cache_key)
+    if cached is None:
+        condition = prefix_filter(tokens)
+        if queryset.model.objects.filter(condition).exists():
+            cached = ('prefix', None)
+        else:
+            cached = ('fuzzy', fuzzy_user_ids(tokens))
+        cache.set(cache_key, cached, RESULT_CACHE_TIMEOUT)
+
+    mode, fuzzy_ids = cached
+    if mode == 'prefix':
+        return queryset.filter(prefix_filter(tokens))
+    return queryset.filter(id__in=fuzzy_ids)
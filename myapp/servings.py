@@ -0,0 +1,212 @@
+"""
+Structured serving sizes
+
+A food's nutrients are per serving, and Food.serving_size says what a
+serving is in free text ('100g', '1 cup (240g)', '2 slices (60 g)'). The
+food log and meal plans count servings, but recipes give ingredients in
+grams and used to assume every serving was 100 g. The text is now parsed
+into:
+- Food.serving_grams: grams in one serving (DEFAULT_SERVING_GRAMS when the
+  text doesn't say, which is what recipes assumed);
+- FoodServingUnit rows: units the text names with their grams ('cup' =
+  240 g, 'slice' = 30 g), which also override the standard units below for
+  that food.
+
+Every line item then stores a servings multiplier: Consume and
+MealPlanItem always did, and RecipeIngredient.servings is quantity /
+serving_grams, kept current by the signals. Any total is
+Sum(food value * servings) in SQL, one multiplication per row, whatever
+the item was entered in (see NutrientVector.aggregates).
+
+parse_servings() parses a whole column of serving sizes: each distinct text
+is parsed once and the results are spread back to the rows with NumPy
+indexing, and there are few distinct texts ('100g' for most foods).
+Migration 0024 backfilled existing foods and recipe ingredients with a
+copy of it, and `python manage.py parse_serving_sizes` does the same for
+foods written without signals (bulk_create(), update()).
+"""
+import re
+from collections import namedtuple
+from fractions import Fraction
+
+import numpy as np
+from django.db.models import F, OuterRef, Subquery
+
+DEFAULT_SERVING_GRAMS = 100.0
+
+# Grams per unit. Volumes are converted as water, unless the food's own
+# serving size gives the weight of that unit.
+UNIT_GRAMS = {
+    'g': 1.0,
+    'mg': 0.001,
+    'kg': 1000.0,
+    'oz': 28.3495,
+    'lb': 453.592,
+    'ml': 1.0,
+    'l': 1000.0,
+    'tsp': 4.93,
+    'tbsp': 14.79,
+    'fl oz': 29.57,
+    'cup': 240.0,
+}
+
+UNIT_ALIASES = {
+    'gram': 'g', 'grams': 'g', 'gr': 'g', 'grs': 'g',
+    'milligram': 'mg', 'milligrams': 'mg',
+    'kilogram': 'kg', 'kilograms': 'kg', 'kgs': 'kg',
+    'ounce': 'oz', 'ounces': 'oz',
+    'pound': 'lb', 'pounds': 'lb', 'lbs': 'lb',
+    'milliliter': 'ml', 'milliliters': 'ml', 'millilitre': 'ml', 'millilitres': 'ml',
+    'liter': 'l', 'liters': 'l', 'litre': 'l', 'litres': 'l',
+    'teaspoon': 'tsp', 'teaspoons': 'tsp',
+    'tablespoon': 'tbsp', 'tablespoons': 'tbsp',
+    'fluid ounce': 'fl oz', 'fluid ounces': 'fl oz', 'floz': 'fl oz',
+    'cups': 'cup',
+}
+
+SERVING = 'serving'
+UNIT_NAME_LENGTH = 30
+
+# "<amount> <unit> (<amount> <unit>)", every part optional
+SERVING_PATTERN = re.compile(
+    r'^\s*(?P<amount>\d+\s+\d+/\d+|\d+/\d+|\d*\.?\d+)?\s*'
+    r'(?P<unit>[^\d()]*?)\s*'
+    r'(?:\(\s*(?P<inner_amount>\d*\.?\d+)\s*(?P<inner_unit>[^\d()]*?)\s*\))?\s*$'
+)
+
+Serving = namedtuple('Serving', 'grams unit unit_grams')
+UNKNOWN = Serving(None, None, None)
+
+
+def normalize_unit(name):
+    """Lowercase, singular where it is known, aliases resolved ('Cups' -> 'cup')"""
+    name = ' '.join(name.lower().strip(' .').split())
+    name = UNIT_ALIASES.get(name, name)
+    if name not in UNIT_GRAMS and len(name) > 3 and name.endswith('s') and not name.endswith('ss'):
+        # slices -> slice, pieces -> piece
+        name = name[:-1]
+    return name[:UNIT_NAME_LENGTH]
+
+
+def _amount(text):
+    if not text:
+        return 1.0
+    return float(sum(Fraction(part) for part in text.split()))
+
+
+def parse_serving(text):
+    """
+    Serving(grams, unit, unit_grams) from a serving size. grams is None when
+    the text doesn't give a weight; unit is a food-specific unit the text
+    defines (with unit_grams per one of it), or None.
+    """
+    match = SERVING_PATTERN.match(text or '')
+    if not match or not (match['amount'] or match['unit']):
+        return UNKNOWN
+    amount = _amount(match['amount'])
+    unit = normalize_unit(match['unit'] or '')
+    grams = None
+    if match['inner_amount']:
+        inner_unit = normalize_unit(match['inner_unit'] or 'g')
+        if inner_unit in UNIT_GRAMS:
+            grams = float(match['inner_amount']) * UNIT_GRAMS[inner_unit]
+    elif unit in UNIT_GRAMS:
+        grams = amount * UNIT_GRAMS[unit]
+    if not grams or grams <= 0:
+        return UNKNOWN
+    if match['inner_amount'] and unit and unit not in ('g', 'mg', 'kg') and amount > 0:
+        # '1 cup (240g)': this food's cup weighs 240 g
+        return Serving(grams, unit, grams / amount)
+    return Serving(grams, None, None)
+
+
+def parse_servings(texts):
+    """
+    Parse a column of serving sizes: (grams, units, unit_grams) arrays, with
+    nan grams where the text gives no weight and '' where it defines no unit
+    """
+    texts = np.array([text or '' for text in texts], dtype=str)
+    if not len(texts):
+        return np.zeros(0), np.zeros(0, dtype=object), np.zeros(0)
+    distinct, inverse = np.unique(texts, return_inverse=True)
+    parsed = [parse_serving(text) for text in distinct]
+    grams = np.array([np.nan if serving.grams is None else serving.grams for serving in parsed])
+    units = np.array([serving.unit or '' for serving in parsed], dtype=object)
+    unit_grams = np.array([np.nan if serving.unit_grams is None else serving.unit_grams for serving in parsed])
+    return grams[inverse], units[inverse], unit_grams[inverse]
+
+
+def serving_grams(text):
+    grams = parse_serving(text).grams
+    return grams if grams is not None else DEFAULT_SERVING_GRAMS
+
+
+def unit_choices(food):
+    """(name, grams) of the units an amount of food can be entered in; the food's own first"""
+    own = [(unit.name, unit.grams) for unit in food.serving_units.all()]
+    names = {name for name, _ in own}
+    return own + [(name, grams) for name, grams in UNIT_GRAMS.items() if name not in names]
+
+
+def servings_for(food, amount, unit=SERVING):
+    """Servings of food in amount of unit ('serving', a standard unit or one of the food's own)"""
+    if not unit or unit == SERVING:
+        return amount
+    unit = normalize_unit(unit)
+    grams = dict(unit_choices(food)).get(unit)
+    if grams is None:
+        raise ValueError(f'Unknown unit "{unit}" for {food.name}')
+    return amount * grams / food.serving_grams
+
+
+def sync_food_units(food):
+    """Replace the food's parsed units after its serving size changed"""
+    from .models import FoodServingUnit
+
+    serving = parse_serving(food.serving_size)
+    food.serving_units.all().delete()
+    if serving.unit:
+        FoodServingUnit.objects.create(food=food, name=serving.unit, grams=serving.unit_grams)
+
+
+def update_ingredient_servings(food):
+    """Recipe ingredients of food in servings, after its serving weight changed: one UPDATE"""
+    from .models import RecipeIngredient
+
+    RecipeIngredient.objects.filter(food=food).update(servings=F('quantity') / food.serving_grams)
+
+
+def backfill(Food, FoodServingUnit, RecipeIngredient, using, batch_size=500):
+    """
+    Parse every food's serving size and rewrite serving_grams, the parsed
+    units and every recipe ingredient's servings. Returns the number of
+    foods parsed.
+    """
+    foods = Food._base_manager.using(using)
+    rows = list(foods.order_by('id').values_list('id', 'serving_size'))
+    units = FoodServingUnit._base_manager.using(using)
+    units.all().delete()
+    if rows:
+        ids = np.array([food_id for food_id, _ in rows])
+        grams, names, unit_grams = parse_servings([text for _, text in rows])
+        grams[np.isnan(grams)] = DEFAULT_SERVING_GRAMS
+        # One UPDATE per distinct weight and batch, skipping rows already right
+        for value in np.unique(grams):
+            matching = ids[grams == value].tolist()
+            for offset in range(0, len(matching), batch_size):
+                (
+                    foods.filter(id__in=matching[offset:offset + batch_size])
+                    .exclude(serving_grams=value)
+                    .update(serving_grams=float(value))
+                )
+        defined = names != ''
+        units.bulk_create(
+            [
+                FoodServingUnit(food_id=food_id, name=name, grams=float(weight))
+                for food_id, name, weight in zip(ids[defined].tolist(), names[defined], unit_grams[defined])
+            ],
+            batch_size=batch_size,
+        )
+    serving_weight = Subquery(foods.filter(id=OuterRef('food_id')).values('serving_grams')[:1])
+    RecipeIngredient._base_manager.using(using).update(servings=F('quantity') / serving_weight)
+    return len(rows)
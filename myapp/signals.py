@@ -1,7 +1,22 @@
-from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.db import connections, transaction
+from django.db.models.signals import post_save, post_init, post_delete, post_migrate, pre_delete, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile, Consume, UserStreak, Achievement, UserAchievement
+from .models import UserProfile, Consume, Food, RecipeIngredient, WeightLog, UserStreak, Achievement, UserAchievement, SubscriptionPlan, UserLifetimeStats, SubscriptionPurchase, PaymentLog
+from . import charts, energy, history, servings, weight_trend
+from .partitions import attach_main_database, disable_foreign_keys, is_partitioned, partition_aliases, partition_for_user, partitioned_models
+from .search import SEARCH_FIELDS, index_user
+from .stats import (
+    adjust_platform_stats,
+    record_new_user,
+    invalidate_subscription_plans,
+    record_consume_created,
+    record_consume_deleted,
+    food_log_user_ids,
+    rebuild_food_lifetime_stats,
+    rebuild_user_lifetime_stats,
+)
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -9,10 +24,152 @@ def create_user_profile(sender, instance, created, **kwargs):
         UserProfile.objects.create(user=instance)
         # Also create streak tracker for new users
         UserStreak.objects.create(user=instance)
+    elif 'userprofile' in instance._state.fields_cache:
+        # Persist profile changes made through user.userprofile. Only when the
+        # profile is already loaded (so logins don't query it), and save()
+        # writes nothing unless a profile field actually changed.
+        instance.userprofile.save()
+
+
+@receiver(post_save, sender=User)
+def update_user_search_index(sender, instance, created, update_fields=None, **kwargs):
+    """Keep the control panel search index in sync with the user's names and email"""
+    # Logins save only last_login; skip saves that can't change the indexed fields
+    if update_fields is not None and not set(update_fields) & set(SEARCH_FIELDS):
+        return
+    index_user(instance)
+
+
+@receiver(post_save, sender=Consume)
+def update_lifetime_stats_on_consume(sender, instance, created, **kwargs):
+    """Keep UserLifetimeStats current; registered first so achievements see the new totals"""
+    if created:
+        record_consume_created(instance)
     else:
-        # Only save existing profile, don't create
-        if hasattr(instance, 'userprofile'):
-            instance.userprofile.save()
+        rebuild_user_lifetime_stats(instance.user_id)
+
+
+@receiver(post_delete, sender=Consume)
+def update_lifetime_stats_on_delete(sender, instance, **kwargs):
+    record_consume_deleted(instance)
+
+
+@receiver(post_save, sender=Consume)
+def update_history_on_consume(sender, instance, created, **kwargs):
+    """Append new entries to the user's cached analytics history (see history.py)"""
+    if created:
+        history.record_consume_created(instance)
+    else:
+        history.invalidate_history(instance.user_id)
+
+
+@receiver(post_delete, sender=Consume)
+def update_history_on_delete(sender, instance, **kwargs):
+    history.invalidate_history(instance.user_id)
+
+
+@receiver(post_init, sender=Food)
+def remember_loaded_nutrients(sender, instance, **kwargs):
+    instance._nutrients_loaded = tuple(instance.__dict__.get(field) for field in history.FIELDS)
+
+
+@receiver(post_save, sender=Food)
+def invalidate_histories_on_food_change(sender, instance, created, **kwargs):
+    """Histories hold servings x the food's values, for the users who logged it; archived entries don't change"""
+    nutrients = tuple(getattr(instance, field) for field in history.FIELDS)
+    if not created and nutrients != instance._nutrients_loaded:
+        food_id = instance.pk
+        transaction.on_commit(lambda: history.invalidate_food_histories(food_log_user_ids(food_id)))
+    instance._nutrients_loaded = nutrients
+
+
+@receiver(post_init, sender=Food)
+def remember_loaded_calories(sender, instance, **kwargs):
+    instance._calories_loaded = instance.__dict__.get('calories')
+
+
+@receiver(post_save, sender=Food)
+def rebuild_lifetime_stats_on_food_change(sender, instance, created, **kwargs):
+    """Lifetime calories are servings x the food's calories, for everyone who logged it"""
+    if not created and instance.calories != instance._calories_loaded:
+        food_id = instance.pk
+        transaction.on_commit(lambda: rebuild_food_lifetime_stats(food_id))
+    instance._calories_loaded = instance.calories
+
+
+# ------------------------------------------------------------
+# Serving sizes (see servings.py)
+# ------------------------------------------------------------
+
+@receiver(post_init, sender=Food)
+def remember_loaded_serving_size(sender, instance, **kwargs):
+    instance._serving_size_loaded = instance.__dict__.get('serving_size')
+
+
+@receiver(pre_save, sender=Food)
+def parse_serving_size(sender, instance, update_fields=None, **kwargs):
+    # Food.save() adds serving_grams to update_fields along with serving_size
+    if update_fields is not None and 'serving_size' not in update_fields:
+        return
+    if instance._state.adding or instance.serving_size != instance._serving_size_loaded:
+        instance.serving_grams = servings.serving_grams(instance.serving_size)
+
+
+@receiver(post_save, sender=Food)
+def update_serving_units(sender, instance, created, update_fields=None, **kwargs):
+    """Store the units the serving size defines, and rescale recipe ingredients to the new serving"""
+    if update_fields is not None and 'serving_size' not in update_fields:
+        return
+    if created or instance.serving_size != instance._serving_size_loaded:
+        servings.sync_food_units(instance)
+        if not created:
+            servings.update_ingredient_servings(instance)
+    instance._serving_size_loaded = instance.serving_size
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def convert_ingredient_quantity(sender, instance, **kwargs):
+    instance.servings = instance.quantity / instance.food.serving_grams
+
+
+@receiver(post_init, sender=WeightLog)
+def remember_loaded_weight(sender, instance, **kwargs):
+    weight_trend.remember_loaded(instance)
+
+
+# Registered before the chart invalidation, so no chart is cached with the old trend
+@receiver(post_save, sender=WeightLog)
+def update_weight_trend(sender, instance, created, **kwargs):
+    """Step the smoothed trend forward, or recompute it from a backdated change (see weight_trend.py)"""
+    weight_trend.record_saved(instance, created)
+
+
+@receiver(post_delete, sender=WeightLog)
+def update_weight_trend_on_delete(sender, instance, **kwargs):
+    weight_trend.record_deleted(instance)
+
+
+@receiver([post_save, post_delete], sender=WeightLog)
+def invalidate_weight_chart(sender, instance, **kwargs):
+    charts.invalidate_weight_series(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Consume)
+@receiver([post_save, post_delete], sender=WeightLog)
+def refresh_energy_estimate_on_log(sender, instance, **kwargs):
+    """Queue a refit of the user's expenditure once the log change commits (see energy.py)"""
+    energy.schedule_refresh(instance.user_id, using=instance._state.db)
+
+
+# Profile fields the energy estimate and its forecast depend on
+ENERGY_PROFILE_FIELDS = {'height', 'weight', 'date_of_birth', 'activity_level', 'weight_goal', 'target_weight'}
+
+
+@receiver(post_save, sender=UserProfile)
+def refresh_energy_estimate_on_profile(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not set(update_fields) & ENERGY_PROFILE_FIELDS):
+        return
+    energy.schedule_refresh(instance.user_id)
 
 
 @receiver(post_save, sender=Consume)
@@ -38,8 +195,10 @@ def check_achievements(user, streak):
                 achievement=achievement
             )
     
+    lifetime_stats = UserLifetimeStats.objects.get(user=user)
+    
     # Check logging achievements (first meal)
-    if Consume.objects.filter(user=user).count() == 1:
+    if lifetime_stats.total_entries == 1:
         first_step = Achievement.objects.filter(name='First Step').first()
         if first_step:
             UserAchievement.objects.get_or_create(
@@ -48,11 +207,108 @@ def check_achievements(user, streak):
             )
     
     # Check food explorer (10 different foods)
-    unique_foods = Consume.objects.filter(user=user).values('food_consumed').distinct().count()
-    if unique_foods >= 10:
+    if lifetime_stats.distinct_foods >= 10:
         explorer = Achievement.objects.filter(name='Food Explorer').first()
         if explorer:
             UserAchievement.objects.get_or_create(
                 user=user,
                 achievement=explorer
-            )
\ No newline at end of file
+            )
+
+
+# ------------------------------------------------------------
+# Platform counters (see stats.py)
+# ------------------------------------------------------------
+
+@receiver(post_init, sender=User)
+def remember_user_active_state(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields don't trigger a query
+    instance._stats_was_active = instance.__dict__.get('is_active')
+
+
+@receiver(post_save, sender=User)
+def update_platform_stats_for_user(sender, instance, created, **kwargs):
+    if created:
+        adjust_platform_stats(total_users=1, active_users=int(instance.is_active))
+        record_new_user()
+    elif instance._stats_was_active is not None and instance._stats_was_active != instance.is_active:
+        adjust_platform_stats(active_users=1 if instance.is_active else -1)
+    instance._stats_was_active = instance.is_active
+
+
+@receiver(post_delete, sender=User)
+def update_platform_stats_for_deleted_user(sender, instance, **kwargs):
+    adjust_platform_stats(total_users=-1, active_users=-int(instance.is_active))
+
+
+@receiver(post_init, sender=UserProfile)
+def remember_profile_premium_state(sender, instance, **kwargs):
+    instance._stats_was_premium = instance.__dict__.get('is_premium')
+
+
+@receiver(post_save, sender=UserProfile)
+def update_platform_stats_for_profile(sender, instance, created, **kwargs):
+    if created:
+        adjust_platform_stats(premium_users=int(instance.is_premium))
+    elif instance._stats_was_premium is not None and instance._stats_was_premium != instance.is_premium:
+        adjust_platform_stats(premium_users=1 if instance.is_premium else -1)
+    instance._stats_was_premium = instance.is_premium
+
+
+@receiver(post_delete, sender=UserProfile)
+def update_platform_stats_for_deleted_profile(sender, instance, **kwargs):
+    adjust_platform_stats(premium_users=-int(instance.is_premium))
+
+
+@receiver([post_save, post_delete], sender=SubscriptionPlan)
+def clear_subscription_plan_cache(sender, **kwargs):
+    invalidate_subscription_plans()
+
+
+# ------------------------------------------------------------
+# Audit database references (see routers.py)
+# ------------------------------------------------------------
+
+@receiver(post_delete, sender=User)
+def delete_user_payment_records(sender, instance, **kwargs):
+    """The CASCADE the cross-database foreign keys can't do"""
+    PaymentLog.objects.filter(user_id=instance.pk).delete()
+    SubscriptionPurchase.objects.filter(user_id=instance.pk).delete()
+
+
+@receiver(pre_delete, sender=SubscriptionPlan)
+def detach_plan_from_purchases(sender, instance, **kwargs):
+    """The SET_NULL the cross-database foreign key can't do"""
+    SubscriptionPurchase.objects.filter(plan_id=instance.pk).update(plan=None)
+
+
+# ------------------------------------------------------------
+# Partitioned food log (see partitions.py)
+# ------------------------------------------------------------
+
+@receiver(connection_created)
+def set_up_partition_connection(sender, connection, **kwargs):
+    attach_main_database(connection)
+
+
+@receiver(post_migrate)
+def reset_partition_connection(sender, using, **kwargs):
+    # Migrations turn foreign key checks back on for the connection they used
+    disable_foreign_keys(connections[using])
+
+
+@receiver(pre_delete, sender=Food)
+def delete_partitioned_food_log(sender, instance, **kwargs):
+    """The CASCADE from Food, whose collector only looks in the main database"""
+    if is_partitioned(Consume):
+        for alias in partition_aliases():
+            # Through the signals, so the owners' lifetime stats follow
+            Consume.objects.using(alias).filter(food_consumed_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=User)
+def delete_partitioned_user_rows(sender, instance, **kwargs):
+    """The CASCADE from User into its partition; no signals, the stats are gone with the user"""
+    alias = partition_for_user(instance.pk)
+    for model in partitioned_models():
+        model._base_manager.using(alias).filter(user_id=instance.pk)._raw_delete(alias)
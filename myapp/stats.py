@@ -0,0 +1,247 @@
+"""
+Precomputed counters for the control panel
+
+PlatformStats holds one row of counters that the User/UserProfile signals keep
+up to date with single UPDATE ... SET x = x + 1 statements, so the admin header
+never has to count the user table. reconcile_platform_stats() recounts
+everything and runs periodically from the scheduler to correct any drift
+(e.g. from queryset.update() calls that bypass signals).
+
+UserLifetimeStats does the same per user for the food log, updated by the
+Consume signals so admin_user_detail doesn't aggregate a user's whole history.
+Archived days (archive.py) count towards it too. Those updates can drift:
+two entries racing to be a day's first both see the other, and editing a
+food's calories changes every entry of it. Editing a food's calories
+rebuilds the stats of everyone with a live entry of it, and
+reconcile_lifetime_stats() rebuilds recently active users' from the scheduler.
+"""
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db.models import Case, Count, F, Max, Min, Q, Sum, Value, When
+from django.utils import timezone
+
+from . import archive
+from .partitions import model_databases
+from .replica import use_primary
+
+STATS_ID = 1
+PLANS_CACHE_KEY = 'active_subscription_plans'
+
+
+def get_platform_stats():
+    """The counters row, created by a full recount the first time"""
+    from .models import PlatformStats
+
+    stats = PlatformStats.objects.filter(pk=STATS_ID).first()
+    if stats is None:
+        stats = reconcile_platform_stats()
+    return stats
+
+
+def adjust_platform_stats(**deltas):
+    """Atomically add deltas, e.g. adjust_platform_stats(total_users=1, active_users=1)"""
+    from .models import PlatformStats
+
+    deltas = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if deltas:
+        # update() skips auto_now; the control panel shows when counters last moved
+        PlatformStats.objects.filter(pk=STATS_ID).update(updated_at=timezone.now(), **deltas)
+
+
+def record_new_user():
+    from .models import PlatformStats
+
+    now = timezone.now()
+    # The local day, as reconcile_platform_stats() counts it
+    today = timezone.localdate(now)
+    updated = PlatformStats.objects.filter(pk=STATS_ID, new_users_date=today).update(
+        new_users_today=F('new_users_today') + 1, updated_at=now
+    )
+    if not updated:
+        # First signup of the day resets the counter
+        PlatformStats.objects.filter(pk=STATS_ID).update(new_users_date=today, new_users_today=1, updated_at=now)
+
+
+def reconcile_platform_stats():
+    """Recount every counter from the source tables"""
+    from django.contrib.auth.models import User
+    from .models import PlatformStats, UserProfile
+
+    now = timezone.now()
+    today = timezone.localdate(now)
+    # A range on date_joined can use its index, unlike date_joined__date
+    start_of_today = timezone.make_aware(datetime.combine(today, time.min))
+
+    # Count on the primary even when called from a replica-routed view
+    with use_primary():
+        stats, _ = PlatformStats.objects.update_or_create(
+            pk=STATS_ID,
+            defaults={
+                'total_users': User.objects.count(),
+                'active_users': User.objects.filter(is_active=True).count(),
+                'premium_users': UserProfile.objects.filter(is_premium=True).count(),
+                'new_users_date': today,
+                'new_users_today': User.objects.filter(date_joined__gte=start_of_today).count(),
+                'reconciled_at': now,
+            },
+        )
+    return stats
+
+
+def get_active_subscription_plans():
+    """Active plans, cached until a plan changes"""
+    from .models import SubscriptionPlan
+
+    plans = cache.get(PLANS_CACHE_KEY)
+    if plans is None:
+        plans = list(SubscriptionPlan.objects.filter(is_active=True))
+        cache.set(PLANS_CACHE_KEY, plans, None)
+    return plans
+
+
+def invalidate_subscription_plans():
+    cache.delete(PLANS_CACHE_KEY)
+
+
+# ------------------------------------------------------------
+# Per-user lifetime stats
+# ------------------------------------------------------------
+
+def _consume_date(consume):
+    # date_consumed defaults to timezone.now(), so it may still be a datetime
+    return consume._meta.get_field('date_consumed').to_python(consume.date_consumed)
+
+
+def rebuild_user_lifetime_stats(user_id):
+    """Recompute one user's lifetime stats from their full food log"""
+    from .models import Consume, UserLifetimeStats
+
+    with use_primary():
+        totals = Consume.objects.filter(user_id=user_id).aggregate(
+            total_entries=Count('id'),
+            total_calories=Sum(F('food_consumed__calories') * F('servings')),
+            days_logged=Count('date_consumed', distinct=True),
+            distinct_foods=Count('food_consumed', distinct=True),
+            first_log_date=Min('date_consumed'),
+            last_log_date=Max('date_consumed'),
+        )
+        archive.add_archived_totals(user_id, totals)
+    totals['total_calories'] = totals['total_calories'] or 0
+    stats, _ = UserLifetimeStats.objects.update_or_create(user_id=user_id, defaults=totals)
+    return stats
+
+
+def food_log_user_ids(food_id):
+    """Ids of the users with a live (not archived) entry of the food, across partitions"""
+    from .models import Consume
+
+    user_ids = set()
+    with use_primary():
+        for using in model_databases(Consume):
+            entries = Consume._base_manager.using(using).filter(food_consumed_id=food_id)
+            user_ids.update(entries.order_by().values_list('user_id', flat=True).distinct())
+    return sorted(user_ids)
+
+
+def rebuild_food_lifetime_stats(food_id):
+    """Rebuild the stats of everyone who logged a food whose calories changed; returns how many"""
+    user_ids = food_log_user_ids(food_id)
+    for user_id in user_ids:
+        rebuild_user_lifetime_stats(user_id)
+    return len(user_ids)
+
+
+def get_user_lifetime_stats(user):
+    """Lifetime stats for a user, building them on first use"""
+    from .models import UserLifetimeStats
+
+    try:
+        return user.lifetime_stats
+    except UserLifetimeStats.DoesNotExist:
+        return rebuild_user_lifetime_stats(user.pk)
+
+
+def reconcile_lifetime_stats(days=2):
+    """Rebuild the lifetime stats of users active in the last few days; returns how many"""
+    from .models import DailyActiveUser
+
+    since = timezone.localdate() - timedelta(days=days)
+    user_ids = list(
+        DailyActiveUser.objects.filter(date__gte=since).order_by('user_id')
+        .values_list('user_id', flat=True).distinct()
+    )
+    for user_id in user_ids:
+        rebuild_user_lifetime_stats(user_id)
+    return len(user_ids)
+
+
+def record_consume_created(consume):
+    from .models import Consume, UserLifetimeStats
+
+    log_date = _consume_date(consume)
+    others = Consume.objects.filter(user_id=consume.user_id).exclude(pk=consume.pk)
+    is_new_day = (
+        not others.filter(date_consumed=log_date).exists()
+        and not archive.has_archived_day(consume.user_id, log_date)
+    )
+    is_new_food = (
+        not others.filter(food_consumed_id=consume.food_consumed_id).exists()
+        and not archive.has_archived_food(consume.user_id, consume.food_consumed_id)
+    )
+
+    updated = UserLifetimeStats.objects.filter(user_id=consume.user_id).update(
+        updated_at=timezone.now(),
+        total_entries=F('total_entries') + 1,
+        total_calories=F('total_calories') + consume.food_consumed.calories * consume.servings,
+        days_logged=F('days_logged') + int(is_new_day),
+        distinct_foods=F('distinct_foods') + int(is_new_food),
+        first_log_date=Case(
+            When(Q(first_log_date__isnull=True) | Q(first_log_date__gt=log_date), then=Value(log_date)),
+            default=F('first_log_date'),
+        ),
+        last_log_date=Case(
+            When(Q(last_log_date__isnull=True) | Q(last_log_date__lt=log_date), then=Value(log_date)),
+            default=F('last_log_date'),
+        ),
+    )
+    if not updated:
+        rebuild_user_lifetime_stats(consume.user_id)
+
+
+def record_consume_deleted(consume):
+    from .models import Consume, Food, UserLifetimeStats
+
+    try:
+        calories = consume.food_consumed.calories * consume.servings
+    except Food.DoesNotExist:
+        rebuild_user_lifetime_stats(consume.user_id)
+        return
+
+    log_date = _consume_date(consume)
+    remaining = Consume.objects.filter(user_id=consume.user_id)
+    day_emptied = (
+        not remaining.filter(date_consumed=log_date).exists()
+        and not archive.has_archived_day(consume.user_id, log_date)
+    )
+    food_gone = (
+        not remaining.filter(food_consumed_id=consume.food_consumed_id).exists()
+        and not archive.has_archived_food(consume.user_id, consume.food_consumed_id)
+    )
+
+    fields = {
+        'updated_at': timezone.now(),
+        'total_entries': F('total_entries') - 1,
+        'total_calories': F('total_calories') - calories,
+        'days_logged': F('days_logged') - int(day_emptied),
+        'distinct_foods': F('distinct_foods') - int(food_gone),
+    }
+    if day_emptied:
+        # The first or last log day may have gone; min/max use the (user, date) index
+        bounds = remaining.aggregate(first_log_date=Min('date_consumed'), last_log_date=Max('date_consumed'))
+        first_archived, last_archived = archive.archived_date_range(consume.user_id)
+        if first_archived:
+            bounds['first_log_date'] = min(filter(None, [bounds['first_log_date'], first_archived]))
+            bounds['last_log_date'] = max(filter(None, [bounds['last_log_date'], last_archived]))
+        fields.update(bounds)
+    UserLifetimeStats.objects.filter(user_id=consume.user_id).update(**fields)
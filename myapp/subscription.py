@@ -30,10 +30,8 @@ def require_premium(view_func):
     @wraps(view_func)
     @login_required
     def wrapper(request, *args, **kwargs):
-        user_profile = request.user.userprofile
-        
         # Check if user has active premium subscription
-        if not user_profile.is_premium_active():
+        if not request.user_context.is_premium:
             # Redirect to subscription plans
             return redirect('subscription_plans')
         
@@ -1,3 +1,1195 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta
+from datetime import timezone as dt_timezone
+from unittest import mock, skipUnless
+import zlib
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models import Q, QuerySet
+from django.db.models.signals import post_save
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import activity, archive, energy, history, replica
+from .analytics import MAX_RANGE_DAYS, MIN_DATE, parse_range
+from .bulk import bulk_grant_premium, bulk_revoke_premium, bulk_set_active
+from .charts import MAX_POINTS, series_points
+from .deletion import count_user_rows, process_user_deletions, queue_user_deletions
+from .downsample import lttb
+from .models import (
+    Consume, ConsumeArchiveDay, DailyActiveUser, EnergyEstimate, EnergyRefresh, Food, PlatformStats, Recipe,
+    RecipeIngredient, SubscriptionPlan, SubscriptionPurchase, UserDeletion, UserLifetimeStats, UserProfile, UserStreak,
+    WeightLog,
+)
+from .nutrients import NutrientVector, nutrient_array
+from .pagination import InvalidCursor, KeysetPaginator, decode_cursor, encode_cursor
+from .partitions import UnroutedQueryError, partition_aliases, partition_for_user
+from .routers import audit_database
+from .scheduler import CronSchedule
+from .search import fuzzy_user_ids, search_users, tokenize
+from .stats import (
+    STATS_ID, adjust_platform_stats, get_platform_stats, rebuild_user_lifetime_stats, reconcile_platform_stats,
+)
+from .user_context import UserContextBackend, get_latest_weight, get_user_streak
+from .weight_trend import ALPHA, gaps, smooth
+
+# User deletes and payment writes reach the audit database, when there is one
+USER_DATABASES = {'default', audit_database()}
+
+
+class CronScheduleTests(SimpleTestCase):
+    def test_fields(self):
+        schedule = CronSchedule('*/15 2-4 1,15 * 1-5/2')
+        self.assertEqual(schedule.minutes, {0, 15, 30, 45})
+        self.assertEqual(schedule.hours, {2, 3, 4})
+        self.assertEqual(schedule.days, {1, 15})
+        self.assertEqual(schedule.weekdays, {1, 3, 5})
+
+    def test_invalid(self):
+        for expression in ('* * * *', '60 * * * *', '* * 0 * *', '5-1 * * * *', '*/0 * * * *'):
+            with self.subTest(expression=expression), self.assertRaises(ValueError):
+                CronSchedule(expression)
+
+    def test_next_after(self):
+        schedule = CronSchedule('30 3 * * *')
+        self.assertEqual(schedule.next_after(datetime(2024, 5, 1, 3, 30)), datetime(2024, 5, 2, 3, 30))
+        self.assertEqual(schedule.next_after(datetime(2024, 5, 1, 3, 29, 59)), datetime(2024, 5, 1, 3, 30))
+
+    def test_next_after_crosses_years(self):
+        schedule = CronSchedule('0 0 29 2 *')
+        self.assertEqual(schedule.next_after(datetime(2024, 3, 1)), datetime(2028, 2, 29))
+
+    def test_either_day_field_matches_when_both_are_restricted(self):
+        # The 13th or any Friday; 2024-09-06 is a Friday
+        schedule = CronSchedule('0 12 13 * 5')
+        self.assertEqual(schedule.next_after(datetime(2024, 9, 1)), datetime(2024, 9, 6, 12, 0))
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        joined = timezone.make_aware(datetime(2024, 1, 1))
+        for index in range(25):
+            # Pairs share a join time, so the id breaks ties
+            User.objects.create(username=f'user{index:02}', date_joined=joined + timedelta(days=index // 2))
+        self.paginator = KeysetPaginator(User.objects.all(), '-date_joined', per_page=10)
+        self.expected = list(User.objects.order_by('-date_joined', '-pk'))
+
+    def test_walks_every_row_once(self):
+        seen = []
+        page = self.paginator.page()
+        while True:
+            seen.extend(page)
+            if not page.has_next():
+                break
+            page = self.paginator.page(page.next_cursor)
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(page.number, 3)
+        self.assertEqual(page.total_pages, 3)
+
+    def test_previous_page(self):
+        second = self.paginator.page(self.paginator.page().next_cursor)
+        first = self.paginator.page(second.prev_cursor, direction='prev')
+        self.assertEqual(list(first), self.expected[:10])
+        self.assertEqual(first.number, 1)
+        self.assertFalse(first.has_previous())
+
+    def test_last_page(self):
+        last = self.paginator.page(direction='last')
+        self.assertEqual(list(last), self.expected[-10:])
+        self.assertFalse(last.has_next())
+
+    def test_cursor(self):
+        self.assertEqual(decode_cursor(encode_cursor(date(2024, 1, 2), 5, 3)), ('2024-01-02', 5, 3))
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not a cursor')
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create(username='john_doe', email='jd@example.com', first_name='John', last_name='Doe')
+        User.objects.create(username='johanna', email='jo@corp.io', first_name='Johanna', last_name='Smíth')
+        User.objects.create(username='mary', email='mary.smith@corp.io', first_name='Mary', last_name='Smythe')
+        User.objects.create(username='averyveryverylongname', email='x@y.z')
+
+    def names(self, query):
+        return sorted(search_users(User.objects.all(), query).values_list('username', flat=True))
+
+    def test_prefixes_of_any_token(self):
+        self.assertEqual(self.names('jo'), ['johanna', 'john_doe'])
+        self.assertEqual(self.names('corp'), ['johanna', 'mary'])
+        self.assertEqual(self.names('JOHN d'), ['john_doe'])
+
+    def test_accents_are_ignored(self):
+        self.assertEqual(self.names('smith'), ['johanna', 'mary'])
+        self.assertEqual(self.names('smíth jo'), ['johanna'])
+
+    def test_tokens_longer_than_the_indexed_prefix(self):
+        self.assertEqual(self.names('averyveryverylongn'), ['averyveryverylongname'])
+
+    def test_fuzzy_fallback_when_nothing_matches_by_prefix(self):
+        self.assertEqual(self.names('jonh'), ['johanna', 'john_doe'])
+        self.assertEqual(self.names('averyveryverylongx'), ['averyveryverylongname'])
+        self.assertEqual(self.names('zzzz'), [])
+
+    def test_without_fuzzy_fallback(self):
+        def names(query):
+            return sorted(search_users(User.objects.all(), query, fuzzy=False).values_list('username', flat=True))
+
+        self.assertEqual(names('jo'), ['johanna', 'john_doe'])
+        self.assertEqual(names('jonh'), [])
+        self.assertEqual(names('@corp.io'), ['johanna', 'mary'])
+
+    def test_fuzzy_matches_best_first(self):
+        ids = fuzzy_user_ids(tokenize('johana'))
+        self.assertEqual(
+            [User.objects.get(pk=user_id).username for user_id in ids], ['johanna', 'john_doe']
+        )
+
+    def test_queries_without_tokens(self):
+        self.assertEqual(self.names('@corp.io'), ['johanna', 'mary'])
+        self.assertEqual(self.names('  '), ['averyveryverylongname', 'johanna', 'john_doe', 'mary'])
+
+    def test_index_follows_edits(self):
+        user = User.objects.get(username='mary')
+        user.last_name = 'Jones'
+        user.save()
+        cache.clear()
+        self.assertEqual(self.names('jones'), ['mary'])
+        self.assertEqual(self.names('smythe'), [])
+
+
+class PlatformStatsTests(TestCase):
+    databases = USER_DATABASES
+
+    def counters(self):
+        stats = PlatformStats.objects.get(pk=STATS_ID)
+        return stats.total_users, stats.active_users, stats.premium_users, stats.get_new_users_today()
+
+    def recount(self):
+        stats = reconcile_platform_stats()
+        return stats.total_users, stats.active_users, stats.premium_users, stats.get_new_users_today()
+
+    def test_signals_keep_the_counters(self):
+        get_platform_stats()
+        alice = User.objects.create_user('alice', password='pw')
+        bob = User.objects.create_user('bob', password='pw')
+        self.assertEqual(self.counters(), (2, 2, 0, 2))
+
+        bob.is_active = False
+        bob.save()
+        profile = alice.userprofile
+        profile.is_premium = True
+        profile.save()
+        self.assertEqual(self.counters(), (2, 1, 1, 2))
+
+        # Saves that don't change the flags leave them alone
+        bob.save()
+        profile.save()
+        self.assertEqual(self.counters(), (2, 1, 1, 2))
+
+        alice.delete()
+        self.assertEqual(self.counters(), (1, 0, 0, 2))
+        self.assertEqual(self.recount(), (1, 0, 0, 1))
+
+    def test_adjust_bumps_updated_at(self):
+        stats = get_platform_stats()
+        adjust_platform_stats(total_users=5)
+        after = PlatformStats.objects.get(pk=STATS_ID)
+        self.assertEqual(after.total_users, stats.total_users + 5)
+        self.assertGreater(after.updated_at, stats.updated_at)
+
+    @override_settings(TIME_ZONE='Pacific/Kiritimati')
+    def test_new_users_are_counted_on_the_local_day(self):
+        # 20:00 UTC is already the next day at UTC+14
+        now = datetime(2024, 5, 1, 20, 0, tzinfo=dt_timezone.utc)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            get_platform_stats()
+            User.objects.create_user('late', password='pw', date_joined=now)
+            stats = PlatformStats.objects.get(pk=STATS_ID)
+            self.assertEqual(stats.new_users_date, date(2024, 5, 2))
+            self.assertEqual(stats.get_new_users_today(), 1)
+            self.assertEqual(reconcile_platform_stats().new_users_date, date(2024, 5, 2))
+            self.assertEqual(self.recount()[3], 1)
+
+
+class LifetimeStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('eater', password='pw')
+        self.apple = Food.objects.create(name='apple', carbs=14, protein=0.3, fats=0.2, calories=52)
+        self.bread = Food.objects.create(user=self.user, name='bread', carbs=49, protein=9, fats=3.2, calories=265)
+        self.today = timezone.localdate()
+
+    def log(self, food, day, servings=1, user=None):
+        return Consume.objects.create(user=user or self.user, food_consumed=food, date_consumed=day, servings=servings)
+
+    def stats(self, user=None):
+        stats = UserLifetimeStats.objects.get(user=user or self.user)
+        return (
+            stats.total_entries, round(stats.total_calories, 6), stats.days_logged,
+            stats.distinct_foods, stats.first_log_date, stats.last_log_date,
+        )
+
+    def rebuilt(self, user=None):
+        rebuild_user_lifetime_stats((user or self.user).pk)
+        return self.stats(user)
+
+    def test_create_edit_delete(self):
+        yesterday = self.today - timedelta(days=1)
+        self.log(self.apple, yesterday)
+        entry = self.log(self.bread, self.today, servings=2)
+        self.log(self.apple, self.today)
+        expected = (3, 52 + 2 * 265 + 52, 2, 2, yesterday, self.today)
+        self.assertEqual(self.stats(), expected)
+        self.assertEqual(self.rebuilt(), expected)
+
+        entry.servings = 1
+        entry.save()
+        self.assertEqual(self.stats(), (3, 52 + 265 + 52, 2, 2, yesterday, self.today))
+
+        entry.delete()
+        expected = (2, 104, 2, 1, yesterday, self.today)
+        self.assertEqual(self.stats(), expected)
+        self.assertEqual(self.rebuilt(), expected)
+
+    def test_deleting_a_days_last_entry(self):
+        yesterday = self.today - timedelta(days=1)
+        self.log(self.apple, yesterday).delete()
+        self.log(self.apple, self.today)
+        self.assertEqual(self.stats(), (1, 52, 1, 1, self.today, self.today))
+
+    def test_calorie_change_rebuilds_everyone_who_logged_the_food(self):
+        other = User.objects.create_user('other', password='pw')
+        bystander = User.objects.create_user('bystander', password='pw')
+        self.log(self.apple, self.today, servings=2)
+        self.log(self.apple, self.today, user=other)
+        self.log(self.bread, self.today, user=bystander)
+        before = self.stats(bystander)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.apple.calories = 60
+            self.apple.save()
+        # The rebuild, and the analytics history invalidation
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(self.stats()[1], 120)
+        self.assertEqual(self.stats(other)[1], 60)
+        self.assertEqual(self.stats(bystander), before)
+
+    def test_other_food_edits_dont_rebuild(self):
+        self.log(self.apple, self.today)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.apple.name = 'green apple'
+            self.apple.save()
+        self.assertFalse(callbacks)
+
+
+class BulkActionTests(TestCase):
+    databases = USER_DATABASES
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.john = User.objects.create_user('john_doe', password='pw')
+        self.johanna = User.objects.create_user('johanna', password='pw')
+        self.client.force_login(self.admin)
+
+    def post(self, **data):
+        return self.client.post('/control-panel/bulk-action/', data)
+
+    def test_select_all_confirms_prefix_matches(self):
+        response = self.post(action='deactivate', select_all_matching='on', search='jo')
+        self.assertEqual(response.context['matched_count'], 2)
+        self.assertTrue(User.objects.get(pk=self.john.pk).is_active)
+
+        self.post(action='deactivate', select_all_matching='on', search='jo', confirm_count='2')
+        self.assertFalse(User.objects.filter(pk__in=[self.john.pk, self.johanna.pk], is_active=True).exists())
+
+    def test_select_all_never_uses_fuzzy_matches(self):
+        # 'jonh' finds both users by spelling, but matches neither by prefix
+        self.assertEqual(len(search_users(User.objects.all(), 'jonh')), 2)
+        response = self.post(action='delete', select_all_matching='on', search='jonh', confirm_count='2')
+        self.assertRedirects(response, '/control-panel/', fetch_redirect_response=False)
+        self.assertEqual(User.objects.filter(is_active=True).count(), 3)
+
+    def test_skipped_users_are_reported(self):
+        queue_user_deletions([self.johanna.pk])
+        response = self.post(action='activate', user_ids=[self.john.pk, self.johanna.pk])
+        self.assertIn(
+            'Skipped 1 users queued for deletion: johanna.', [str(m) for m in get_messages(response.wsgi_request)]
+        )
+        self.assertFalse(User.objects.get(pk=self.johanna.pk).is_active)
+
+
+class BulkUpdateTests(TestCase):
+    databases = USER_DATABASES
+
+    def setUp(self):
+        get_platform_stats()
+        self.users = [User.objects.create_user(f'user{n}', password='pw') for n in range(3)]
+        self.ids = [user.pk for user in self.users]
+        self.plan = SubscriptionPlan.objects.create(
+            name='Premium Monthly', description='', duration='monthly', price=9.99, duration_days=30
+        )
+
+    def counters(self):
+        stats = PlatformStats.objects.get(pk=STATS_ID)
+        return stats.active_users, stats.premium_users
+
+    def assertCounters(self, active, premium):
+        self.assertEqual(self.counters(), (active, premium))
+        recount = reconcile_platform_stats()
+        self.assertEqual((recount.active_users, recount.premium_users), (active, premium))
+
+    def test_counters_follow_the_updates(self):
+        self.assertEqual(bulk_set_active(self.ids[:2], False), (2, []))
+        self.assertCounters(1, 0)
+        # Already inactive users aren't counted twice
+        self.assertEqual(bulk_set_active(self.ids, False), (1, []))
+        self.assertCounters(0, 0)
+        self.assertEqual(bulk_set_active(self.ids, True), (3, []))
+        self.assertCounters(3, 0)
+
+        self.assertEqual(bulk_grant_premium(self.ids[:2], self.plan), (2, []))
+        self.assertCounters(3, 2)
+        # Extending a premium user's plan doesn't count them again
+        self.assertEqual(bulk_grant_premium(self.ids, self.plan), (3, []))
+        self.assertCounters(3, 3)
+        self.assertEqual(SubscriptionPurchase.objects.filter(plan=self.plan).count(), 5)
+
+        self.assertEqual(bulk_revoke_premium(self.ids[:1]), 1)
+        self.assertCounters(3, 2)
+
+    def test_users_queued_for_deletion_are_skipped(self):
+        doomed = self.ids[2]
+        queue_user_deletions([doomed])
+        self.assertCounters(2, 0)
+
+        self.assertEqual(bulk_set_active(self.ids, True), (0, [doomed]))
+        self.assertEqual(bulk_grant_premium(self.ids, self.plan), (2, [doomed]))
+        self.assertCounters(2, 2)
+        self.assertFalse(User.objects.get(pk=doomed).is_active)
+        self.assertFalse(UserProfile.objects.get(user_id=doomed).is_premium)
+        self.assertFalse(SubscriptionPurchase.objects.filter(user_id=doomed).exists())
+
+        # Failed deletions still hold the user
+        UserDeletion.objects.filter(user_id=doomed).update(status='failed')
+        self.assertEqual(bulk_set_active([doomed], True), (0, [doomed]))
+        UserDeletion.objects.filter(user_id=doomed).update(status='done')
+        self.assertEqual(bulk_set_active([doomed], True), (1, []))
+
+
+class UserDeletionTests(TestCase):
+    databases = USER_DATABASES
+
+    def setUp(self):
+        self.user = User.objects.create_user('leaving', password='pw')
+        self.other = User.objects.create_user('staying', password='pw')
+        self.custom = Food.objects.create(user=self.user, name='stew', carbs=10, protein=8, fats=5, calories=200)
+        self.apple = Food.objects.create(name='apple', carbs=14, protein=0.3, fats=0.2, calories=52)
+        for food in (self.custom, self.apple):
+            for user in (self.user, self.other):
+                Consume.objects.create(user=user, food_consumed=food)
+        WeightLog.objects.create(user=self.user, weight=80)
+        WeightLog.objects.create(user=self.other, weight=70)
+
+    def test_steps_delete_the_users_rows_and_their_custom_foods(self):
+        get_platform_stats()
+        queue_user_deletions([self.user.pk])
+        self.assertGreater(count_user_rows(self.user.pk), 0)
+
+        with override_settings(USER_DELETION_BATCH_SIZE=1):
+            self.assertEqual(process_user_deletions(), (1, 0))
+
+        deletion = UserDeletion.objects.get(user_id=self.user.pk)
+        self.assertEqual(deletion.status, 'done')
+        self.assertEqual(deletion.rows_deleted, deletion.total_rows)
+        self.assertEqual(count_user_rows(self.user.pk), 0)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Food.objects.filter(pk=self.custom.pk).exists())
+
+        # The other user loses only the entry of the deleted custom food
+        self.assertEqual(
+            list(Consume.objects.filter(user=self.other).values_list('food_consumed_id', flat=True)), [self.apple.pk]
+        )
+        self.assertEqual(WeightLog.objects.filter(user=self.other).count(), 1)
+        stats = UserLifetimeStats.objects.get(user=self.other)
+        self.assertEqual((stats.total_entries, stats.total_calories, stats.distinct_foods), (1, 52, 1))
+        self.assertEqual(reconcile_platform_stats().total_users, 1)
+
+    def test_resumes_after_the_deadline(self):
+        queue_user_deletions([self.user.pk])
+        with override_settings(USER_DELETION_BATCH_SIZE=1, USER_DELETION_TIME_BUDGET=0):
+            self.assertEqual(process_user_deletions(), (0, 1))
+        self.assertEqual(UserDeletion.objects.get(user_id=self.user.pk).status, 'running')
+
+        self.assertEqual(process_user_deletions(), (1, 0))
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+
+
+class DirtyFieldsTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('eater', password='pw')
+        self.profile = UserProfile.objects.get(user=user)
+        self.saved_fields = []
+        post_save.connect(self.record_save, sender=UserProfile)
+        self.addCleanup(post_save.disconnect, self.record_save, sender=UserProfile)
+
+    def record_save(self, sender, update_fields=None, **kwargs):
+        self.saved_fields.append(sorted(update_fields or []))
+
+    def test_unchanged_save_writes_nothing(self):
+        self.profile.height = self.profile.height
+        with self.assertNumQueries(0):
+            self.profile.save()
+        self.assertEqual(self.saved_fields, [])
+
+    def test_save_writes_only_the_changed_fields(self):
+        self.profile.height = 180
+        self.profile.weight = 80
+        self.profile.save()
+        self.assertEqual(self.saved_fields, [['height', 'weight']])
+        self.assertFalse(self.profile.is_dirty())
+
+        # Other columns keep what the database has, not the stale instance's values
+        UserProfile.objects.filter(pk=self.profile.pk).update(daily_calorie_goal=1800)
+        self.profile.weight = 79
+        self.profile.save()
+        self.assertEqual(UserProfile.objects.get(pk=self.profile.pk).daily_calorie_goal, 1800)
+
+    def test_equal_values_of_another_type_are_clean(self):
+        self.profile.date_of_birth = date(1990, 1, 2)
+        self.profile.save()
+        self.profile.date_of_birth = '1990-01-02'
+        self.assertEqual(self.profile.get_dirty_fields(), [])
+
+    def test_explicit_update_fields_leave_the_rest_dirty(self):
+        self.profile.height = 180
+        self.profile.weight = 80
+        self.profile.save(update_fields=['height'])
+        self.assertEqual(self.saved_fields, [['height']])
+        self.assertEqual(self.profile.get_dirty_fields(), ['weight'])
+
+        self.profile.refresh_from_db(fields=['weight'])
+        self.assertFalse(self.profile.is_dirty())
+        self.assertIsNone(self.profile.weight)
+
+    def test_user_save_saves_a_loaded_profile_only_when_changed(self):
+        user = User.objects.get(username='eater')
+        user.save()
+        user.userprofile.save()
+        self.assertEqual(self.saved_fields, [])
+
+        user.userprofile.phone_number = '555'
+        user.save()
+        self.assertEqual(self.saved_fields, [['phone_number']])
+
+
+class UserContextTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('eater', password='pw')
+        self.today = timezone.localdate()
+
+    def test_session_user_comes_with_profile_streak_and_latest_weight(self):
+        WeightLog.objects.create(user=self.user, weight=81, date=self.today - timedelta(days=1))
+        latest = WeightLog.objects.create(user=self.user, weight=80, date=self.today)
+        # Backdated: logged last, but not the latest
+        WeightLog.objects.create(user=self.user, weight=82, date=self.today - timedelta(days=2))
+
+        with self.assertNumQueries(1):
+            user = UserContextBackend().get_user(self.user.pk)
+            self.assertEqual(user.userprofile.daily_calorie_goal, 2000)
+            self.assertEqual(get_user_streak(user).current_streak, 0)
+            weight = get_latest_weight(user)
+        self.assertEqual((weight.pk, weight.weight, weight.date), (latest.pk, 80, self.today))
+        self.assertEqual(weight.trend, WeightLog.objects.get(pk=latest.pk).trend)
+
+    def test_latest_weight_ties_go_to_the_last_logged(self):
+        WeightLog.objects.create(user=self.user, weight=81, date=self.today)
+        last = WeightLog.objects.create(user=self.user, weight=80, date=self.today)
+        self.assertEqual(get_latest_weight(UserContextBackend().get_user(self.user.pk)).pk, last.pk)
+        self.assertEqual(get_latest_weight(User.objects.get(pk=self.user.pk)).pk, last.pk)
+
+    def test_no_weigh_ins(self):
+        user = UserContextBackend().get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_latest_weight(user))
+
+    def test_missing_streak_is_created(self):
+        UserStreak.objects.filter(user=self.user).delete()
+        user = UserContextBackend().get_user(self.user.pk)
+        streak = get_user_streak(user)
+        self.assertEqual(streak.user_id, self.user.pk)
+        self.assertIs(get_user_streak(user), streak)
+
+    def test_inactive_users_are_not_loaded(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertIsNone(UserContextBackend().get_user(self.user.pk))
+
+    def test_request_context(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/')
+        context = response.wsgi_request.user_context
+        self.assertEqual(context.profile.user_id, self.user.pk)
+        self.assertFalse(context.is_premium)
+
+
+class ActivityTests(TestCase):
+    databases = USER_DATABASES
+
+    def setUp(self):
+        self.user = User.objects.create_user('eater', password='pw')
+        self.clear_buffers()
+        self.addCleanup(self.clear_buffers)
+
+    def clear_buffers(self):
+        activity._last_seen.clear()
+        activity._pending_days.clear()
+        activity._recorded_days.clear()
+
+    def flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return activity.flush_activity()
+
+    def test_flush_writes_the_latest_activity_once_per_day(self):
+        first = timezone.now() - timedelta(minutes=5)
+        activity.record_activity(self.user.pk, first)
+        activity.record_activity(self.user.pk, first + timedelta(minutes=1))
+        self.assertEqual(self.flush(), 1)
+
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.last_seen_at, first + timedelta(minutes=1))
+        self.assertEqual(DailyActiveUser.objects.filter(user=self.user).count(), 1)
+
+        # Same day again: only last_seen_at is written
+        activity.record_activity(self.user.pk)
+        self.assertFalse(activity._pending_days)
+        self.assertEqual(self.flush(), 1)
+        self.assertEqual(self.flush(), 0)
+
+    def test_failed_flush_puts_the_buffer_back(self):
+        seen = timezone.now() - timedelta(minutes=5)
+        activity.record_activity(self.user.pk, seen)
+        with mock.patch.object(DailyActiveUser.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.flush()
+        self.assertIsNone(UserProfile.objects.get(user=self.user).last_seen_at)
+        self.assertFalse(activity._recorded_days)
+
+        # Activity recorded in the meantime isn't overwritten by the older buffer
+        later = seen + timedelta(minutes=1)
+        activity.record_activity(self.user.pk, later)
+        self.assertEqual(self.flush(), 1)
+        self.assertEqual(UserProfile.objects.get(user=self.user).last_seen_at, later)
+        self.assertEqual(DailyActiveUser.objects.filter(user=self.user).count(), 1)
+
+    def test_deleted_users_dont_fail_the_flush(self):
+        gone = User.objects.create_user('gone', password='pw')
+        activity.record_activity(gone.pk)
+        activity.record_activity(self.user.pk)
+        gone.delete()
+        self.assertEqual(self.flush(), 2)
+        self.assertEqual(list(DailyActiveUser.objects.values_list('user_id', flat=True)), [self.user.pk])
+
+    def test_days_count_as_recorded_only_once_committed(self):
+        activity.record_activity(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=False):
+            activity.flush_activity()
+        self.assertFalse(activity._recorded_days)
+
+    @override_settings(ACTIVITY_FLUSH_THREAD=False)
+    def test_thread_can_be_turned_off(self):
+        with mock.patch.object(activity, '_flusher_pid', None), mock.patch('threading.Thread') as thread:
+            activity.record_activity(self.user.pk)
+        thread.assert_not_called()
+
+    def test_requests_record_activity(self):
+        self.client.force_login(self.user)
+        self.client.get('/')
+        self.assertIn(self.user.pk, activity._last_seen)
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        # As if REPLICA_MODE configured one; routers.py imports replica_configured by name
+        for target in ('myapp.replica.replica_configured', 'myapp.replica.replica_available',
+                       'myapp.routers.replica_configured'):
+            patcher = mock.patch(target, return_value=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+
+    def read_db(self):
+        return router.db_for_read(Food)
+
+    def serve(self, request, view):
+        return replica.ReplicaMiddleware(view)(request)
+
+    def test_reads_use_the_replica_only_when_asked(self):
+        self.assertEqual(self.read_db(), 'default')
+        with replica.use_replica():
+            self.assertEqual(self.read_db(), 'replica')
+            with replica.use_primary():
+                self.assertEqual(self.read_db(), 'default')
+            self.assertEqual(router.db_for_write(Food), 'default')
+
+    def test_reads_return_to_the_primary_after_a_write(self):
+        reads = []
+
+        def view(request):
+            with replica.use_replica():
+                reads.append(self.read_db())
+                router.db_for_write(Food)
+                reads.append(self.read_db())
+            return HttpResponse()
+
+        response = self.serve(self.factory.get('/'), view)
+        self.assertEqual(reads, ['replica', 'default'])
+        self.assertIn(replica.REPLICA_PIN_COOKIE, response.cookies)
+
+    @override_settings(REPLICA_STICKY_SECONDS=30)
+    def test_writers_stay_on_the_primary(self):
+        reads = []
+
+        def view(request):
+            with replica.use_replica():
+                reads.append(self.read_db())
+            return HttpResponse()
+
+        response = self.serve(self.factory.post('/'), view)
+        self.assertEqual(response.cookies[replica.REPLICA_PIN_COOKIE]['max-age'], 30)
+
+        request = self.factory.get('/')
+        request.COOKIES[replica.REPLICA_PIN_COOKIE] = '1'
+        response = self.serve(request, view)
+        self.serve(self.factory.get('/'), view)
+        # The POST itself read before writing anything; the pinned GET after it doesn't
+        self.assertEqual(reads, ['replica', 'default', 'replica'])
+        self.assertNotIn(replica.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_no_pin_without_a_replica(self):
+        with mock.patch('myapp.replica.replica_configured', return_value=False):
+            response = self.serve(self.factory.post('/'), lambda request: HttpResponse())
+        self.assertNotIn(replica.REPLICA_PIN_COOKIE, response.cookies)
+
+
+@override_settings(CONSUME_PARTITIONS=2, PARTITION_WEIGHT_LOG=True)
+class PartitionRoutingTests(SimpleTestCase):
+    # crc32 of the id modulo 2
+    EVEN, ODD = 4, 1
+
+    def test_partition_for_user_is_stable(self):
+        self.assertEqual(partition_aliases(), ['partition_0', 'partition_1'])
+        for user_id in range(1, 50):
+            self.assertEqual(partition_for_user(user_id), f'partition_{zlib.crc32(str(user_id).encode()) % 2}')
+        self.assertEqual((partition_for_user(self.EVEN), partition_for_user(self.ODD)), ('partition_0', 'partition_1'))
+
+    def test_queries_by_user_are_routed(self):
+        user = User(pk=self.ODD)
+        for queryset in (
+            Consume.objects.filter(user=user),
+            Consume.objects.filter(user_id=self.ODD, servings=1),
+            Consume.objects.filter(Q(user__id=self.ODD) & Q(servings=1)),
+            Consume.objects.filter(user__in=[self.ODD, 2]),
+            Consume.objects.filter(user_id=self.ODD).exclude(servings=2),
+            WeightLog.objects.filter(user=user),
+        ):
+            self.assertEqual(queryset.db, 'partition_1')
+        self.assertEqual(Consume.objects.using('partition_0').filter(user_id=self.ODD).db, 'partition_0')
+        self.assertEqual(router.db_for_write(Consume, instance=Consume(user_id=self.EVEN)), 'partition_0')
+        self.assertEqual(router.db_for_read(Consume, instance=user), 'partition_1')
+
+    def test_unrouted_queries_raise(self):
+        for queryset in (
+            Consume.objects.all(),
+            Consume.objects.filter(servings=1),
+            Consume.objects.filter(user__in=[self.EVEN, self.ODD]),
+            Consume.objects.filter(Q(user_id=self.EVEN) | Q(user_id=self.ODD)),
+            Consume.objects.exclude(user_id=self.ODD),
+        ):
+            with self.assertRaises(UnroutedQueryError):
+                queryset.db
+        self.assertEqual(Food.objects.all().db, 'default')
+
+    @override_settings(PARTITION_WEIGHT_LOG=False)
+    def test_weight_log_only_when_enabled(self):
+        self.assertEqual(WeightLog.objects.all().db, 'default')
+
+    def test_bulk_create_splits_by_partition(self):
+        calls = []
+
+        def bulk_create(queryset, objs, *args, **kwargs):
+            calls.append((queryset.db, [obj.user_id for obj in objs]))
+            return objs
+
+        entries = [Consume(user_id=user_id) for user_id in (self.EVEN, self.ODD, 5, 2)]
+        with mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=bulk_create):
+            created = Consume.objects.bulk_create(entries)
+            Consume.objects.using('partition_1').bulk_create(entries[:1])
+        self.assertEqual(calls, [
+            ('partition_0', [self.EVEN, 5]), ('partition_1', [self.ODD, 2]), ('partition_1', [self.EVEN]),
+        ])
+        self.assertEqual(len(created), 4)
+
+
+@skipUnless(
+    'partition_1' in settings.DATABASES, 'needs CONSUME_PARTITIONS=2 (and PARTITION_WEIGHT_LOG=1 for the weight log)'
+)
+class PartitionedFoodLogTests(TransactionTestCase):
+    databases = USER_DATABASES | set(partition_aliases())
+
+    def setUp(self):
+        users = [User.objects.create_user(f'user{n}', password='pw') for n in range(6)]
+        by_partition = {}
+        for user in users:
+            by_partition.setdefault(partition_for_user(user.pk), user)
+        self.even, self.odd = by_partition['partition_0'], by_partition['partition_1']
+        self.food = Food.objects.create(user=self.odd, name='stew', carbs=10, protein=8, fats=5, calories=200)
+        self.apple = Food.objects.create(name='apple', carbs=14, protein=0.3, fats=0.2, calories=52)
+
+    def rows(self, alias, user):
+        return Consume._base_manager.using(alias).filter(user_id=user.pk).count()
+
+    def test_rows_live_in_their_users_partition(self):
+        Consume.objects.create(user=self.even, food_consumed=self.apple)
+        Consume.objects.bulk_create([
+            Consume(user=self.even, food_consumed=self.apple), Consume(user=self.odd, food_consumed=self.apple),
+        ])
+        self.assertEqual((self.rows('partition_0', self.even), self.rows('partition_1', self.even)), (2, 0))
+        self.assertEqual((self.rows('partition_0', self.odd), self.rows('partition_1', self.odd)), (0, 1))
+        self.assertEqual(self.rows('default', self.even), 0)
+        self.assertEqual(self.even.consume_set.count(), 2)
+        # Joins into the attached main database
+        self.assertEqual(
+            list(Consume.objects.filter(user=self.odd).values_list('food_consumed__name', flat=True)), ['apple']
+        )
+
+    def test_deleting_a_food_deletes_its_entries_in_every_partition(self):
+        Consume.objects.create(user=self.even, food_consumed=self.food)
+        Consume.objects.create(user=self.odd, food_consumed=self.food)
+        Consume.objects.create(user=self.even, food_consumed=self.apple)
+        self.food.delete()
+        self.assertEqual((self.rows('partition_0', self.even), self.rows('partition_1', self.odd)), (1, 0))
+        self.assertEqual(UserLifetimeStats.objects.get(user=self.even).total_entries, 1)
+
+    def test_deleting_a_user_deletes_their_partitioned_rows(self):
+        Consume.objects.create(user=self.even, food_consumed=self.apple)
+        Consume.objects.create(user=self.odd, food_consumed=self.apple)
+        WeightLog.objects.create(user=self.even, weight=80)
+        self.even.delete()
+        self.assertEqual(self.rows('partition_0', self.even), 0)
+        self.assertFalse(WeightLog._base_manager.using('partition_0').filter(user_id=self.even.pk).exists())
+        self.assertEqual(self.rows('partition_1', self.odd), 1)
+
+    def test_queued_deletion_reaches_other_users_partitions(self):
+        # The even user logged the odd user's custom food
+        Consume.objects.create(user=self.even, food_consumed=self.food)
+        Consume.objects.create(user=self.odd, food_consumed=self.food)
+        queue_user_deletions([self.odd.pk])
+        self.assertEqual(process_user_deletions(), (1, 0))
+        self.assertEqual((self.rows('partition_0', self.even), self.rows('partition_1', self.odd)), (0, 0))
+        self.assertEqual(count_user_rows(self.odd.pk), 0)
+        self.assertEqual(UserLifetimeStats.objects.get(user=self.even).total_entries, 0)
+
+
+class FoodHistoryInvalidationTests(TestCase):
+    def setUp(self):
+        self.eater = User.objects.create_user('eater', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.bread = Food.objects.create(name='bread', carbs=50, protein=9, fats=3, calories=265)
+        self.rice = Food.objects.create(name='rice', carbs=28, protein=3, fats=0.3, calories=130)
+        Consume.objects.create(user=self.eater, food_consumed=self.bread, servings=2)
+        Consume.objects.create(user=self.other, food_consumed=self.rice)
+        self.cached = {user.pk: history.get_history(user.pk) for user in (self.eater, self.other)}
+
+    def assertCached(self, user, cached=True):
+        self.assertEqual(history.get_history(user.pk) is self.cached[user.pk], cached)
+
+    def test_renaming_a_food_keeps_histories(self):
+        self.bread.name = 'sourdough'
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.bread.save()
+        self.assertEqual(callbacks, [])
+        self.assertCached(self.eater)
+
+    def test_nutrient_change_invalidates_only_its_eaters(self):
+        self.bread.calories = 250
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bread.save()
+        self.assertCached(self.eater, False)
+        self.assertCached(self.other)
+        self.assertEqual(history.get_history(self.eater.pk).column('calories').tolist(), [500])
+        # Saving again without a change does nothing
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.bread.save()
+        self.assertEqual(callbacks, [])
+
+
+class PackEntriesTests(SimpleTestCase):
+    def entry(self, notes, **fields):
+        values = dict(
+            food_id=7, meal_type='lunch', servings=1.5, time=time(12, 30, 15, 250),
+            calories=120.0, carbs=20.5, protein=3.25, fats=1.0, notes=notes,
+        )
+        values.update(fields)
+        return archive.PackedEntry(**values)
+
+    def test_round_trip(self):
+        entries = [
+            self.entry(None),
+            self.entry(''),
+            self.entry('grünes Müsli 🍎', meal_type='breakfast', time=time(0, 0)),
+            self.entry('late', food_id=2 ** 40, meal_type='dinner', time=time(23, 59, 59, 999999)),
+        ]
+        self.assertEqual(archive.unpack_entries(archive.pack_entries(entries)), entries)
+
+    def test_none_and_empty_notes_stay_distinct(self):
+        unpacked = archive.unpack_entries(archive.pack_entries([self.entry(None), self.entry('')]))
+        self.assertIsNone(unpacked[0].notes)
+        self.assertEqual(unpacked[1].notes, '')
+
+    def test_unknown_meal_type_is_stored_as_snack(self):
+        [unpacked] = archive.unpack_entries(archive.pack_entries([self.entry(None, meal_type='brunch')]))
+        self.assertEqual(unpacked.meal_type, 'snack')
+
+    def test_empty(self):
+        self.assertEqual(archive.unpack_entries(archive.pack_entries([])), [])
+        self.assertEqual(archive.unpack_entries(b''), [])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            archive.unpack_entries(bytes([archive.FORMAT_VERSION + 1]))
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('eater', password='pw')
+        self.apple = Food.objects.create(user=self.user, name='apple', carbs=14, protein=0.3, fats=0.2, calories=52)
+        self.bread = Food.objects.create(user=self.user, name='bread', carbs=49, protein=9, fats=3.2, calories=265)
+        self.today = timezone.localdate()
+        self.old = self.today - timedelta(days=400)
+        self.cutoff = archive.archive_cutoff(self.today)
+
+    def log(self, food, day, at, **fields):
+        return Consume.objects.create(
+            user=self.user, food_consumed=food, date_consumed=day, time_consumed=at, **fields
+        )
+
+    def archived_count(self):
+        return sum(ConsumeArchiveDay.objects.filter(user=self.user).values_list('entry_count', flat=True))
+
+    def test_moves_old_entries(self):
+        self.log(self.apple, self.old, time(8, 0), notes='ü')
+        self.log(self.bread, self.old, time(12, 0), servings=2)
+        self.log(self.apple, self.today, time(9, 0))
+
+        moved = archive.archive_user_entries(self.user.pk, Consume.objects.filter(user=self.user).db, self.cutoff)
+
+        self.assertEqual(moved, 2)
+        self.assertEqual(Consume.objects.filter(user=self.user).count(), 1)
+        day = ConsumeArchiveDay.objects.get(user=self.user, date=self.old)
+        self.assertEqual(day.entry_count, 2)
+        self.assertAlmostEqual(day.calories, 52 + 2 * 265)
+        self.assertEqual(day.food_ids, f',{self.apple.pk},{self.bread.pk},')
+
+    def test_rerun_after_partial_archive(self):
+        self.log(self.apple, self.old, time(8, 0), notes='')
+        self.log(self.bread, self.old, time(12, 0))
+        self.log(self.bread, self.old + timedelta(days=1), time(12, 0))
+        using = Consume.objects.filter(user=self.user).db
+        # A run that merged the first day into the archive but stopped before
+        # deleting the hot rows
+        rows = Consume.objects.filter(user=self.user, date_consumed=self.old).order_by('time_consumed')
+        archive._merge_day(self.user.pk, self.old, [
+            archive.PackedEntry(
+                row.food_consumed_id, row.meal_type, row.servings, row.time_consumed,
+                row.food_consumed.calories, row.food_consumed.carbs, row.food_consumed.protein,
+                row.food_consumed.fats, row.notes,
+            )
+            for row in rows
+        ])
+
+        archive.archive_user_entries(self.user.pk, using, self.cutoff)
+        self.assertEqual(archive.archive_user_entries(self.user.pk, using, self.cutoff), 0)
+
+        self.assertFalse(Consume.objects.filter(user=self.user, date_consumed__lt=self.cutoff).exists())
+        self.assertEqual(self.archived_count(), 3)
+        day = ConsumeArchiveDay.objects.get(user=self.user, date=self.old)
+        self.assertEqual(day.entry_count, 2)
+        self.assertAlmostEqual(day.calories, 52 + 265)
+
+    def test_iter_entries_merges_hot_and_archived(self):
+        self.log(self.bread, self.old, time(12, 0))
+        self.log(self.apple, self.old + timedelta(days=2), time(7, 0))
+        archive.archive_user_entries(self.user.pk, Consume.objects.filter(user=self.user).db, self.cutoff)
+        # Hot entries that sort before, between and after the archived ones
+        self.log(self.apple, self.old, time(8, 0))
+        self.log(self.bread, self.old + timedelta(days=1), time(9, 0))
+        self.log(self.apple, self.old + timedelta(days=2), time(18, 0))
+        self.log(self.bread, self.today, time(9, 0))
+
+        entries = list(archive.iter_entries(self.user.pk))
+
+        self.assertEqual(
+            [(entry.date_consumed, entry.time_consumed, entry.pk is None) for entry in entries],
+            [
+                (self.old, time(8, 0), False),
+                (self.old, time(12, 0), True),
+                (self.old + timedelta(days=1), time(9, 0), False),
+                (self.old + timedelta(days=2), time(7, 0), True),
+                (self.old + timedelta(days=2), time(18, 0), False),
+                (self.today, time(9, 0), False),
+            ],
+        )
+        self.assertEqual(entries[1].food_consumed.name, 'bread')
+
+    def test_archived_entries_outlive_their_food(self):
+        self.log(self.bread, self.old, time(12, 0))
+        archive.archive_user_entries(self.user.pk, Consume.objects.filter(user=self.user).db, self.cutoff)
+        self.bread.delete()
+
+        [entry] = archive.iter_entries(self.user.pk)
+        self.assertEqual(entry.food_consumed.name, 'Deleted food')
+        self.assertEqual(entry.food_consumed.calories, 265)
+
+
+class EnergyRefreshTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('eater', password='pw')
+        self.food = Food.objects.create(user=self.user, name='apple', carbs=14, protein=0.3, fats=0.2, calories=52)
+
+    def test_one_queue_write_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            for _ in range(3):
+                Consume.objects.create(user=self.user, food_consumed=self.food)
+            WeightLog.objects.create(user=self.user, weight=80)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(list(EnergyRefresh.objects.values_list('user_id', flat=True)), [self.user.pk])
+        self.assertFalse(EnergyEstimate.objects.filter(user=self.user).exists())
+
+        self.assertEqual(energy.refresh_queued_estimates(), 1)
+        self.assertTrue(EnergyEstimate.objects.filter(user=self.user).exists())
+        self.assertFalse(EnergyRefresh.objects.exists())
+
+    def test_next_transaction_queues_again(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Consume.objects.create(user=self.user, food_consumed=self.food)
+        EnergyRefresh.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Consume.objects.create(user=self.user, food_consumed=self.food)
+        self.assertEqual(len(callbacks), 1)
+        self.assertTrue(EnergyRefresh.objects.filter(user=self.user).exists())
+
+    def test_rolled_back_savepoint_drops_only_its_users(self):
+        rolled_back = User.objects.create_user('rolled back', password='pw')
+        later = User.objects.create_user('later', password='pw')
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    energy.schedule_refresh(rolled_back.pk)
+                    raise ValueError
+            except ValueError:
+                pass
+            energy.schedule_refresh(later.pk)
+            try:
+                with transaction.atomic():
+                    energy.schedule_refresh(self.user.pk)
+                    energy.schedule_refresh(rolled_back.pk)
+                    raise ValueError
+            except ValueError:
+                pass
+            with transaction.atomic():
+                energy.schedule_refresh(self.user.pk)
+        self.assertEqual(
+            set(EnergyRefresh.objects.values_list('user_id', flat=True)), {self.user.pk, later.pk}
+        )
+
+
+class ServingSizeTests(TestCase):
+    def setUp(self):
+        self.food = Food.objects.create(name='rice', carbs=28, protein=2.7, fats=0.3, calories=130)
+
+    def test_update_fields_saves_serving_grams(self):
+        self.food.serving_size = '1 cup (185g)'
+        self.food.save(update_fields=['serving_size'])
+
+        food = Food.objects.get(pk=self.food.pk)
+        self.assertEqual(food.serving_grams, 185)
+        self.assertEqual(list(food.serving_units.values_list('name', 'grams')), [('cup', 185)])
+
+    def test_other_update_fields_leave_the_serving_alone(self):
+        self.food.serving_size = '1 cup (185g)'
+        self.food.name = 'white rice'
+        self.food.save(update_fields=['name'])
+
+        food = Food.objects.get(pk=self.food.pk)
+        self.assertEqual((food.name, food.serving_size, food.serving_grams), ('white rice', '100g', 100))
+        self.assertFalse(food.serving_units.exists())
+
+
+class ParseRangeTests(SimpleTestCase):
+    today = date(2024, 6, 30)
+
+    def parse(self, first_day=None, **params):
+        return parse_range(params, lambda: first_day, default_days=30, today=self.today)
+
+    def test_presets(self):
+        self.assertEqual(self.parse(range='30'), (date(2024, 6, 1), self.today, '30'))
+        self.assertEqual(self.parse(days='7'), (date(2024, 6, 24), self.today, ''))
+        self.assertEqual(self.parse(date(2024, 1, 1), range='all'), (date(2024, 1, 1), self.today, 'all'))
+
+    def test_explicit_range(self):
+        self.assertEqual(self.parse(start='2024-03-01', end='2024-02-01'), (date(2024, 2, 1), date(2024, 3, 1), ''))
+
+    def test_bad_values_give_the_default(self):
+        for params in ({'start': 'bad'}, {'days': 'abc'}, {}):
+            with self.subTest(params=params):
+                self.assertEqual(self.parse(**params), (date(2024, 6, 1), self.today, '30'))
+
+    def test_strict_rejects_bad_values(self):
+        for params in ({'start': 'bad'}, {'days': 'abc'}, {'start': '2024-01-01', 'end': '2024-02-30'}):
+            with self.subTest(params=params), self.assertRaises(ValueError):
+                parse_range(params, lambda: None, today=self.today, strict=True)
+        self.assertEqual(parse_range({}, lambda: None, default_days=30, today=self.today, strict=True)[0], date(2024, 6, 1))
+
+    def test_ranges_start_at_min_date(self):
+        self.assertEqual(self.parse(start='0001-01-01', end='0001-01-05'), (MIN_DATE, MIN_DATE, ''))
+        self.assertEqual(self.parse(date(1, 1, 1), range='all')[0], MIN_DATE)
+        start, end, _ = self.parse(start='0001-01-01', end='9999-12-31')
+        self.assertEqual((end - start).days, MAX_RANGE_DAYS - 1)
+
+
+class LttbTests(SimpleTestCase):
+    def test_short_series_is_kept(self):
+        self.assertEqual(list(lttb(range(5), [1, 2, 3, 4, 5], 10)), [0, 1, 2, 3, 4])
+
+    def test_threshold_below_three_keeps_everything(self):
+        self.assertEqual(len(lttb(range(50), range(50), 2)), 50)
+
+    def test_keeps_ends_and_peaks(self):
+        y = np.zeros(1000)
+        y[500] = 100
+        y[750] = -100
+        kept = lttb(np.arange(1000), y, 20)
+        self.assertEqual(len(kept), 20)
+        self.assertEqual((kept[0], kept[-1]), (0, 999))
+        self.assertIn(500, kept)
+        self.assertIn(750, kept)
+        self.assertTrue(np.all(np.diff(kept) > 0))
+
+
+class WeightTrendTests(SimpleTestCase):
+    def step_by_step(self, weights, day_gaps):
+        trend = weights[0]
+        trends = []
+        for weight, gap in zip(weights, day_gaps):
+            keep = (1 - ALPHA) ** min(max(gap, 1), 365)
+            trend = keep * trend + (1 - keep) * weight
+            trends.append(trend)
+        return trends
+
+    def test_gaps(self):
+        self.assertEqual(list(gaps([10, 11, 11, 15])), [0, 1, 0, 4])
+        self.assertEqual(list(gaps([10, 12], seed_day=7)), [3, 2])
+
+    def test_matches_the_recurrence(self):
+        rng = np.random.default_rng(0)
+        weights = 80 + rng.normal(0, 1, 300)
+        day_gaps = rng.integers(0, 5, 300)
+        np.testing.assert_allclose(smooth(weights, day_gaps), self.step_by_step(weights, day_gaps))
+
+    def test_long_history_stays_finite(self):
+        # Long enough to need several blocks
+        weights = np.full(20000, 70.0)
+        trends = smooth(weights, np.ones(20000), seed=90.0)
+        self.assertTrue(np.all(np.isfinite(trends)))
+        self.assertAlmostEqual(trends[-1], 70.0)
+
+    def test_seed(self):
+        [trend] = smooth([80.0], [1], seed=70.0)
+        self.assertAlmostEqual(trend, 71.0)
+
+
+class NutrientVectorTests(SimpleTestCase):
+    def test_arithmetic(self):
+        a = NutrientVector(100, 10, 5, 2)
+        b = NutrientVector(50, 4, 1, 1)
+        self.assertEqual(a + b, NutrientVector(150, 14, 6, 3))
+        self.assertEqual(a - b, NutrientVector(50, 6, 4, 1))
+        self.assertEqual(a * 1.5, NutrientVector(150, 15, 7.5, 3))
+        self.assertEqual(2 * b, NutrientVector(100, 8, 2, 2))
+        self.assertEqual(a / 4, NutrientVector(25, 2.5, 1.25, 0.5))
+        self.assertEqual(a, NutrientVector(100, 10, 5, 2))
+        self.assertNotEqual(a, (100, 10, 5, 2))
+
+    def test_in_place(self):
+        total = NutrientVector()
+        same = total
+        total += NutrientVector(1, 2, 3, 4)
+        total.add_scaled(Food(calories=200, carbs=20, protein=10, fats=5), 0.5)
+        self.assertIs(total, same)
+        self.assertEqual(total, NutrientVector(101, 12, 8, 6.5))
+
+    def test_of_a_food_times_servings(self):
+        food = Food(calories=52, carbs=14, protein=0.3, fats=0.2)
+        self.assertEqual(NutrientVector.of(food, 3), NutrientVector(156, 42, 0.3 * 3, 0.2 * 3))
+        self.assertEqual(NutrientVector.of(food).rounded(0), NutrientVector(52, 14, 0, 0))
+
+    def test_reads_like_a_dict(self):
+        vector = NutrientVector(100, 10, 5, 2)
+        self.assertEqual(vector['protein'], 5)
+        self.assertEqual(vector.as_dict('total_'), {
+            'total_calories': 100, 'total_carbs': 10, 'total_protein': 5, 'total_fats': 2,
+        })
+        with self.assertRaises(KeyError):
+            vector['fiber']
+
+    def test_from_array(self):
+        self.assertEqual(NutrientVector.from_array([[1, 2, 3, 4], [10, 20, 30, 40]]), NutrientVector(11, 22, 33, 44))
+        self.assertEqual(NutrientVector.from_array([1, 2, 3, 4]), NutrientVector(1, 2, 3, 4))
+        self.assertEqual(NutrientVector.from_array(np.empty((0, 4))), NutrientVector())
+
+
+class NutrientTotalsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('eater', password='pw')
+        self.rice = Food.objects.create(name='rice', carbs=28, protein=3, fats=0.5, calories=130, serving_size='100g')
+        self.oil = Food.objects.create(
+            name='oil', carbs=0, protein=0, fats=14, calories=120, serving_size='1 tbsp (14g)',
+        )
+
+    def test_food_log_totals_times_servings(self):
+        Consume.objects.create(user=self.user, food_consumed=self.rice, servings=2)
+        Consume.objects.create(user=self.user, food_consumed=self.oil, servings=0.5)
+        entries = Consume.objects.filter(user=self.user)
+        expected = NutrientVector(320, 56, 6, 8)
+        self.assertEqual(NutrientVector.total(entries, 'food_consumed__', 'servings'), expected)
+        array = nutrient_array(entries.order_by('pk'), 'food_consumed__', 'servings')
+        self.assertEqual(array.tolist(), [[260, 56, 6, 1], [60, 0, 0, 7]])
+        self.assertEqual(NutrientVector.from_array(array), expected)
+
+    def test_empty_total_is_zero(self):
+        entries = Consume.objects.filter(user=self.user)
+        self.assertEqual(NutrientVector.total(entries, 'food_consumed__', 'servings'), NutrientVector())
+
+    def test_recipe_scales_grams_to_servings(self):
+        recipe = Recipe.objects.create(user=self.user, name='fried rice', instructions='fry', preparation_time=10)
+        RecipeIngredient.objects.create(recipe=recipe, food=self.rice, quantity=250)
+        RecipeIngredient.objects.create(recipe=recipe, food=self.oil, quantity=7)
+        self.assertEqual(recipe.calculate_nutrition(), NutrientVector(385, 70, 7.5, 8.25))
+
+
+class SeriesPointsTests(SimpleTestCase):
+    def test_points(self):
+        self.assertEqual(series_points({'points': '5'}), 5)
+        self.assertEqual(series_points({'points': '1'}), 3)
+        self.assertEqual(series_points({'points': '999999'}), MAX_POINTS)
+        with self.settings(CHART_POINTS=120):
+            self.assertEqual(series_points({}), 120)
+        with self.assertRaises(ValueError):
+            series_points({'points': 'many'})
@@ -0,0 +1,111 @@
+"""
+Request-scoped user context
+
+A typical page needs the user, their profile (premium badge and avatar in
+base.html, require_premium, calorie goal), their streak and their latest
+weight. UserContextBackend loads all four in the one query that resolves
+request.user: the profile and streak are joined in with select_related and
+the latest WeightLog is pulled in through subquery annotations.
+UserContextMiddleware exposes them as request.user_context, so views and
+templates share the same objects instead of querying each one again.
+"""
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.db.models import OuterRef, Subquery
+from django.utils.functional import cached_property
+
+from .partitions import is_partitioned
+
+
+def user_context_queryset():
+    from .models import WeightLog
+
+    users = User.objects.select_related('userprofile', 'streak')
+    if is_partitioned(WeightLog):
+        # The weight log is in another database; get_latest_weight() queries it
+        return users
+    latest = WeightLog.objects.filter(user=OuterRef('pk')).order_by('-date', '-id')[:1]
+    return users.annotate(
+        latest_weight_id=Subquery(latest.values('id')),
+        latest_weight_value=Subquery(latest.values('weight')),
+        latest_weight_date=Subquery(latest.values('date')),
+        latest_weight_trend=Subquery(latest.values('trend')),
+    )
+
+
+def get_latest_weight(user):
+    """The user's most recent WeightLog, from the request's context query when it was loaded that way"""
+    from .models import WeightLog
+
+    if 'latest_weight_id' not in user.__dict__:
+        return WeightLog.objects.filter(user=user).order_by('-date', '-id').first()
+    if user.latest_weight_id is None:
+        return None
+    return WeightLog(
+        id=user.latest_weight_id,
+        user=user,
+        weight=user.latest_weight_value,
+        date=user.latest_weight_date,
+        trend=user.latest_weight_trend,
+    )
+
+
+def get_user_streak(user):
+    """The user's streak tracker, reusing the joined row if there is one"""
+    from .models import UserStreak
+
+    try:
+        return user.streak
+    except UserStreak.DoesNotExist:
+        streak, _ = UserStreak.objects.get_or_create(user=user)
+        user.streak = streak
+        return streak
+
+
+class UserContextBackend(ModelBackend):
+    """ModelBackend whose session lookup loads the whole user context in one query"""
+
+    def get_user(self, user_id):
+        try:
+            user = user_context_queryset().get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+class UserContext:
+    """Per-request accessors; nothing is loaded until first used"""
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def user(self):
+        return self.request.user
+
+    @cached_property
+    def profile(self):
+        return self.user.userprofile
+
+    @cached_property
+    def streak(self):
+        return get_user_streak(self.user)
+
+    @cached_property
+    def latest_weight(self):
+        return get_latest_weight(self.user)
+
+    @cached_property
+    def is_premium(self):
+        return self.profile.is_premium_active()
+
+
+class UserContextMiddleware:
+    """Attach request.user_context; goes after AuthenticationMiddleware"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.user_context = UserContext(request)
+        return self.get_response(request)
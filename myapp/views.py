@@ -8,13 +8,37 @@ from django.contrib.auth.forms import PasswordChangeForm
 from django.utils import timezone
 from datetime import timedelta, datetime
 from django.db.models import Sum, Count
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_http_methods
+import csv
+import itertools
 import json
 import logging
-from .models import Food, Consume, UserProfile, WeightLog, MEAL_TYPE_CHOICES, SubscriptionPlan, SubscriptionPurchase, PaymentLog, MealPlan, MealPlanItem, UserStreak, Achievement, UserAchievement
+from .models import Food, Consume, UserProfile, WeightLog, MEAL_TYPE_CHOICES, SubscriptionPlan, SubscriptionPurchase, PaymentLog, MealPlan, MealPlanItem, UserStreak, Achievement, UserAchievement, ScheduledJob, UserDeletion, WebhookEvent, EnergyEstimate
 from .forms import SignUpForm
+from .pagination import KeysetPaginator, InvalidCursor
+from .search import search_users
+from .stats import get_platform_stats, get_active_subscription_plans, get_user_lifetime_stats
+from .activity import get_activity_summary
+from .audit import log_admin_action
+from .replica import read_from_replica
+from .analytics import build_analytics, parse_range
+from .history import get_history
+from .nutrients import NutrientVector
+from .servings import UNIT_GRAMS, servings_for
+from . import archive, charts
+from .deletion import is_pending_deletion, queue_user_deletion
+from .bulk import (
+    BULK_ACTIONS,
+    BULK_CHUNK_SIZE,
+    allowed_user_ids,
+    bulk_set_active,
+    bulk_grant_premium,
+    bulk_revoke_premium,
+    bulk_delete_users,
+)
 from django.db.models.functions import TruncDate
 from .subscription import (
     create_stripe_checkout_session,
@@ -39,7 +63,7 @@ def signup(request):
             if phone_number:
                 user.userprofile.phone_number = phone_number
                 user.userprofile.save()
-            login(request, user)
+            login(request, user, backend='myapp.user_context.UserContextBackend')
             messages.success(request, 'Welcome! Your account has been created successfully.')
             return redirect('dashboard')
         else:
@@ -78,9 +102,9 @@ def delete_consume(request, id):
     if not request.user.is_authenticated:
         return redirect('login')
         
-    consumed_food = Consume.objects.get(id=id)
-    # Make sure the user owns this consume object
-    if consumed_food.user != request.user:
+    # Only the user's own entries (which also picks their food log partition)
+    consumed_food = Consume.objects.filter(user=request.user, id=id).first()
+    if consumed_food is None:
         return redirect('index')
         
     if request.method == 'POST':
@@ -90,19 +114,14 @@ def delete_consume(request, id):
 
 @login_required
 def dashboard(request):
-    user_profile = request.user.userprofile
+    user_profile = request.user_context.profile
     today = timezone.now().date()
     
-    # Get daily calories and nutrients
-    today_consumption = Consume.objects.filter(
-        user=request.user,
-        date_consumed=today
-    ).select_related('food_consumed')
-    
-    daily_calories = sum(consume.food_consumed.calories for consume in today_consumption)
-    daily_carbs = sum(consume.food_consumed.carbs for consume in today_consumption)
-    daily_protein = sum(consume.food_consumed.protein for consume in today_consumption)
-    daily_fats = sum(consume.food_consumed.fats for consume in today_consumption)
+    # Get daily calories and nutrients, servings included, summed in SQL
+    today_totals = NutrientVector.total(
+        Consume.objects.filter(user=request.user, date_consumed=today), 'food_consumed__', 'servings',
+    )
+    daily_calories, daily_carbs, daily_protein, daily_fats = today_totals
     
     # Calculate calorie percentage
     calorie_percentage = min((daily_calories / user_profile.daily_calorie_goal * 100), 100)
@@ -111,7 +130,7 @@ def dashboard(request):
     goal_met = daily_calories >= user_profile.daily_calorie_goal * 0.9 and daily_calories <= user_profile.daily_calorie_goal * 1.1
     
     # Get or create user streak
-    user_streak, created = UserStreak.objects.get_or_create(user=request.user)
+    user_streak = request.user_context.streak
     
     # Get user achievements
     user_achievements = UserAchievement.objects.filter(user=request.user).select_related('achievement')[:6]
@@ -135,9 +154,13 @@ def dashboard(request):
     motivational_data = get_motivational_data(calorie_percentage, user_streak.current_streak)
     
     # Get latest weight and BMI
-    # First try to get weight from weight log, otherwise use profile weight
-    latest_weight = WeightLog.objects.filter(user=request.user).order_by('-date').first()
-    current_weight = latest_weight.weight if latest_weight else user_profile.weight
+    # First try to get weight from weight log, otherwise use profile weight.
+    # BMI uses the smoothed trend, so it doesn't jump with each weigh-in.
+    latest_weight = request.user_context.latest_weight
+    if latest_weight:
+        current_weight = latest_weight.trend if latest_weight.trend is not None else latest_weight.weight
+    else:
+        current_weight = user_profile.weight
     current_bmi = user_profile.calculate_bmi(current_weight)
     
     # Determine BMI category
@@ -154,37 +177,13 @@ def dashboard(request):
     
     # Get weekly average calories
     week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
-    
-    weekly_consumption = Consume.objects.filter(
-        user=request.user,
-        date_consumed__gte=week_ago
-    ).values('date_consumed').annotate(
-        daily_total=Sum('food_consumed__calories')
-    ).order_by('date_consumed')
-    
-    weekly_avg_calories = sum(day['daily_total'] for day in weekly_consumption) / 7 if weekly_consumption else 0
     
-    # Prepare data for charts - show last 14 days for better visualization
-    two_weeks_ago = today - timedelta(days=14)
-    calorie_history_data = Consume.objects.filter(
-        user=request.user,
-        date_consumed__gte=two_weeks_ago
-    ).values('date_consumed').annotate(
-        daily_total=Sum('food_consumed__calories')
-    ).order_by('date_consumed')
-    
-    calorie_history = list(calorie_history_data)
-    calorie_history_dates = [entry['date_consumed'].strftime('%b %d') for entry in calorie_history]
-    calorie_history_values = [entry['daily_total'] for entry in calorie_history]
+    weekly_totals = NutrientVector.total(
+        Consume.objects.filter(user=request.user, date_consumed__gte=week_ago), 'food_consumed__', 'servings',
+    )
+    weekly_avg_calories = weekly_totals.calories / 7
     
-    # Get weight history - show last 30 days
-    weight_history = WeightLog.objects.filter(
-        user=request.user,
-        date__gte=month_ago
-    ).order_by('date')
-    weight_history_dates = [entry.date.strftime('%b %d') for entry in weight_history]
-    weight_history_values = [entry.weight for entry in weight_history]
+    # The charts fetch their data from chart_data after the page loads
     
     # Get meals by type
     daily_meals = {}
@@ -206,12 +205,9 @@ def dashboard(request):
         'daily_carbs': daily_carbs,
         'daily_protein': daily_protein,
         'daily_fats': daily_fats,
-        'calorie_history_dates': calorie_history_dates,
-        'calorie_history_values': calorie_history_values,
-        'weight_history_dates': weight_history_dates,
-        'weight_history_values': weight_history_values,
         'daily_meals': daily_meals,
-        'foods': Food.objects.filter(user=request.user),
+        'foods': Food.objects.filter(user=request.user).prefetch_related('serving_units'),
+        'standard_units': UNIT_GRAMS,
         'today': today,
         # New stunning features
         'goal_met': goal_met,
@@ -221,11 +217,28 @@ def dashboard(request):
         'remaining_calories': remaining_calories,
         'meal_suggestions': meal_suggestions,
         'motivational_data': motivational_data,
+        # Fitted from the food and weight logs (see energy.py)
+        'energy_estimate': EnergyEstimate.objects.filter(user=request.user).first(),
     }
     
     return render(request, 'myapp/dashboard.html', context)
 
 
+@login_required
+@require_http_methods(["POST"])
+def apply_suggested_calories(request):
+    """Set the daily calorie goal to the one suggested by the energy estimate"""
+    estimate = EnergyEstimate.objects.filter(user=request.user).first()
+    if not estimate or not estimate.suggested_calories:
+        messages.error(request, 'There is no suggested calorie goal yet. Keep logging your meals and weight.')
+        return redirect('dashboard')
+    user_profile = request.user_context.profile
+    user_profile.daily_calorie_goal = estimate.suggested_calories
+    user_profile.save()
+    messages.success(request, f'Daily calorie goal set to {estimate.suggested_calories} kcal.')
+    return redirect('dashboard')
+
+
 def get_suggestion_reason(food, remaining_calories, daily_protein, daily_carbs, daily_fats):
     """Generate AI-like reason for food suggestion"""
     reasons = []
@@ -296,10 +309,12 @@ def add_meal(request):
     if request.method == 'POST':
         food_id = request.POST.get('food_consumed')
         meal_type = request.POST.get('meal_type')
-        servings = float(request.POST.get('servings', 1))
+        amount = float(request.POST.get('servings', 1))
         
         try:
             food = Food.objects.get(id=food_id, user=request.user)
+            # The amount may be given in grams, cups or the food's own units
+            servings = servings_for(food, amount, request.POST.get('unit'))
             Consume.objects.create(
                 user=request.user,
                 food_consumed=food,
@@ -339,7 +354,7 @@ def log_weight(request):
 
 @login_required
 def edit_profile(request):
-    user_profile = request.user.userprofile
+    user_profile = request.user_context.profile
     password_form = PasswordChangeForm(request.user)
     
     if request.method == 'POST':
@@ -366,6 +381,7 @@ def edit_profile(request):
             date_of_birth = request.POST.get('date_of_birth')
             activity_level = request.POST.get('activity_level')
             weight_goal = request.POST.get('weight_goal')
+            target_weight = request.POST.get('target_weight')
             daily_calorie_goal = request.POST.get('daily_calorie_goal')
             
             # Update User model (Username, Email, First Name, Last Name)
@@ -391,35 +407,17 @@ def edit_profile(request):
                 if phone_number is not None:
                     user_profile.phone_number = phone_number
 
-                # Store original values
-                original_values = {
-                    'height': user_profile.height,
-                    'weight': user_profile.weight,
-                    'date_of_birth': user_profile.date_of_birth,
-                    'activity_level': user_profile.activity_level,
-                    'weight_goal': user_profile.weight_goal,
-                    'daily_calorie_goal': user_profile.daily_calorie_goal
-                }
-                
                 # Set new values
                 user_profile.height = float(height) if height else None
                 user_profile.weight = float(weight) if weight else None
                 user_profile.date_of_birth = date_of_birth if date_of_birth else None
                 user_profile.activity_level = activity_level
                 user_profile.weight_goal = weight_goal
+                user_profile.target_weight = float(target_weight) if target_weight else None
                 user_profile.daily_calorie_goal = int(daily_calorie_goal)
                 
-                # Check if any values changed (including picture)
-                new_values = {
-                    'height': user_profile.height,
-                    'weight': user_profile.weight,
-                    'date_of_birth': user_profile.date_of_birth,
-                    'activity_level': user_profile.activity_level,
-                    'weight_goal': user_profile.weight_goal,
-                    'daily_calorie_goal': user_profile.daily_calorie_goal
-                }
-                
-                if original_values != new_values or 'profile_picture' in request.FILES:
+                # Only write if something changed (including picture and phone number)
+                if user_profile.is_dirty():
                     user_profile.save()
                     messages.success(request, 'Profile updated successfully!')
                 
@@ -442,6 +440,32 @@ def edit_profile(request):
     
     return render(request, 'myapp/edit_profile.html', context)
 
+
+class _Echo:
+    # csv.writer writes each row to this and we stream what it returns
+    def write(self, value):
+        return value
+
+
+@login_required
+def export_food_log(request):
+    """The user's whole food log as CSV, archived days included"""
+    writer = csv.writer(_Echo())
+    rows = (
+        [entry.date_consumed, entry.time_consumed.strftime('%H:%M'), entry.get_meal_type_display(),
+         entry.food_consumed.name, entry.servings, round(entry.food_consumed.calories * entry.servings),
+         round(entry.food_consumed.carbs * entry.servings, 1), round(entry.food_consumed.protein * entry.servings, 1),
+         round(entry.food_consumed.fats * entry.servings, 1), entry.notes or '']
+        for entry in archive.iter_entries(request.user.pk)
+    )
+    header = ['Date', 'Time', 'Meal', 'Food', 'Servings', 'Calories', 'Carbs (g)', 'Protein (g)', 'Fats (g)', 'Notes']
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in itertools.chain([header], rows)),
+        content_type='text/csv',
+    )
+    response['Content-Disposition'] = 'attachment; filename="food-log.csv"'
+    return response
+
 @login_required
 def add_food(request):
     if request.method == 'POST':
@@ -450,6 +474,7 @@ def add_food(request):
         protein = request.POST.get('protein')
         fats = request.POST.get('fats')
         calories = request.POST.get('calories')
+        serving_size = request.POST.get('serving_size', '').strip() or '100g'
         
         try:
             # Check if food item already exists for this user
@@ -462,7 +487,8 @@ def add_food(request):
                     carbs=carbs,
                     protein=protein,
                     fats=fats,
-                    calories=calories
+                    calories=calories,
+                    serving_size=serving_size
                 )
                 messages.success(request, f'Food item "{name}" has been added successfully!')
                 return redirect('add_food')
@@ -505,7 +531,7 @@ def subscription_plans(request):
     """
     # Get all active subscription plans
     plans = SubscriptionPlan.objects.filter(is_active=True).order_by('duration_days')
-    user_profile = request.user.userprofile
+    user_profile = request.user_context.profile
     
     context = {
         'plans': plans,
@@ -590,7 +616,7 @@ def subscription_status(request):
     """
     Display user's current subscription status
     """
-    user_profile = request.user.userprofile
+    user_profile = request.user_context.profile
     
     # Get user's subscription purchases
     subscriptions = SubscriptionPurchase.objects.filter(user=request.user).order_by('-created_at')
@@ -643,6 +669,15 @@ def stripe_webhook(request):
         if not event:
             return JsonResponse({'status': 'invalid_signature'}, status=400)
         
+        # Keep every event (audit database); Stripe retries deliveries, so
+        # events that were already processed are acknowledged and skipped
+        webhook_event, created = WebhookEvent.objects.get_or_create(
+            stripe_event_id=event['id'],
+            defaults={'event_type': event['type'], 'payload': json.loads(payload)},
+        )
+        if not created and webhook_event.status == 'processed':
+            return JsonResponse({'status': 'duplicate'}, status=200)
+        
         # Handle different event types
         if event['type'] == 'checkout.session.completed':
             session = event['data']['object']
@@ -654,6 +689,9 @@ def stripe_webhook(request):
                 logger.info(f"Webhook: Processed payment for session {session['id']}")
             except Exception as e:
                 logger.error(f"Webhook: Error processing payment: {str(e)}")
+                webhook_event.status = 'failed'
+                webhook_event.error = str(e)
+                webhook_event.save(update_fields=['status', 'error'])
                 return JsonResponse({'status': 'error'}, status=500)
         
         elif event['type'] == 'payment_intent.succeeded':
@@ -662,6 +700,9 @@ def stripe_webhook(request):
         elif event['type'] == 'customer.subscription.deleted':
             logger.info("Webhook: Subscription deleted")
         
+        webhook_event.status = 'processed'
+        webhook_event.processed_at = timezone.now()
+        webhook_event.save(update_fields=['status', 'processed_at'])
         return JsonResponse({'status': 'success'}, status=200)
     
     except Exception as e:
@@ -680,7 +721,7 @@ def meal_planner(request):
     """
     Meal planning tools - Premium feature only
     """
-    user_profile = request.user.userprofile
+    user_profile = request.user_context.profile
     
     # Get date from request or default to today
     date_str = request.GET.get('date')
@@ -700,12 +741,7 @@ def meal_planner(request):
     
     # Organize by meal type
     planned_meals = {}
-    nutrition_summary = {
-        'total_calories': 0,
-        'total_protein': 0,
-        'total_carbs': 0,
-        'total_fats': 0
-    }
+    planned_totals = NutrientVector()
     
     # Initialize all meal types
     for meal_type_code, meal_type_name in MealPlan.MEAL_TYPES:
@@ -721,9 +757,6 @@ def meal_planner(request):
         if meal_type in planned_meals:
             for item in plan.mealplanitem_set.all():
                 calories = item.food.calories * item.servings
-                protein = item.food.protein * item.servings
-                carbs = item.food.carbs * item.servings
-                fats = item.food.fats * item.servings
                 
                 planned_meals[meal_type]['items'].append({
                     'food': item.food,
@@ -735,10 +768,8 @@ def meal_planner(request):
                 planned_meals[meal_type]['calories'] += calories
                 
                 # Update totals
-                nutrition_summary['total_calories'] += calories
-                nutrition_summary['total_protein'] += protein
-                nutrition_summary['total_carbs'] += carbs
-                nutrition_summary['total_fats'] += fats
+                planned_totals.add_scaled(item.food, item.servings)
+    nutrition_summary = planned_totals.as_dict('total_')
 
     # Calculate calorie progress percentage
     calorie_percentage = min((nutrition_summary['total_calories'] / user_profile.daily_calorie_goal * 100), 100) if user_profile.daily_calorie_goal > 0 else 0
@@ -806,13 +837,12 @@ def meal_planner(request):
                     if not reasons:
                         reasons.append("Balanced")
                     
+                    suggested = NutrientVector.of(food, optimal_servings).rounded(1)
                     ai_suggestions.append({
                         'food': food,
                         'servings': optimal_servings,
+                        **suggested.as_dict('total_'),
                         'total_calories': int(food.calories * optimal_servings),
-                        'total_protein': round(food.protein * optimal_servings, 1),
-                        'total_carbs': round(food.carbs * optimal_servings, 1),
-                        'total_fats': round(food.fats * optimal_servings, 1),
                         'reason': reasons[0],
                         'all_reasons': reasons
                     })
@@ -928,11 +958,12 @@ def add_meal_plan(request):
         date_str = request.POST.get('date')
         meal_type = request.POST.get('meal_type')
         food_id = request.POST.get('food_consumed')
-        servings = float(request.POST.get('servings', 1))
+        amount = float(request.POST.get('servings', 1))
         
         try:
             date = datetime.strptime(date_str, '%Y-%m-%d').date()
             food = Food.objects.get(id=food_id, user=request.user)
+            servings = servings_for(food, amount, request.POST.get('unit'))
             
             # Get or create MealPlan for this user, date, and meal_type
             meal_plan, created = MealPlan.objects.get_or_create(
@@ -1015,31 +1046,29 @@ def delete_meal_plan_item(request, item_id):
 
 @login_required
 @require_premium
+@read_from_replica
 def generate_shopping_list(request):
     user = request.user
     start_date = timezone.now().date()
     end_date = start_date + timedelta(days=7)
     
-    # Get all meal plan items for the next 7 days
-    items = MealPlanItem.objects.filter(
+    # Servings and nutrients of each food planned for the next 7 days, summed in SQL
+    # (foods of the same name are one line of the list)
+    rows = MealPlanItem.objects.filter(
         meal_plan__user=user,
         meal_plan__date__range=[start_date, end_date]
-    ).select_related('food')
+    ).values('food__name').annotate(
+        quantity=Sum('servings'), **NutrientVector.aggregates('food__', 'servings'),
+    ).order_by('food__name')
     
-    # Aggregate ingredients
     shopping_list = {}
-    
-    for item in items:
-        food_name = item.food.name
-        if food_name in shopping_list:
-            shopping_list[food_name]['quantity'] += item.servings
-            shopping_list[food_name]['calories'] += item.food.calories * item.servings
-        else:
-            shopping_list[food_name] = {
-                'food': item.food,
-                'quantity': item.servings,
-                'calories': item.food.calories * item.servings
-            }
+    for row in rows:
+        nutrients = NutrientVector.from_aggregate(row)
+        shopping_list[row['food__name']] = {
+            'quantity': row['quantity'],
+            'nutrients': nutrients,
+            'calories': nutrients.calories,
+        }
             
     context = {
         'shopping_list': shopping_list,
@@ -1050,10 +1079,42 @@ def generate_shopping_list(request):
     return render(request, 'myapp/shopping_list.html', context)
 
 
+def _chart_etag(request, series):
+    if series not in charts.SERIES or not request.user.is_authenticated:
+        return None
+    try:
+        start, end = charts.series_range(series, request.user, request.GET)
+        points = charts.series_points(request.GET)
+    except ValueError:
+        # chart_data answers 400
+        return None
+    return charts.series_etag(series, request.user, start, end, points)
+
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_chart_etag)
+def chart_data(request, series):
+    """JSON for one dashboard chart (see charts.py)"""
+    if series not in charts.SERIES:
+        raise Http404('Unknown chart')
+    try:
+        start, end = charts.series_range(series, request.user, request.GET)
+        points = charts.series_points(request.GET)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse(charts.series_data(series, request.user, start, end, points))
+
+
+@login_required
+@read_from_replica
 def advanced_analytics(request):
-    """Advanced analytics page - redirects to dashboard with info message"""
-    return render(request, 'myapp/advanced_analytics.html')
+    """Rolling averages, weekday split, meal shares, goal adherence and weight over a date range"""
+    history = get_history(request.user.pk)
+    start, end, preset = parse_range(request.GET, history.first_day)
+    context = build_analytics(request.user, request.user_context.profile, history, start, end)
+    context['range_preset'] = preset
+    return render(request, 'myapp/advanced_analytics.html', context)
 
 
 # ============================================
@@ -1072,100 +1133,125 @@ def admin_required(view_func):
     return wrapper
 
 
+ADMIN_USER_SORTS = ['username', '-username', 'email', '-email', 'date_joined', '-date_joined', 'last_login', '-last_login']
+
+
+def get_admin_users_page(search_query, sort_by, cursor=None, direction='next'):
+    """Keyset-paginated page of users for the control panel list"""
+    # Base queryset
+    users = User.objects.select_related('userprofile').all()
+    
+    # Apply search filter (indexed prefix/fuzzy search, see search.py)
+    if search_query:
+        users = search_users(users, search_query)
+    
+    if sort_by not in ADMIN_USER_SORTS:
+        sort_by = '-date_joined'
+    
+    # Cursor pagination: seeks on (sort column, id) instead of COUNT + OFFSET
+    paginator = KeysetPaginator(users, sort_by, per_page=10, count_key=f'admin_users:{search_query}')
+    try:
+        return paginator.page(cursor, direction)
+    except InvalidCursor:
+        return paginator.page()
+
+
 @admin_required
+@read_from_replica
 def admin_dashboard(request):
     """Custom admin dashboard with user management"""
-    from django.core.paginator import Paginator
-    from django.db.models import Q
-    
     # Get search query
     search_query = request.GET.get('search', '')
     sort_by = request.GET.get('sort', '-date_joined')
     
-    # Base queryset
-    users = User.objects.select_related('userprofile').all()
-    
-    # Apply search filter
-    if search_query:
-        users = users.filter(
-            Q(username__icontains=search_query) |
-            Q(email__icontains=search_query) |
-            Q(first_name__icontains=search_query) |
-            Q(last_name__icontains=search_query)
-        )
-    
-    # Apply sorting
-    valid_sorts = ['username', '-username', 'email', '-email', 'date_joined', '-date_joined', 'last_login', '-last_login']
-    if sort_by in valid_sorts:
-        users = users.order_by(sort_by)
-    else:
-        users = users.order_by('-date_joined')
-    
     # Pagination
-    paginator = Paginator(users, 10)  # 10 users per page
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    page_obj = get_admin_users_page(
+        search_query,
+        sort_by,
+        cursor=request.GET.get('cursor'),
+        direction=request.GET.get('direction', 'next'),
+    )
     
-    # Stats
-    total_users = User.objects.count()
-    active_users = User.objects.filter(is_active=True).count()
-    premium_users = UserProfile.objects.filter(is_premium=True).count()
-    new_users_today = User.objects.filter(date_joined__date=timezone.now().date()).count()
+    # Stats (one cached counters row, see stats.py)
+    stats = get_platform_stats()
     
     # Check if currently impersonating
     is_impersonating = request.session.get('impersonator_id') is not None
     
     # Get subscription plans for premium assignment
-    subscription_plans = SubscriptionPlan.objects.filter(is_active=True)
+    subscription_plans = get_active_subscription_plans()
+    
+    # Periodic job timings for the scheduler panel
+    scheduled_jobs = ScheduledJob.objects.all()
     
     context = {
         'page_obj': page_obj,
         'search_query': search_query,
         'sort_by': sort_by,
-        'total_users': total_users,
-        'active_users': active_users,
-        'premium_users': premium_users,
-        'new_users_today': new_users_today,
+        'total_users': stats.total_users,
+        'active_users': stats.active_users,
+        'premium_users': stats.premium_users,
+        'new_users_today': stats.get_new_users_today(),
         'is_impersonating': is_impersonating,
         'subscription_plans': subscription_plans,
+        'scheduled_jobs': scheduled_jobs,
+        'user_deletions': UserDeletion.objects.all()[:10],
+        'bulk_actions': BULK_ACTIONS,
+        'activity': get_activity_summary(),
     }
     
     return render(request, 'myapp/admin_dashboard.html', context)
 
 
 @admin_required
+@read_from_replica
+def admin_stats_ajax(request):
+    """Lightweight JSON endpoint so the control panel can poll the stats header"""
+    stats = get_platform_stats()
+    return JsonResponse({
+        'total_users': stats.total_users,
+        'active_users': stats.active_users,
+        'premium_users': stats.premium_users,
+        'new_users_today': stats.get_new_users_today(),
+        'updated_at': stats.updated_at.isoformat(),
+        **{key: value for key, value in get_activity_summary().items() if key in ('dau', 'wau', 'mau')},
+    })
+
+
 @admin_required
+def admin_deletions_ajax(request):
+    """Progress of queued and recent user deletions, polled by the control panel"""
+    return JsonResponse({
+        'deletions': [
+            {
+                'id': deletion.id,
+                'username': deletion.username,
+                'status': deletion.status,
+                'current_step': deletion.current_step,
+                'rows_deleted': deletion.rows_deleted,
+                'total_rows': deletion.total_rows,
+                'progress': deletion.progress_percent,
+            }
+            for deletion in UserDeletion.objects.all()[:10]
+        ]
+    })
+
+
+@admin_required
+@admin_required
+@read_from_replica
 def admin_users_ajax(request):
     """AJAX endpoint for real-time user search, sort, and pagination"""
-    from django.core.paginator import Paginator
-    from django.db.models import Q
-    
     search_query = request.GET.get('search', '')
     sort_by = request.GET.get('sort', '-date_joined')
-    page_number = request.GET.get('page', 1)
-    
-    # Base queryset
-    users = User.objects.select_related('userprofile').all()
-    
-    # Apply search filter
-    if search_query:
-        users = users.filter(
-            Q(username__icontains=search_query) |
-            Q(email__icontains=search_query) |
-            Q(first_name__icontains=search_query) |
-            Q(last_name__icontains=search_query)
-        )
-    
-    # Apply sorting
-    valid_sorts = ['username', '-username', 'email', '-email', 'date_joined', '-date_joined', 'last_login', '-last_login']
-    if sort_by in valid_sorts:
-        users = users.order_by(sort_by)
-    else:
-        users = users.order_by('-date_joined')
     
     # Pagination
-    paginator = Paginator(users, 10)
-    page_obj = paginator.get_page(page_number)
+    page_obj = get_admin_users_page(
+        search_query,
+        sort_by,
+        cursor=request.GET.get('cursor'),
+        direction=request.GET.get('direction', 'next'),
+    )
     
     # Build user data
     users_data = []
@@ -1195,8 +1281,10 @@ def admin_users_ajax(request):
         'has_previous': page_obj.has_previous(),
         'has_next': page_obj.has_next(),
         'current_page': page_obj.number,
-        'total_pages': paginator.num_pages,
-        'total_count': paginator.count,
+        'total_pages': page_obj.total_pages,
+        'total_count': page_obj.total_count,
+        'prev_cursor': page_obj.prev_cursor,
+        'next_cursor': page_obj.next_cursor,
     })
 
 
@@ -1254,7 +1342,12 @@ def admin_edit_user(request, user_id):
         user.first_name = request.POST.get('first_name', '')
         user.last_name = request.POST.get('last_name', '')
         user.is_staff = request.POST.get('is_staff') == 'on'
-        user.is_active = request.POST.get('is_active') == 'on'
+        is_active = request.POST.get('is_active') == 'on'
+        if is_active and not user.is_active and is_pending_deletion(user.id):
+            # As in admin_toggle_user_status: a queued deletion keeps the user inactive
+            messages.error(request, 'This user is queued for deletion and stays inactive.')
+        else:
+            user.is_active = is_active
         
         # Update password if provided
         new_password = request.POST.get('password', '')
@@ -1293,6 +1386,11 @@ def admin_edit_user(request, user_id):
             
             user.userprofile.save()
         
+        log_admin_action(
+            request.user, 'edit_user', user,
+            is_staff=user.is_staff, is_active=user.is_active,
+            password_changed=bool(new_password), premium_plan=request.POST.get('premium_plan', ''),
+        )
         messages.success(request, f'User "{user.username}" updated successfully.')
         return redirect('admin_dashboard')
     
@@ -1319,9 +1417,10 @@ def admin_delete_user(request, user_id):
         messages.error(request, 'You cannot delete a superuser.')
         return redirect('admin_dashboard')
     
-    username = user.username
-    user.delete()
-    messages.success(request, f'User "{username}" deleted successfully.')
+    # The user is deactivated now; their data is removed in the background
+    queue_user_deletion(user, requested_by=request.user)
+    log_admin_action(request.user, 'delete_user', user)
+    messages.success(request, f'User "{user.username}" has been deactivated and queued for deletion.')
     return redirect('admin_dashboard')
 
 
@@ -1338,14 +1437,88 @@ def admin_toggle_user_status(request, user_id):
         messages.error(request, 'You cannot deactivate your own account.')
         return redirect('admin_dashboard')
     
+    if is_pending_deletion(user.id):
+        messages.error(request, 'This user is queued for deletion.')
+        return redirect('admin_dashboard')
+    
     user.is_active = not user.is_active
     user.save()
     
     status = 'activated' if user.is_active else 'deactivated'
+    log_admin_action(request.user, 'activate_user' if user.is_active else 'deactivate_user', user)
     messages.success(request, f'User "{user.username}" has been {status}.')
     return redirect('admin_dashboard')
 
 
+@admin_required
+@require_http_methods(["POST"])
+def admin_bulk_action(request):
+    """Apply an action to selected users, or to every user matching the search"""
+    action = request.POST.get('action')
+    select_all = request.POST.get('select_all_matching') == 'on'
+    
+    if select_all:
+        # Never "every user": select-all needs a search to narrow it
+        search_query = request.POST.get('search', '').strip()
+        if not search_query:
+            messages.error(request, 'Search for the users to apply this to, or select them individually.')
+            return redirect('admin_dashboard')
+        # Exact and prefix matches only: no fuzzy fallback for bulk changes
+        users = search_users(User.objects.all(), search_query, fuzzy=False)
+        user_ids = list(users.values_list('id', flat=True).iterator(chunk_size=BULK_CHUNK_SIZE))
+    else:
+        user_ids = [int(user_id) for user_id in request.POST.getlist('user_ids') if user_id.isdigit()]
+    
+    user_ids = allowed_user_ids(request.user, user_ids)
+    if not user_ids:
+        messages.error(request, 'No users selected.')
+        return redirect('admin_dashboard')
+    
+    if select_all and request.POST.get('confirm_count') != str(len(user_ids)):
+        # Show how many users the search matched and apply only once that count is confirmed
+        return render(request, 'myapp/admin_bulk_confirm.html', {
+            'action': action,
+            'action_label': dict(BULK_ACTIONS).get(action, action),
+            'premium_plan': request.POST.get('premium_plan', ''),
+            'search_query': search_query,
+            'matched_count': len(user_ids),
+        })
+    
+    skipped = []
+    if action == 'activate':
+        count, skipped = bulk_set_active(user_ids, True)
+        messages.success(request, f'Activated {count} users.')
+    elif action == 'deactivate':
+        count, _ = bulk_set_active(user_ids, False)
+        messages.success(request, f'Deactivated {count} users.')
+    elif action == 'grant_premium':
+        try:
+            plan = SubscriptionPlan.objects.get(id=request.POST.get('premium_plan'))
+        except (SubscriptionPlan.DoesNotExist, ValueError):
+            messages.error(request, 'Please choose a subscription plan.')
+            return redirect('admin_dashboard')
+        count, skipped = bulk_grant_premium(user_ids, plan)
+        messages.success(request, f'Assigned {plan.name} to {count} users.')
+    elif action == 'revoke_premium':
+        count = bulk_revoke_premium(user_ids)
+        messages.success(request, f'Removed premium from {count} users.')
+    elif action == 'delete':
+        count = bulk_delete_users(user_ids, requested_by=request.user)
+        messages.success(request, f'Queued {count} users for deletion.')
+    else:
+        messages.error(request, 'Unknown action.')
+        return redirect('admin_dashboard')
+    
+    if skipped:
+        # As in admin_toggle_user_status: a queued deletion keeps the user inactive and non-premium
+        names = list(User.objects.filter(id__in=skipped[:10]).values_list('username', flat=True))
+        more = f' and {len(skipped) - len(names)} more' if len(skipped) > len(names) else ''
+        messages.warning(request, f'Skipped {len(skipped)} users queued for deletion: {", ".join(names)}{more}.')
+    
+    log_admin_action(request.user, f'bulk_{action}', selected=len(user_ids), affected=count, skipped=len(skipped))
+    return redirect('admin_dashboard')
+
+
 @admin_required
 def impersonate_user(request, user_id):
     """Start impersonating a user - like Laravel's impersonate"""
@@ -1369,9 +1542,11 @@ def impersonate_user(request, user_id):
     original_admin_id = request.user.id
     original_admin_username = request.user.username
     
+    log_admin_action(request.user, 'impersonate_user', target_user)
+    
     # Log in as the target user
     from django.contrib.auth import login
-    login(request, target_user, backend='django.contrib.auth.backends.ModelBackend')
+    login(request, target_user, backend='myapp.user_context.UserContextBackend')
     
     # Restore the impersonator data AFTER login (since login may cycle session)
     request.session['impersonator_id'] = original_admin_id
@@ -1404,45 +1579,51 @@ def stop_impersonation(request):
     del request.session['impersonator_id']
     del request.session['impersonator_username']
     
+    log_admin_action(admin_user, 'stop_impersonation', request.user)
+    
     # Log back in as admin
     from django.contrib.auth import login
-    login(request, admin_user, backend='django.contrib.auth.backends.ModelBackend')
+    login(request, admin_user, backend='myapp.user_context.UserContextBackend')
     
     messages.success(request, 'You have returned to your admin account.')
     return redirect('admin_dashboard')
 
 
 @admin_required  
+@read_from_replica
 def admin_user_detail(request, user_id):
     """View detailed user information"""
+    # Profile, streak and precomputed lifetime stats in one joined query
+    users = User.objects.select_related('userprofile', 'streak', 'lifetime_stats')
     try:
-        user = User.objects.select_related('userprofile').get(id=user_id)
+        user = users.get(id=user_id)
     except User.DoesNotExist:
-        messages.error(request, 'User not found.')
-        return redirect('admin_dashboard')
+        # The user may be newer than the replica
+        user = users.using('default').filter(id=user_id).first()
+        if user is None:
+            messages.error(request, 'User not found.')
+            return redirect('admin_dashboard')
     
     # Get user stats
-    total_foods_logged = Consume.objects.filter(user=user).count()
-    total_calories = Consume.objects.filter(user=user).aggregate(
-        total=Sum('food_consumed__calories')
-    )['total'] or 0
+    lifetime_stats = get_user_lifetime_stats(user)
     
     # Get streak info
     try:
-        streak = UserStreak.objects.get(user=user)
+        streak = user.streak
     except UserStreak.DoesNotExist:
         streak = None
     
     # Get achievements
-    achievements = UserAchievement.objects.filter(user=user).select_related('achievement')
+    achievements = list(UserAchievement.objects.filter(user=user).select_related('achievement'))
     
     # Get recent activity
-    recent_logs = Consume.objects.filter(user=user).order_by('-date_consumed')[:10]
+    recent_logs = archive.recent_entries(user.pk, 10)
     
     context = {
         'view_user': user,
-        'total_foods_logged': total_foods_logged,
-        'total_calories': total_calories,
+        'lifetime_stats': lifetime_stats,
+        'total_foods_logged': lifetime_stats.total_entries,
+        'total_calories': lifetime_stats.total_calories,
         'streak': streak,
         'achievements': achievements,
         'recent_logs': recent_logs,
@@ -0,0 +1,208 @@
+"""
+Smoothed weight trend
+
+Weight swings by a kilogram or more from day to day with water and food,
+which hides the trend underneath. Each WeightLog stores `trend`, an
+exponentially weighted moving average of the weigh-ins up to and including
+it, in (date, id) order: every day since the weigh-in before moves the
+trend ALPHA of the way towards the new weight. After a gap of g days a
+weigh-in counts 1 - (1 - ALPHA)^g; a second weigh-in on the same day
+counts as a day of its own.
+
+An entry's trend depends on every entry before it, so the WeightLog
+signals (signals.py) keep it current with as little work as possible:
+- a new latest entry is one step from the trend of the entry before it;
+- a backdated entry, an edit of the date or weight, or a deletion
+  recomputes forward from the first affected day, seeded with the trend of
+  the entry before that day.
+Trends are written with plain UPDATEs, which don't send the signals again.
+
+The forward pass is vectorized. With k_i = (1 - ALPHA)^g_i the recurrence
+t_i = k_i t_(i-1) + (1 - k_i) w_i unrolls to
+t_i = K_i (t_0 + sum over j <= i of (1 - k_j) w_j / K_j), K_i = k_1 ... k_i,
+which is one cumulative sum of logs and one cumulative sum. 1 / K_i grows
+without bound over a long history, so the series is cut into blocks short
+enough to keep it representable, each seeded with the end of the one before.
+
+Rows written with bulk_create() have no trend until
+`python manage.py recompute_weight_trends` fills it in (it recomputes every
+user's from scratch, a batch of users per query); migration 0023 runs the
+same pass once for existing rows.
+"""
+import math
+
+import numpy as np
+from django.db import connections, transaction
+
+ALPHA = 0.1
+LOG_KEEP = math.log1p(-ALPHA)
+# After a year the old trend no longer counts (0.9^365 is about 2e-17);
+# capping gaps there also bounds each step's factor
+MAX_GAP_DAYS = 365
+# How far 1 / K may grow within a block; doubles overflow past e^709
+BLOCK_LOG = 600.0
+
+
+def gaps(days, seed_day=None):
+    """Days between consecutive ordinal days, the first counted from seed_day (0 without one)"""
+    days = np.asarray(days, dtype=np.int64)
+    previous = np.concatenate(([days[0] if seed_day is None else seed_day], days[:-1]))
+    return days - previous
+
+
+def smooth(weights, day_gaps, seed=None):
+    """
+    Trend after each weigh-in, given the days since the weigh-in before it
+    (for the first, since the seed's). Without a seed the trend starts at
+    the first weight.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    trends = np.empty_like(weights)
+    if not len(weights):
+        return trends
+    if seed is None:
+        seed = weights[0]
+    log_keep = np.clip(np.asarray(day_gaps), 1, MAX_GAP_DAYS) * LOG_KEEP
+    cumulative = np.cumsum(log_keep)
+    start = 0
+    while start < len(weights):
+        base = cumulative[start - 1] if start else 0.0
+        # One step is at most MAX_GAP_DAYS * -LOG_KEEP (about 38), so a block
+        # always takes at least one entry
+        end = int(np.searchsorted(-cumulative, BLOCK_LOG - base, side='right'))
+        log_k = cumulative[start:end] - base
+        gain = -np.expm1(log_keep[start:end])
+        trends[start:end] = np.exp(log_k) * (seed + np.cumsum(gain * weights[start:end] * np.exp(-log_k)))
+        seed = trends[end - 1]
+        start = end
+    return trends
+
+
+def _write_trends(model, using, ids, trends):
+    """
+    UPDATE the trends of entries by id in one executemany(). bulk_update()
+    builds a CASE expression per row, which costs more than the pass itself.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {table} SET trend = %s WHERE id = %s',
+            [(float(trend), entry_id) for entry_id, trend in zip(ids, trends)],
+        )
+
+
+def _normalized(instance):
+    """(date, weight) of a WeightLog, with a datetime default turned into its date"""
+    return instance._meta.get_field('date').to_python(instance.date), instance.weight
+
+
+def remember_loaded(instance):
+    """Called from post_init: the date and weight an edit has to be compared with"""
+    instance._trend_loaded = (instance.__dict__.get('date'), instance.__dict__.get('weight'))
+
+
+def recompute_from(user_id, day):
+    """
+    Recompute the trend of the user's entries from day on, seeded with the
+    entry before it. Returns {id: trend} of the recomputed entries.
+    """
+    from .models import WeightLog
+
+    entries = WeightLog.objects.filter(user_id=user_id)
+    seed = entries.filter(date__lt=day).order_by('-date', '-id').values_list('date', 'trend').first()
+    if seed and seed[1] is None:
+        # Entries without a trend yet (bulk_create()d): start from the first of them
+        day = entries.filter(trend__isnull=True).order_by('date', 'id').values_list('date', flat=True).first()
+        seed = entries.filter(date__lt=day).order_by('-date', '-id').values_list('date', 'trend').first()
+    rows = list(entries.filter(date__gte=day).order_by('date', 'id').values_list('id', 'date', 'trend', 'weight'))
+    if not rows:
+        return {}
+    ids, days, old_trends, weights = zip(*rows)
+    day_gaps = gaps([value.toordinal() for value in days], seed[0].toordinal() if seed else None)
+    trends = smooth(weights, day_gaps, seed[1] if seed else None)
+    changed = [
+        (entry_id, trend) for entry_id, old, trend in zip(ids, old_trends, trends.tolist())
+        if old is None or abs(old - trend) > 1e-9
+    ]
+    if changed:
+        # entries.db: the user filter routes to the user's partition
+        _write_trends(WeightLog, entries.db, *zip(*changed))
+    return dict(zip(ids, trends.tolist()))
+
+
+def record_saved(instance, created):
+    """Keep trends current after a WeightLog is saved"""
+    from django.db.models import Q
+
+    from .models import WeightLog
+
+    day, weight = _normalized(instance)
+    if not created:
+        loaded_day, loaded_weight = getattr(instance, '_trend_loaded', (None, None))
+        if loaded_day is not None:
+            loaded_day = instance._meta.get_field('date').to_python(loaded_day)
+        if (loaded_day, loaded_weight) == (day, weight):
+            # Notes only
+            return
+        trends = recompute_from(instance.user_id, min(day, loaded_day or day))
+        # A later save() of this instance writes its trend back too
+        instance.trend = trends.get(instance.pk, instance.trend)
+    else:
+        entries = WeightLog.objects.filter(user_id=instance.user_id)
+        if entries.filter(Q(date__gt=day) | Q(date=day, id__gt=instance.pk)).exists():
+            # Backdated
+            instance.trend = recompute_from(instance.user_id, day).get(instance.pk)
+        else:
+            seed = (
+                entries.filter(Q(date__lt=day) | Q(date=day, id__lt=instance.pk))
+                .order_by('-date', '-id').values_list('date', 'trend').first()
+            )
+            if seed and seed[1] is None:
+                instance.trend = recompute_from(instance.user_id, day).get(instance.pk)
+            else:
+                day_gaps = gaps([day.toordinal()], seed[0].toordinal() if seed else None)
+                trend = float(smooth([weight], day_gaps, seed[1] if seed else None)[0])
+                entries.filter(id=instance.pk).update(trend=trend)
+                instance.trend = trend
+    instance._trend_loaded = (day, weight)
+
+
+def record_deleted(instance):
+    recompute_from(instance.user_id, _normalized(instance)[0])
+
+
+def recompute_all(using, model=None, batch_size=500):
+    """
+    Recompute the trend of every entry in database using, loading a batch
+    of users' entries per query. model is the WeightLog model (migrations
+    pass theirs). Returns the number of entries written.
+    """
+    if model is None:
+        from .models import WeightLog as model
+
+    entries = model._base_manager.using(using)
+    user_ids = list(entries.order_by('user_id').values_list('user_id', flat=True).distinct())
+    written = 0
+    for offset in range(0, len(user_ids), batch_size):
+        rows = list(
+            entries.filter(user_id__in=user_ids[offset:offset + batch_size])
+            .order_by('user_id', 'date', 'id')
+            .values_list('user_id', 'id', 'date', 'weight')
+        )
+        if not rows:
+            continue
+        users, ids, days, weights = zip(*rows)
+        users = np.array(users)
+        days = np.fromiter((day.toordinal() for day in days), dtype=np.int64, count=len(days))
+        weights = np.array(weights, dtype=np.float64)
+        # Gaps over the whole batch at once; each user's first entry starts over
+        starts = np.flatnonzero(np.concatenate(([True], users[1:] != users[:-1])))
+        day_gaps = np.diff(days, prepend=days[0])
+        day_gaps[starts] = 0
+        trends = np.empty_like(weights)
+        for start, end in zip(starts, np.append(starts[1:], len(rows))):
+            trends[start:end] = smooth(weights[start:end], day_gaps[start:end])
+        _write_trends(model, using, ids, trends.tolist())
+        written += len(rows)
+    return written
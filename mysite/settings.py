@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
@@ -47,6 +48,9 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'myapp.user_context.UserContextMiddleware',
+    'myapp.activity.ActivityMiddleware',
+    'myapp.replica.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,6 +86,152 @@ DATABASES = {
     }
 }
 
+# SQLite tuned for concurrent use (DATABASE_PROFILE=production):
+# - WAL lets readers run while a writer commits; synchronous=NORMAL is
+#   durable against application crashes in WAL mode and avoids an fsync per commit
+# - 20 MB page cache, 128 MB memory-mapped reads, temp tables in memory
+# - writers take the write lock at BEGIN (IMMEDIATE) and wait up to `timeout`
+#   seconds for it instead of failing with "database is locked" mid-transaction
+# - connections are kept for 10 minutes instead of reopened per request
+SQLITE_PRODUCTION_OPTIONS = {
+    'timeout': 20,
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA cache_size=-20000;'
+        'PRAGMA mmap_size=134217728;'
+        'PRAGMA temp_store=MEMORY;'
+    ),
+}
+
+# Payment and audit tables (SubscriptionPurchase, PaymentLog, WebhookEvent,
+# AuditLog) can live in their own database so their writes don't take the
+# main database's write lock; see myapp/routers.py. SQLITE_AUDIT_DB names its
+# file (relative to BASE_DIR); unset, they stay in default. To switch over:
+#   1. deploy with SQLITE_AUDIT_DB unset and run `python manage.py migrate`
+#   2. SQLITE_AUDIT_DB=audit.sqlite3 python manage.py migrate --database=audit
+#      (migration 0025 copies the payment history from default)
+#   3. restart the app with SQLITE_AUDIT_DB=audit.sqlite3
+# Serving with it set before step 2 hides the payment history and fails
+# payment writes. `python manage.py move_audit_data` copies rows written to
+# default between steps 2 and 3; with --purge it then removes them from default.
+if os.environ.get('SQLITE_AUDIT_DB'):
+    DATABASES['audit'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / os.environ['SQLITE_AUDIT_DB'],
+    }
+DATABASE_ROUTERS = ['myapp.routers.AuditRouter', 'myapp.routers.PartitionRouter', 'myapp.routers.ReplicaRouter']
+
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'development')
+if DATABASE_PROFILE == 'production':
+    for alias in DATABASES:
+        DATABASES[alias].update({
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': SQLITE_PRODUCTION_OPTIONS,
+        })
+
+# PostgreSQL: set POSTGRES_DB (plus POSTGRES_USER, POSTGRES_PASSWORD,
+# POSTGRES_HOST, POSTGRES_PORT) to use it instead of SQLite. Needs
+# `pip install "psycopg[binary,pool]"`.
+#
+# POSTGRES_POOL chooses how connections are reused:
+#   persistent  (default) each worker keeps its connection for
+#               POSTGRES_CONN_MAX_AGE seconds, checked before reuse
+#   psycopg     an in-process psycopg_pool per worker, sized by
+#               POSTGRES_POOL_MIN_SIZE / POSTGRES_POOL_MAX_SIZE; keep
+#               workers x max size below the server's max_connections
+#   pgbouncer   connections go through PgBouncer in transaction pooling
+#               mode (point POSTGRES_HOST/PORT at it); server-side cursors
+#               don't survive transaction pooling, so they are turned off
+#               and .iterator() falls back to chunked client-side fetching
+if os.environ.get('POSTGRES_DB'):
+    POSTGRES_POOL = os.environ.get('POSTGRES_POOL', 'persistent')
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    # PostgreSQL has row-level locking, so the audit tables only move to a
+    # separate database when POSTGRES_AUDIT_DB names one. Its backend creates
+    # no foreign key constraints: they would point into the main database.
+    if os.environ.get('POSTGRES_AUDIT_DB'):
+        DATABASES['audit'] = {
+            **DATABASES['default'],
+            'ENGINE': 'myapp.audit_postgresql',
+            'NAME': os.environ['POSTGRES_AUDIT_DB'],
+        }
+    else:
+        DATABASES.pop('audit', None)
+    for database in DATABASES.values():
+        if POSTGRES_POOL == 'psycopg':
+            # Django hands connections back to the pool itself
+            database['CONN_MAX_AGE'] = 0
+            database['OPTIONS'] = {'pool': {
+                'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10)),
+                'timeout': 10,
+            }}
+        elif POSTGRES_POOL == 'pgbouncer':
+            database['DISABLE_SERVER_SIDE_CURSORS'] = True
+    # Trigram lookups for the admin user search (see myapp/search.py)
+    INSTALLED_APPS.append('django.contrib.postgres')
+
+# Food log partitioning (SQLite only, see myapp/partitions.py): with
+# CONSUME_PARTITIONS > 1, Consume rows (and WeightLog rows with
+# PARTITION_WEIGHT_LOG=1) are spread by user over that many SQLite files.
+# Migrate each one (`migrate --database=partition_0`, ...) and move existing
+# rows with `python manage.py rebalance_partitions`.
+CONSUME_PARTITIONS = int(os.environ.get('CONSUME_PARTITIONS', 1))
+PARTITION_WEIGHT_LOG = os.environ.get('PARTITION_WEIGHT_LOG') == '1'
+if CONSUME_PARTITIONS > 1 and DATABASES['default']['ENGINE'].endswith('sqlite3'):
+    for index in range(CONSUME_PARTITIONS):
+        DATABASES[f'partition_{index}'] = {
+            **{key: value for key, value in DATABASES['default'].items() if key != 'NAME'},
+            'NAME': BASE_DIR / f'partition_{index}.sqlite3',
+        }
+else:
+    CONSUME_PARTITIONS = 1
+
+# Food log entries older than this many days move into packed per-day rows
+# (see myapp/archive.py) nightly. Never less than 35 days.
+CONSUME_ARCHIVE_AFTER_DAYS = int(os.environ.get('CONSUME_ARCHIVE_AFTER_DAYS', 180))
+
+# Read replica for heavy read-only pages (see myapp/replica.py). REPLICA_MODE:
+#   off       (default) everything reads from default
+#   snapshot  a SQLite copy of default, refreshed every minute by the
+#             refresh_replica_snapshot job; for trying replica routing locally
+#   postgres  a streaming replica of the PostgreSQL database at
+#             POSTGRES_REPLICA_HOST (same name and credentials)
+# After a browser writes, its reads stay on default for REPLICA_STICKY_SECONDS,
+# which should cover the replica's lag.
+REPLICA_MODE = os.environ.get('REPLICA_MODE', 'off')
+REPLICA_SNAPSHOT = REPLICA_MODE == 'snapshot' and DATABASES['default']['ENGINE'].endswith('sqlite3')
+if REPLICA_SNAPSHOT:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'replica.sqlite3',
+        # A fresh connection per request, so a new snapshot is picked up
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {'init_command': 'PRAGMA query_only=1;'},
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_STICKY_SECONDS = 90
+elif REPLICA_MODE == 'postgres' and os.environ.get('POSTGRES_DB'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ.get('POSTGRES_REPLICA_HOST', DATABASES['default']['HOST']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_STICKY_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -126,6 +276,52 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Authentication settings
+# Loads the user with their profile, streak and latest weight in one query
+# (see myapp/user_context.py). ModelBackend stays listed: sessions store the
+# backend that logged them in, and ones created before UserContextBackend
+# would otherwise stop authenticating.
+AUTHENTICATION_BACKENDS = [
+    'myapp.user_context.UserContextBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Sessions
+# SESSION_MODE picks where session data lives:
+#   db              database only (default)
+#   cached_db       read from the cache, written through to the database, falls
+#                   back to the database on a cache miss
+#   signed_cookies  no server-side storage; data is signed but readable by the
+#                   client, so only for non-sensitive session contents
+# cached_db needs a cache shared by all workers (set REDIS_URL): with a
+# per-process cache, a logout in one worker leaves the session cached and
+# authenticating in the others. The system check refuses it without one.
+SESSION_MODE = os.environ.get('SESSION_MODE', 'db')
+SESSION_ENGINE = {
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'db': 'django.contrib.sessions.backends.db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESSION_MODE]
+# Expired sessions are purged in batches by the clear_expired_sessions job
+SESSION_PURGE_BATCH_SIZE = 1000
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
+# Memory per process for the columnar analytics histories (see myapp/history.py)
+ANALYTICS_HISTORY_CACHE_BYTES = int(os.environ.get('ANALYTICS_HISTORY_CACHE_BYTES', 32 * 1024 * 1024))
+# Longer chart series are downsampled to this many points (see myapp/charts.py)
+CHART_POINTS = 200
+
+# Background thread flushing the activity buffer (see myapp/activity.py). Off
+# under `manage.py test`: it, and its flush at exit, would outlive the test
+# database; tests call flush_activity() themselves.
+ACTIVITY_FLUSH_THREAD = os.environ.get('ACTIVITY_FLUSH_THREAD', '1') == '1' and sys.argv[1:2] != ['test']
+
 LOGIN_REDIRECT_URL = '/'
 LOGIN_URL = '/login/'
 # EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -33,6 +33,8 @@ urlpatterns = [
     path('add-meal/', views.add_meal, name='add_meal'),
     path('log-weight/', views.log_weight, name='log_weight'),
     path('profile/edit/', views.edit_profile, name='edit_profile'),
+    path('profile/export/food-log/', views.export_food_log, name='export_food_log'),
+    path('profile/apply-suggested-calories/', views.apply_suggested_calories, name='apply_suggested_calories'),
     
     # Subscription and Payment URLs
     path('subscription/plans/', views.subscription_plans, name='subscription_plans'),
@@ -49,6 +51,7 @@ urlpatterns = [
     path('meal-planner/delete/<int:item_id>/', views.delete_meal_plan_item, name='delete_meal_plan_item'),
     path('meal-planner/shopping-list/', views.generate_shopping_list, name='generate_shopping_list'),
     path('analytics/', views.advanced_analytics, name='advanced_analytics'),
+    path('charts/<slug:series>/', views.chart_data, name='chart_data'),
     
     # Password Reset URLs
     path('password-reset/', auth_views.PasswordResetView.as_view(template_name='myapp/password_reset_form.html'), name='password_reset'),
@@ -59,10 +62,13 @@ urlpatterns = [
     # Custom Admin Panel URLs
     path('control-panel/', views.admin_dashboard, name='admin_dashboard'),
     path('control-panel/users-ajax/', views.admin_users_ajax, name='admin_users_ajax'),
+    path('control-panel/stats/', views.admin_stats_ajax, name='admin_stats_ajax'),
+    path('control-panel/deletions/', views.admin_deletions_ajax, name='admin_deletions_ajax'),
     path('control-panel/add-user/', views.admin_add_user, name='admin_add_user'),
     path('control-panel/edit-user/<int:user_id>/', views.admin_edit_user, name='admin_edit_user'),
     path('control-panel/delete-user/<int:user_id>/', views.admin_delete_user, name='admin_delete_user'),
     path('control-panel/toggle-user/<int:user_id>/', views.admin_toggle_user_status, name='admin_toggle_user'),
+    path('control-panel/bulk-action/', views.admin_bulk_action, name='admin_bulk_action'),
     path('control-panel/user/<int:user_id>/', views.admin_user_detail, name='admin_user_detail'),
     path('control-panel/impersonate/<int:user_id>/', views.impersonate_user, name='impersonate_user'),
     path('stop-impersonation/', views.stop_impersonation, name='stop_impersonation'),